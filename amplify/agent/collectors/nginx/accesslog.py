@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+from collections import Counter, defaultdict
+
 from amplify.agent.collectors.abstract import AbstractCollector
 
 from amplify.agent.common.context import context
 from amplify.agent.pipelines.abstract import Pipeline
 from amplify.agent.pipelines.file import FileTail
+from amplify.agent.objects.nginx.filters import FilterIndex
 from amplify.agent.objects.nginx.log.access import NginxAccessLogParser
 
 
@@ -54,6 +57,32 @@ class NginxAccessLogsCollector(AbstractCollector):
         'nginx.upstream.request.count': None
     }
 
+    # variables of the log format that are read by registered methods ("*" means any variable with such prefix)
+    method_variables = {
+        'http_method': ('request_method',),
+        'http_status': ('status',),
+        'http_version': ('server_protocol',),
+        'request_length': ('request_length',),
+        'body_bytes_sent': ('body_bytes_sent',),
+        'bytes_sent': ('bytes_sent',),
+        'gzip_ration': ('gzip_ratio',),
+        'request_time': ('request_time',),
+        'upstreams': ('upstream*',),
+    }
+
+    # batch twins of registered methods (see aggregate)
+    batch_methods = {
+        'http_method': 'batch_http_method',
+        'http_status': 'batch_http_status',
+        'http_version': 'batch_http_version',
+        'request_length': 'batch_request_length',
+        'body_bytes_sent': 'batch_body_bytes_sent',
+        'bytes_sent': 'batch_bytes_sent',
+        'gzip_ration': 'batch_gzip_ration',
+        'request_time': 'batch_request_time',
+        'upstreams': 'batch_upstreams',
+    }
+
     valid_http_methods = (
         'head',
         'get',
@@ -63,10 +92,18 @@ class NginxAccessLogsCollector(AbstractCollector):
         'options'
     )
 
-    def __init__(self, filename=None, log_format=None, tail=None, **kwargs):
+    upstream_timers = {
+        'nginx.upstream.connect.time': 'upstream_connect_time',
+        'nginx.upstream.response.time': 'upstream_response_time',
+        'nginx.upstream.header.time': 'upstream_header_time'
+    }
+
+    # number of parsed lines aggregated at once, 0 means per-line processing
+    batch_size = 2000
+
+    def __init__(self, filename=None, log_format=None, tail=None, batch_size=None, **kwargs):
         super(NginxAccessLogsCollector, self).__init__(**kwargs)
         self.filename = filename
-        self.parser = NginxAccessLogParser(log_format)
         self.tail = tail if tail is not None else FileTail(filename)
         self.filters = []
 
@@ -77,6 +114,7 @@ class NginxAccessLogsCollector(AbstractCollector):
             if log_filter.filename and log_filter.filename != self.filename:
                 continue
             self.filters.append(log_filter)
+        self.filter_index = FilterIndex(self.filters)
 
         self.register(
             self.http_method,
@@ -90,6 +128,54 @@ class NginxAccessLogsCollector(AbstractCollector):
             self.upstreams,
         )
 
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+        # statsd handles for per-line methods
+        statsd = self.object.statsd
+        self.handles = {}
+        for metric_name in self.counters:
+            self.handles[metric_name] = statsd.counter_handle(metric_name)
+        for metric_name in ('nginx.http.request.length', 'nginx.http.gzip.ratio', 'nginx.upstream.response.length'):
+            self.handles[metric_name] = statsd.average_handle(metric_name)
+        for metric_name in ['nginx.http.request.time'] + self.upstream_timers.keys():
+            self.handles[metric_name] = statsd.timer_handle(metric_name)
+
+        self.method_counters = dict(
+            (method, self.handles['nginx.http.method.%s' % method]) for method in self.valid_http_methods
+        )
+        self.status_counters = {}  # first digit of status - handle
+        self.version_counters = {}  # $server_protocol - handle
+
+        self.parser = NginxAccessLogParser(log_format, fields=self.parser_fields())
+        context.log.debug(
+            '%s access log parser for %s uses %s' % (
+                self.object.definition_hash,
+                self.tail.name if isinstance(self.tail, Pipeline) else 'list',
+                'tokenizer' if self.parser.tokenizer is not None else 'regex'
+            )
+        )
+
+    def parser_fields(self):
+        """
+        Collects log format variables that are consumed by registered methods and custom filters, so the parser
+        doesn't waste time on the rest (like $http_user_agent)
+
+        :return: set of variable names or None if all variables should be parsed
+        """
+        fields = set()
+
+        for method in self.methods:
+            method_fields = self.method_variables.get(method.__name__)
+            if method_fields is None:
+                return None  # we don't know what this method needs
+            fields.update(method_fields)
+
+        for log_filter in self.filters:
+            fields.update(log_filter.data.iterkeys())
+
+        return fields
+
     def init_counters(self):
         for counter, key in self.counters.iteritems():
             # If keys are in the parser format (access log) or not defined (error log)
@@ -100,10 +186,24 @@ class NginxAccessLogsCollector(AbstractCollector):
         for counter in set(f.metric for f in self.filters):
             self.count_custom_filter(self.filters, counter, 0, self.object.statsd.incr)
 
+    def _sleep(self):
+        # pipelines can wake the collector up as soon as new lines come
+        if isinstance(self.tail, Pipeline):
+            self.tail.wait(self.interval)
+        else:
+            super(NginxAccessLogsCollector, self)._sleep()
+
     def collect(self):
         self.init_counters()  # set all counters to 0
+        self.parser.tokenizer_misses = 0
+
+        # batches are possible only if every registered method has a batch twin
+        batch_size = self.batch_size
+        if any(method.__name__ not in self.batch_methods for method in self.methods):
+            batch_size = 0
 
         count = 0
+        batch, batch_filters = [], defaultdict(list)
         for line in self.tail:
             count += 1
             try:
@@ -117,14 +217,102 @@ class NginxAccessLogsCollector(AbstractCollector):
 
             if parsed['malformed']:
                 self.request_malformed()
+            elif batch_size:
+                batch.append(parsed)
+                if self.filters:
+                    for log_filter in self.filter_index.matching(parsed):
+                        batch_filters[log_filter].append(parsed)
+
+                if len(batch) >= batch_size:
+                    self.collect_batch(batch, batch_filters)
+                    batch, batch_filters = [], defaultdict(list)
             else:
                 # try to match custom filters and collect log metrics with them
-                matched_filters = [filter for filter in self.filters if filter.match(parsed)]
+                matched_filters = self.filter_index.matching(parsed) if self.filters else []
                 super(NginxAccessLogsCollector, self).collect(parsed, matched_filters)
 
+        if batch:
+            self.collect_batch(batch, batch_filters)
+
         tail_name = self.tail.name if isinstance(self.tail, Pipeline) else 'list'
         context.log.debug('%s processed %s lines from %s' % (self.object.definition_hash, count, tail_name))
 
+        if isinstance(self.tail, Pipeline):
+            self.tail.report(self.object.statsd)
+
+        # formats without a tokenizer are always parsed with regex, only fallbacks of the tokenizer are counted
+        if self.parser.tokenizer is not None:
+            tokenized = count - self.parser.tokenizer_misses
+            for metric_name, value in (
+                ('amplify.agent.log.parser.tokenizer', tokenized),
+                ('amplify.agent.log.parser.regex', self.parser.tokenizer_misses),
+            ):
+                if value:
+                    self.object.statsd.incr(metric_name, value)
+
+            if count:
+                context.log.debug(
+                    '%s tokenized %s lines from %s, %s lines fell back to regex' % (
+                        self.object.definition_hash, tokenized, tail_name, self.parser.tokenizer_misses
+                    )
+                )
+
+    def collect_batch(self, batch, batch_filters):
+        """
+        Aggregates a batch of parsed lines and pushes one update per metric to statsd.
+        The result is the same as if every line was passed through registered methods.
+
+        :param batch: [] of parsed lines
+        :param batch_filters: {} of filter - [] of parsed lines matched by this filter
+        """
+        self.push_aggregated(*self.aggregate(batch))
+
+        for log_filter in self.filters:
+            filter_batch = batch_filters.get(log_filter)
+            if filter_batch:
+                self.push_aggregated(
+                    *self.aggregate(filter_batch),
+                    metric_name=log_filter.metric,
+                    suffix='||%s' % log_filter.filter_rule_id
+                )
+
+    def aggregate(self, batch):
+        """
+        Runs batch twins of registered methods over a batch of parsed lines
+
+        :param batch: [] of parsed lines
+        :return: (counters, timers, averages) - {} of metric name - sum or [] of values
+        """
+        counters, timers, averages = Counter(), defaultdict(list), defaultdict(list)
+        for method in self.methods:
+            batch_method = getattr(self, self.batch_methods[method.__name__])
+            try:
+                batch_method(batch, counters, timers, averages)
+            except Exception as e:
+                self.handle_exception(batch_method, e)
+        return counters, timers, averages
+
+    def push_aggregated(self, counters, timers, averages, metric_name=None, suffix=''):
+        """
+        Sends aggregated values to statsd
+
+        :param counters: {} of metric name - sum
+        :param timers: {} of metric name - [] of values
+        :param averages: {} of metric name - [] of values
+        :param metric_name: str send only this metric (used for custom filters)
+        :param suffix: str metric name suffix (used for custom filters)
+        """
+        for store, method in (
+            (counters, self.object.statsd.incr),
+            (timers, self.object.statsd.timer_batch),
+            (averages, self.object.statsd.average_batch)
+        ):
+            if metric_name is None:
+                for name, value in store.iteritems():
+                    method(name + suffix, value)
+            elif metric_name in store:
+                method(metric_name + suffix, store[metric_name])
+
     def request_malformed(self):
         """
         nginx.http.request.malformed
@@ -145,12 +333,12 @@ class NginxAccessLogsCollector(AbstractCollector):
         :param matched_filters: [] of matched filters
         """
         if 'request_method' in data:
-            method = data['request_method'].lower()
-            method = method if method in self.valid_http_methods else 'other'
-            metric_name = 'nginx.http.method.%s' % method
-            self.object.statsd.incr(metric_name)
+            counter = self.method_counters.get(data['request_method'].lower())
+            if counter is None:
+                counter = self.handles['nginx.http.method.other']
+            counter.inc()
             if matched_filters:
-                self.count_custom_filter(matched_filters, metric_name, 1, self.object.statsd.incr)
+                self.count_custom_filter(matched_filters, counter.metric_name, 1, self.object.statsd.incr)
 
     def http_status(self, data, matched_filters=None):
         """
@@ -166,11 +354,16 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'status' in data:
             status = data['status']
-            suffix = 'discarded' if status in ('499', '444', '408') else '%sxx' % status[0]
-            metric_name = 'nginx.http.status.%s' % suffix
-            self.object.statsd.incr(metric_name)
+            if status in ('499', '444', '408'):
+                counter = self.handles['nginx.http.status.discarded']
+            else:
+                counter = self.status_counters.get(status[0])
+                if counter is None:
+                    metric_name = 'nginx.http.status.%sxx' % status[0]
+                    counter = self.status_counters[status[0]] = self.object.statsd.counter_handle(metric_name)
+            counter.inc()
             if matched_filters:
-                self.count_custom_filter(matched_filters, metric_name, 1, self.object.statsd.incr)
+                self.count_custom_filter(matched_filters, counter.metric_name, 1, self.object.statsd.incr)
 
     def http_version(self, data, matched_filters=None):
         """
@@ -184,25 +377,21 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'server_protocol' in data:
             proto = data['server_protocol']
-            if not proto.startswith('HTTP'):
-                return
-
-            version = proto.split('/')[-1]
-
-            # Ordered roughly by expected popularity to reduce number of calls to `startswith`
-            if version.startswith('1.1'):
-                suffix = '1_1'
-            elif version.startswith('2.0'):
-                suffix = '2'
-            elif version.startswith('1.0'):
-                suffix = '1_0'
-            elif version.startswith('0.9'):
-                suffix = '0_9'
+            counter = self.version_counters.get(proto)
+            if counter is not None:
+                metric_name = counter.metric_name
+                counter.inc()
             else:
-                suffix = version.replace('.', '_')
+                suffix = self.http_version_suffix(proto)
+                if suffix is None:
+                    return
+
+                metric_name = 'nginx.http.v%s' % suffix
+                if metric_name in self.handles:
+                    # cache only known versions, $server_protocol can be anything
+                    self.version_counters[proto] = self.handles[metric_name]
+                self.object.statsd.incr(metric_name)
 
-            metric_name = 'nginx.http.v%s' % suffix
-            self.object.statsd.incr(metric_name)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, 1, self.object.statsd.incr)
 
@@ -215,7 +404,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'request_length' in data:
             metric_name, value = 'nginx.http.request.length', data['request_length']
-            self.object.statsd.average(metric_name, value)
+            self.handles[metric_name].add(value)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.average)
 
@@ -228,7 +417,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'body_bytes_sent' in data:
             metric_name, value = 'nginx.http.request.body_bytes_sent', data['body_bytes_sent']
-            self.object.statsd.incr(metric_name, value)
+            self.handles[metric_name].inc(value)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.incr)
 
@@ -241,7 +430,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'bytes_sent' in data:
             metric_name, value = 'nginx.http.request.bytes_sent', data['bytes_sent']
-            self.object.statsd.incr(metric_name, value)
+            self.handles[metric_name].inc(value)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.incr)
 
@@ -254,7 +443,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'gzip_ratio' in data:
             metric_name, value = 'nginx.http.gzip.ratio', data['gzip_ratio']
-            self.object.statsd.average(metric_name, value)
+            self.handles[metric_name].add(value)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.average)
 
@@ -271,7 +460,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'request_time' in data:
             metric_name, value = 'nginx.http.request.time', sum(data['request_time'])
-            self.object.statsd.timer(metric_name, value)
+            self.handles[metric_name].add(value)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.timer)
 
@@ -322,23 +511,22 @@ class NginxAccessLogsCollector(AbstractCollector):
                     suffix = '%sxx' % status[0]
                     metric_name = 'nginx.upstream.status.%s' % suffix
                     upstream_response = True if suffix in ('2xx', '3xx') else False   # Set flag for upstream length processing
-                    self.object.statsd.incr(metric_name)
+                    if metric_name in self.handles:
+                        self.handles[metric_name].inc()
+                    else:
+                        self.object.statsd.incr(metric_name)
                     if matched_filters:
                         self.count_custom_filter(matched_filters, metric_name, 1, self.object.statsd.incr)
 
         if upstream_response and 'upstream_response_length' in data:
             metric_name, value = 'nginx.upstream.response.length', data['upstream_response_length']
-            self.object.statsd.average(metric_name, value)
+            self.handles[metric_name].add(value)
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.average)
 
         # gauges
         upstream_switches = None
-        for metric_name, key_name in {
-            'nginx.upstream.connect.time': 'upstream_connect_time',
-            'nginx.upstream.response.time': 'upstream_response_time',
-            'nginx.upstream.header.time': 'upstream_header_time'
-        }.iteritems():
+        for metric_name, key_name in self.upstream_timers.iteritems():
             if key_name in data:
                 values = data[key_name]
 
@@ -348,13 +536,13 @@ class NginxAccessLogsCollector(AbstractCollector):
 
                 # store all values
                 value = sum(values)
-                self.object.statsd.timer(metric_name, value)
+                self.handles[metric_name].add(value)
                 if matched_filters:
                     self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.timer)
 
         # log upstream switches
         metric_name, value = 'nginx.upstream.next.count', 0 if upstream_switches is None else upstream_switches
-        self.object.statsd.incr(metric_name, value)
+        self.handles[metric_name].inc(value)
         if matched_filters:
             self.count_custom_filter(matched_filters, metric_name, value, self.object.statsd.incr)
 
@@ -363,16 +551,152 @@ class NginxAccessLogsCollector(AbstractCollector):
             cache_status = data['upstream_cache_status']
             if cache_status != '-':
                 metric_name = 'nginx.cache.%s' % cache_status.lower()
-                self.object.statsd.incr(metric_name)
+                if metric_name in self.handles:
+                    self.handles[metric_name].inc()
+                else:
+                    self.object.statsd.incr(metric_name)
                 if matched_filters:
                     self.count_custom_filter(matched_filters, metric_name, 1, self.object.statsd.incr)
 
         # log total upstream requests
         metric_name = 'nginx.upstream.request.count'
-        self.object.statsd.incr(metric_name)
+        self.handles[metric_name].inc()
         if matched_filters:
             self.count_custom_filter(matched_filters, metric_name, 1, self.object.statsd.incr)
 
+    def batch_http_method(self, batch, counters, timers, averages):
+        """
+        Batch twin of http_method
+        """
+        methods = Counter(data['request_method'] for data in batch if 'request_method' in data)
+        for method, count in methods.iteritems():
+            method = method.lower()
+            method = method if method in self.valid_http_methods else 'other'
+            counters['nginx.http.method.%s' % method] += count
+
+    def batch_http_status(self, batch, counters, timers, averages):
+        """
+        Batch twin of http_status
+        """
+        statuses = Counter(data['status'] for data in batch if 'status' in data)
+        for status, count in statuses.iteritems():
+            suffix = 'discarded' if status in ('499', '444', '408') else '%sxx' % status[0]
+            counters['nginx.http.status.%s' % suffix] += count
+
+    def batch_http_version(self, batch, counters, timers, averages):
+        """
+        Batch twin of http_version
+        """
+        protocols = Counter(data['server_protocol'] for data in batch if 'server_protocol' in data)
+        for proto, count in protocols.iteritems():
+            suffix = self.http_version_suffix(proto)
+            if suffix is not None:
+                counters['nginx.http.v%s' % suffix] += count
+
+    def batch_request_length(self, batch, counters, timers, averages):
+        """
+        Batch twin of request_length
+        """
+        values = [data['request_length'] for data in batch if 'request_length' in data]
+        if values:
+            averages['nginx.http.request.length'].extend(values)
+
+    def batch_body_bytes_sent(self, batch, counters, timers, averages):
+        """
+        Batch twin of body_bytes_sent
+        """
+        values = [data['body_bytes_sent'] for data in batch if 'body_bytes_sent' in data]
+        if values:
+            counters['nginx.http.request.body_bytes_sent'] += sum(values)
+
+    def batch_bytes_sent(self, batch, counters, timers, averages):
+        """
+        Batch twin of bytes_sent
+        """
+        values = [data['bytes_sent'] for data in batch if 'bytes_sent' in data]
+        if values:
+            counters['nginx.http.request.bytes_sent'] += sum(values)
+
+    def batch_gzip_ration(self, batch, counters, timers, averages):
+        """
+        Batch twin of gzip_ration
+        """
+        values = [data['gzip_ratio'] for data in batch if 'gzip_ratio' in data]
+        if values:
+            averages['nginx.http.gzip.ratio'].extend(values)
+
+    def batch_request_time(self, batch, counters, timers, averages):
+        """
+        Batch twin of request_time
+        """
+        values = [sum(data['request_time']) for data in batch if 'request_time' in data]
+        if values:
+            timers['nginx.http.request.time'].extend(values)
+
+    def batch_upstreams(self, batch, counters, timers, averages):
+        """
+        Batch twin of upstreams
+        """
+        for data in batch:
+            if not any(key.startswith('upstream') and data[key] not in ('-', '') for key in data):
+                continue
+
+            # counters
+            upstream_response = False
+            if 'upstream_status' in data:
+                for status in data['upstream_status']:
+                    if status.isdigit():
+                        suffix = '%sxx' % status[0]
+                        upstream_response = suffix in ('2xx', '3xx')
+                        counters['nginx.upstream.status.%s' % suffix] += 1
+
+            if upstream_response and 'upstream_response_length' in data:
+                averages['nginx.upstream.response.length'].append(data['upstream_response_length'])
+
+            # gauges
+            upstream_switches = None
+            for metric_name, key_name in self.upstream_timers.iteritems():
+                if key_name in data:
+                    values = data[key_name]
+                    if len(values) > 1 and upstream_switches is None:
+                        upstream_switches = len(values) - 1
+                    timers[metric_name].append(sum(values))
+
+            counters['nginx.upstream.next.count'] += 0 if upstream_switches is None else upstream_switches
+
+            # cache
+            if 'upstream_cache_status' in data:
+                cache_status = data['upstream_cache_status']
+                if cache_status != '-':
+                    counters['nginx.cache.%s' % cache_status.lower()] += 1
+
+            counters['nginx.upstream.request.count'] += 1
+
+    @staticmethod
+    def http_version_suffix(proto):
+        """
+        Converts $server_protocol to a suffix of nginx.http.v* metrics
+
+        :param proto: str server protocol (like HTTP/1.1)
+        :return: str suffix or None if protocol is not HTTP
+        """
+        if not proto.startswith('HTTP'):
+            return None
+
+        version = proto.split('/')[-1]
+
+        # Ordered roughly by expected popularity to reduce number of calls to `startswith`
+        if version.startswith('1.1'):
+            return '1_1'
+        elif version.startswith('2.0'):
+            return '2'
+        elif version.startswith('1.0'):
+            return '1_0'
+        elif version.startswith('0.9'):
+            return '0_9'
+        else:
+            return version.replace('.', '_')
+
     @staticmethod
     def count_custom_filter(matched_filters, metric_name, value, method):
         """
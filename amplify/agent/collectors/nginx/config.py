@@ -5,7 +5,10 @@ from amplify.agent.data.eventd import CRITICAL, WARNING, INFO
 from amplify.agent.collectors.abstract import AbstractCollector
 
 from amplify.agent.common.context import context
+from amplify.agent.common.errors import AmplifyWorkerError
 from amplify.agent.objects.nginx.config.config import NginxConfig
+from amplify.agent.objects.nginx.config.watcher import NginxConfigWatcher
+from amplify.agent.objects.nginx.config.worker import NginxConfigWorker, DEFAULT_TIMEOUT, DEFAULT_MEMORY_LIMIT
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -31,6 +34,11 @@ class NginxConfigCollector(AbstractCollector):
 
         self.parse_delay = context.app_config['containers'].get('nginx', {}).get('parse_delay', DEFAULT_PARSE_DELAY)
 
+        # parse in a separate process unless "inline" is set
+        self.parse_in_worker = self.object.config_option('config_parsing') != 'inline'
+        self.parse_timeout = float(self.object.config_option('parse_timeout') or DEFAULT_TIMEOUT)
+        self.parse_memory_limit = int(self.object.config_option('parse_memory_limit') or DEFAULT_MEMORY_LIMIT)
+
         self.register(
             self.parse_config
         )
@@ -41,7 +49,8 @@ class NginxConfigCollector(AbstractCollector):
 
         Will not run if:
             a) it hasn't been long enough since the last time it parsed (unless `no_delay` is True)
-            b) the configuration files/directories from the last parse haven't changed
+            b) the config watcher has seen no changes in files/directories since the last check
+            c) the configuration files/directories from the last parse haven't changed
 
         :param no_delay: bool - ignore delay times for this run (useful for testing)
         """
@@ -51,24 +60,40 @@ class NginxConfigCollector(AbstractCollector):
         if not no_delay and time.time() < config.wait_until:
             return
 
+        # don't read all config files if nothing has happened to them
+        if config.watcher is None:
+            config.watcher = NginxConfigWatcher()
+        elif self.previous['files'] and not config.watcher.changed():
+            return
+
         files, directories = config.collect_structure(include_ssl_certs=self.object.upload_ssl)
+        config.watcher.watch(files.keys() + directories.keys())
 
         # check if config is changed (changes are: new files/certs, new mtimes)
         if files == self.previous['files'] and directories == self.previous['directories']:
             return
 
-        self.previous['files'] = files
-        self.previous['directories'] = directories
-
         # parse config tree
         start_time = time.time()
+        checksum = None
+        digest_hits, digest_misses = config.digests.hits, config.digests.misses
         try:
-            config.full_parse()
+            if self.parse_in_worker:
+                checksum = self.parse_with_worker(config)
+            else:
+                config.full_parse()
+        except:
+            config.watcher.dirty = True  # parse again next time, even if nothing changes
+            raise
         finally:
             elapsed_time = time.time() - start_time
             delay = 0 if no_delay else max(elapsed_time * 2, self.parse_delay)
             config.wait_until = start_time + delay
 
+        # remember the structure only when it is parsed, otherwise a failed parse would never be retried
+        self.previous['files'] = files
+        self.previous['directories'] = directories
+
         # Send event for parsing nginx config.
         # Use config.parser.filename to account for default value defined in NginxConfigParser.
         self.object.eventd.event(
@@ -78,14 +103,17 @@ class NginxConfigCollector(AbstractCollector):
         for error in config.parser_errors:
             self.object.eventd.event(level=WARNING, message=error)
 
-        # run ssl checks
-        if self.object.upload_ssl:
-            config.run_ssl_analysis()
-        else:
+        # run ssl checks (the worker has done them already)
+        if not self.object.upload_ssl:
             context.log.info('ssl analysis skipped due to users settings')
+        elif checksum is None:
+            config.run_ssl_analysis()
 
         # run upload
-        checksum = config.checksum()
+        if checksum is None:
+            checksum = config.checksum()
+        self.report_digests(config, digest_hits, digest_misses)
+
         if self.object.upload_config:
             self.upload(config, checksum)
 
@@ -120,6 +148,44 @@ class NginxConfigCollector(AbstractCollector):
 
         self.previous['checksum'] = checksum
 
+    def parse_with_worker(self, config):
+        """
+        Parses the config in the worker process, falls back to parsing inline if the worker can't be started
+
+        :param config: NginxConfig
+        :return: str checksum or None if the config was parsed inline
+        """
+        if config.worker is None:
+            config.worker = NginxConfigWorker(config, timeout=self.parse_timeout, memory_limit=self.parse_memory_limit)
+
+        try:
+            return config.worker.parse(ssl_analysis=self.object.upload_ssl)
+        except AmplifyWorkerError as e:
+            if e.message != 'failed to start':
+                raise
+
+        context.log.warning('could not start config worker for %s, parsing inline' % config.filename)
+        config.worker = None
+        self.parse_in_worker = False
+        config.full_parse()
+        return None
+
+    def report_digests(self, config, hits, misses):
+        """
+        Reports how many digests of files and certificates were computed and taken from the cache for the checksum
+        (in the worker or inline)
+
+        :param config: NginxConfig
+        :param hits: int digest cache hits before the parse
+        :param misses: int digest cache misses before the parse
+        """
+        for metric_name, value in (
+            ('amplify.agent.config.digest_hits', config.digests.hits - hits),
+            ('amplify.agent.config.digest_misses', config.digests.misses - misses),
+        ):
+            if value:
+                self.object.statsd.incr(metric_name, value)
+
     def handle_exception(self, method, exception):
         super(NginxConfigCollector, self).handle_exception(method, exception)
         self.object.eventd.event(
@@ -31,8 +31,16 @@ class NginxErrorLogsCollector(AbstractCollector):
         self.level = level
         self.parser = NginxErrorLogParser()
         self.tail = tail if tail is not None else FileTail(filename)
+        self.handles = {}  # metric name - statsd handle
         self.register(self.error_log_parsed)
 
+    def _sleep(self):
+        # pipelines can wake the collector up as soon as new lines come
+        if isinstance(self.tail, Pipeline):
+            self.tail.wait(self.interval)
+        else:
+            super(NginxErrorLogsCollector, self)._sleep()
+
     def collect(self):
         # If log_level is <= warn (e.g. debug, info, notice, warn)
         if ERROR_LOG_LEVELS.index(self.level) <= 3:
@@ -53,5 +61,11 @@ class NginxErrorLogsCollector(AbstractCollector):
         tail_name = self.tail.name if isinstance(self.tail, Pipeline) else 'list'
         context.log.debug('%s processed %s lines from %s' % (self.object.definition_hash, count, tail_name))
 
+        if isinstance(self.tail, Pipeline):
+            self.tail.report(self.object.statsd)
+
     def error_log_parsed(self, error):
-        self.object.statsd.incr(error)
+        counter = self.handles.get(error)
+        if counter is None:
+            counter = self.handles[error] = self.object.statsd.counter_handle(error)
+        counter.inc()
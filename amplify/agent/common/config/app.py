@@ -36,6 +36,21 @@ class Config(AbstractConfig):
             hostname=None,
             imagename=None
         ),
+        tail=dict(
+            offsets=None,  # path of a file to keep log offsets between agent restarts
+            max_backlog=50 * 1024 * 1024,  # max bytes of a log to read after a restart, the rest is skipped
+            max_lines=None,  # max lines of a log read in one cycle
+            max_time=1000,  # max milliseconds spent on reading a log in one cycle
+            max_lag=None,  # unread bytes of a log are skipped if there are more of them at the start of a cycle
+        ),
+        listeners=dict(
+            keys='',
+            receive_buffer=4 * 1024 * 1024,  # SO_RCVBUF of syslog sockets, the kernel may limit it (net.core.rmem_max)
+        ),
+        metrics=dict(
+            timers='sketch',  # or 'exact' to keep all timer samples
+            gauges='average',  # or 'extremes' to report .min and .max of gauges as well
+        ),
     )
 
     config_changes = dict()
@@ -130,8 +130,11 @@ class Context(Singleton):
             if listener_definition:
                 # ...try to find the address...
                 listener_address = listener_definition.get('address')
+                # ...unix sockets are saved as they are...
+                if listener_address and listener_address.startswith('unix:'):
+                    self.listeners.add(listener_address)
                 # ...if there is an address...
-                if listener_address is not None:
+                elif listener_address is not None:
                     # ...try to format and save the ipv4 address into the context store.
                     try:
                         _, _, formatted_address = net.ipv4_address(address=listener_address, full_format=True)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class FileDigests(object):
+    """
+    SHA-256 digests of files, cached with the stat signature of every file (device, inode, size, mtime).
+    A file is read and hashed again only if its signature changes.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self):
+        self.digests = {}  # path - (signature, hex digest)
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, path):
+        """
+        :param path: str path to file
+        :return: str hex digest of the file contents
+        """
+        stat = os.stat(path)
+        signature = stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime
+
+        cached = self.digests.get(path)
+        if cached and cached[0] == signature:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), ''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+
+        self.digests[path] = signature, digest
+        return digest
+
+    def forget_others(self, paths):
+        """
+        Drops cached digests of files that are not in paths
+
+        :param paths: set of str paths to keep
+        """
+        for path in self.digests.keys():
+            if path not in paths:
+                del self.digests[path]
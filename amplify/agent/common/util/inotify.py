@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+import gevent
+from gevent import select
+from gevent.event import Event
+
+from amplify.agent.common.context import context
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# Constants (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len of name
+READ_SIZE = 64 * 1024
+
+_libc = None
+
+# watches shared by everybody in the process, see shared_watches()
+SHARED_WATCHES = None
+
+
+def libc():
+    """
+    Loads libc with inotify functions, only once
+
+    :return: ctypes.CDLL or None if inotify is not available
+    """
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                lib = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                if hasattr(lib, 'inotify_init1'):
+                    lib.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                    _libc = lib
+            except OSError:
+                pass
+    return _libc or None
+
+
+def available():
+    return libc() is not None
+
+
+class Inotify(object):
+    """
+    Minimal ctypes wrapper for Linux inotify with gevent friendly waits
+    """
+
+    def __init__(self):
+        lib = libc()
+        if lib is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self._lib = lib
+        self.fd = lib.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+        self.watches = {}  # wd - path
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        :param path: str path of a file or a directory
+        :param mask: int inotify event mask
+        :return: int watch descriptor
+        """
+        wd = self._lib.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, '%s: %s' % (os.strerror(code), path))
+        self.watches[wd] = path
+        return wd
+
+    def rm_watch(self, wd):
+        """
+        :param wd: int watch descriptor returned by add_watch
+        """
+        self.watches.pop(wd, None)
+        if self._lib.inotify_rm_watch(self.fd, wd) < 0:
+            code = ctypes.get_errno()
+            if code != errno.EINVAL:  # already removed by the kernel (e.g. the directory is deleted)
+                raise OSError(code, os.strerror(code))
+
+    def read(self):
+        """
+        Reads all pending events without blocking
+
+        :return: [] of (wd, mask, cookie, name)
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+
+            if not data:
+                return events
+
+            position = 0
+            while position + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size
+                name = data[position:position + length].rstrip('\0')
+                position += length
+                events.append((wd, mask, cookie, name))
+
+    def wait(self, timeout):
+        """
+        Blocks the current greenlet until there are events or timeout passes
+
+        :param timeout: float seconds
+        :return: [] of events (see read)
+        """
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        return self.read() if readable else []
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+        self.watches = {}
+
+
+class FileWatches(object):
+    """
+    One inotify instance for everybody in the process who waits for changes of files or directories
+
+    Every directory is watched once, no matter how many files in it are waited for, and events are dispatched by
+    file name (or to everybody who waits for any change in the directory).  So the number of inotify instances
+    (fs.inotify.max_user_instances is often 128 for all processes of a user) doesn't grow with the number of files.
+    Events are read by a greenlet which runs while there are subscriptions, see also read().
+    """
+
+    idle_timeout = 1.0  # seconds the reader waits for events before it checks if it is still needed
+
+    def __init__(self):
+        self.notifier = Inotify()
+        self.directories = {}  # directory - (wd, mask)
+        self.events = {}  # wd - {file name or None for any change - [gevent.event.Event]}
+        self.reader = None
+
+    def subscribe(self, path, mask):
+        """
+        :param path: str path of a file, it doesn't have to exist
+        :param mask: int inotify event mask for the directory of the file
+        :return: gevent.event.Event which is set on events of the file and on queue overflows
+        """
+        directory, name = self._split(path)
+        return self._add(directory, name, mask, Event())
+
+    def subscribe_directory(self, directory, mask, event=None):
+        """
+        :param directory: str path of an existing directory
+        :param mask: int inotify event mask
+        :param event: gevent.event.Event to set, so one event can be shared by several directories (optional)
+        :return: gevent.event.Event which is set on any event in the directory and on queue overflows
+        """
+        return self._add(os.path.realpath(directory), None, mask, event or Event())
+
+    def unsubscribe(self, path, event):
+        """
+        :param path: str path of a file given to subscribe()
+        :param event: gevent.event.Event returned by subscribe()
+        """
+        directory, name = self._split(path)
+        self._remove(directory, name, event)
+
+    def unsubscribe_directory(self, directory, event):
+        """
+        :param directory: str path of a directory given to subscribe_directory()
+        :param event: gevent.event.Event returned by subscribe_directory()
+        """
+        self._remove(os.path.realpath(directory), None, event)
+
+    def watching(self, directory):
+        """
+        :return: bool - False if the directory is not watched (e.g. it was removed and the kernel dropped the watch)
+        """
+        return os.path.realpath(directory) in self.directories
+
+    def read(self):
+        """
+        Dispatches events which are not read yet without waiting, for those who check events instead of waiting
+        """
+        self._dispatch(self.notifier.read())
+
+    def _add(self, directory, name, mask, event):
+        wd, watched_mask = self.directories.get(directory, (None, 0))
+        if mask & ~watched_mask:
+            wd = self.notifier.add_watch(directory, mask | watched_mask)  # the same wd if it is watched already
+            self.directories[directory] = wd, mask | watched_mask
+
+        self.read()  # events which happened before are not for the new subscriber
+        self.events.setdefault(wd, {}).setdefault(name, []).append(event)
+
+        if self.reader is None:
+            self.reader = gevent.spawn(self._read)
+        return event
+
+    def _remove(self, directory, name, event):
+        wd, _ = self.directories.get(directory, (None, 0))
+        names = self.events.get(wd)
+        if names is None:
+            return  # the directory is not watched anymore
+
+        if event in names.get(name, ()):
+            names[name].remove(event)
+            if not names[name]:
+                del names[name]
+
+        if not names:
+            del self.events[wd]
+            del self.directories[directory]
+            self.notifier.rm_watch(wd)
+
+    def _read(self):
+        try:
+            while self.events:
+                self._dispatch(self.notifier.wait(self.idle_timeout))
+        except OSError as e:
+            context.log.error('failed to read inotify events due to %s' % e)
+            context.log.debug('additional info:', exc_info=True)
+            self._wake(self.events.keys())
+        finally:
+            self.reader = None
+
+    def _dispatch(self, events):
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self._wake(self.events.keys())  # events are lost, anything could have changed
+            elif mask & IN_IGNORED:
+                self._forget(wd)  # the directory is gone, waiters fall back to their timeouts
+            else:
+                names = self.events.get(wd, {})
+                for event in names.get(name, ()):
+                    event.set()
+                for event in names.get(None, ()):
+                    event.set()
+
+    def _wake(self, wds):
+        for wd in wds:
+            for events in self.events.get(wd, {}).itervalues():
+                for event in events:
+                    event.set()
+
+    def _forget(self, wd):
+        self._wake([wd])
+        self.events.pop(wd, None)
+        for directory, (watched_wd, _) in self.directories.items():
+            if watched_wd == wd:
+                del self.directories[directory]
+
+    @staticmethod
+    def _split(path):
+        """
+        :return: (str real path of the directory, str file name)
+        """
+        directory, name = os.path.split(os.path.abspath(path))
+        return os.path.realpath(directory), name
+
+
+def shared_watches():
+    """
+    Returns the watches shared by everybody in the process, creates them if needed
+
+    :return: FileWatches
+    """
+    global SHARED_WATCHES
+    if SHARED_WATCHES is None:
+        SHARED_WATCHES = FileWatches()
+    return SHARED_WATCHES
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from math import ceil, log
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# Constants
+RELATIVE_ACCURACY = 0.01  # 1%
+MIN_VALUE = 1e-6  # values closer to zero are counted as zeros (timers are in seconds, so this is 1 microsecond)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch with log-linear buckets (DDSketch)
+
+    A positive value v is counted in bucket ceil(log(v) / log(gamma)), gamma = (1 + a) / (1 - a), and is restored as
+    the middle of its bucket. So a value returned for any rank differs from the exact value at this rank by no more
+    than a * value, where a is the relative accuracy. Values closer to zero than min_value are counted as zeros.
+    Count, sum, min and max are exact.
+
+    Insert is O(1) and memory depends only on the range of values, not on their number: about
+    log(max / min) / log(gamma) buckets, e.g. ~1000 buckets for 1 microsecond .. 1 day with 1% accuracy.
+
+    Supports append/extend/len like a list, so it can be used in place of a list of samples.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, min_value=MIN_VALUE):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.multiplier = 1 / log(self.gamma)
+
+        self.count = 0
+        self.sum = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.zeros = 0
+        self.positive = {}  # bucket key - count
+        self.negative = {}  # bucket key of abs value - count
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        """
+        Adds a value
+
+        :param value: int/float value
+        """
+        self.count += 1
+        self.sum += value
+
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+
+        if value > self.min_value:
+            key = int(ceil(log(value) * self.multiplier))
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < -self.min_value:
+            key = int(ceil(log(-value) * self.multiplier))
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zeros += 1
+
+    def extend(self, values):
+        """
+        Adds several values
+
+        :param values: [] of int/float values
+        """
+        if not isinstance(values, (list, tuple)):
+            values = list(values)
+
+        # sum is accumulated in the same order as append() does, so the result doesn't depend on batching
+        min_value, multiplier, positive = self.min_value, self.multiplier, self.positive
+        count, total, zeros = 0, self.sum, 0
+        for value in values:
+            count += 1
+            total += value
+            if value > min_value:
+                key = int(ceil(log(value) * multiplier))
+                positive[key] = positive.get(key, 0) + 1
+            elif value < -min_value:
+                key = int(ceil(log(-value) * multiplier))
+                self.negative[key] = self.negative.get(key, 0) + 1
+            else:
+                zeros += 1
+
+        if count:
+            self.count += count
+            self.sum = total
+            self.zeros += zeros
+            self.max = max(self.max, max(values))
+            self.min = min(self.min, min(values))
+
+    def merge(self, other):
+        """
+        Adds all values of another sketch with the same accuracy
+
+        :param other: QuantileSketch
+        """
+        if other.relative_accuracy != self.relative_accuracy or other.min_value != self.min_value:
+            raise ValueError('can not merge sketches with different accuracy')
+
+        if not other.count:
+            return
+
+        self.count += other.count
+        self.sum += other.sum
+        self.zeros += other.zeros
+        self.max = max(self.max, other.max)
+        self.min = min(self.min, other.min)
+
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_buckets.iteritems():
+                buckets[key] = buckets.get(key, 0) + count
+
+    def value(self, key):
+        """
+        Restores a value from bucket key
+
+        :param key: int bucket key
+        :return: float middle of the bucket
+        """
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def value_at(self, rank):
+        """
+        Returns the value which would be at index `rank` of sorted values
+
+        :param rank: int index (negative indexes work like with lists)
+        :return: float value
+        """
+        if not self.count:
+            raise IndexError('sketch is empty')
+
+        if rank < 0:
+            rank += self.count
+        if not 0 <= rank < self.count:
+            raise IndexError('rank out of range')
+
+        # exact ones
+        if rank == 0:
+            return self.min
+        if rank == self.count - 1:
+            return self.max
+
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self.value(key), self.min)
+
+        seen += self.zeros
+        if seen > rank:
+            return 0
+
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self.value(key), self.max)
+
+        return self.max
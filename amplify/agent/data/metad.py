@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import copy
 from collections import defaultdict
 
 from amplify.agent.data.abstract import CommonDataClient
@@ -26,7 +25,6 @@ class MetadClient(CommonDataClient):
 
     def flush(self):
         if self.current:
-            delivery = copy.deepcopy(self.current)
-            delivery.update(agent=self.context.version)
-            self.current = defaultdict(dict)
-            return delivery
+            # meta collectors build nested structures from scratch every time, so a shallow copy is enough
+            delivery, self.current = self.current, defaultdict(dict)
+            return dict(delivery, agent=self.context.version)
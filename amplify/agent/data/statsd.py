@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
-import copy
+import math
 import time
 
 from collections import defaultdict
 
+from amplify.agent.common.util.sketch import QuantileSketch
+
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
 __credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard", "Arie van Luttikhuizen"]
@@ -12,8 +14,152 @@ __maintainer__ = "Mike Belov"
 __email__ = "dedm@nginx.com"
 
 
+def parse_percentiles(value):
+    """
+    Parses extra percentiles for timers, like
+    "nginx.http.request.time=50,90,99,99.9 nginx.upstream.response.time=99,99.9"
+    or {'nginx.http.request.time': [99, 99.9]}
+
+    :param value: str or {} from config
+    :return: {} of timer name - tuple of percentiles
+    """
+    if not value:
+        return {}
+
+    if isinstance(value, dict):
+        items = value.items()
+    else:
+        items = [item.split('=', 1) for item in value.split()]
+
+    percentiles = {}
+    for metric_name, metric_percentiles in items:
+        if isinstance(metric_percentiles, basestring):
+            metric_percentiles = metric_percentiles.split(',')
+
+        metric_percentiles = set(float(percentile) for percentile in metric_percentiles)
+        if not all(0 < percentile <= 100 for percentile in metric_percentiles):
+            raise ValueError('percentiles of %s should be in (0, 100]' % metric_name)
+
+        percentiles[metric_name.strip()] = tuple(sorted(metric_percentiles))
+
+    return percentiles
+
+
+class RunningAggregate(object):
+    """
+    Count, sum, min, max and the last value of a metric
+
+    Used instead of a list of values for gauges and averages, so memory per metric stays the same no matter
+    how many values are stored between flushes.
+    """
+    __slots__ = ('count', 'sum', 'min', 'max', 'last', 'stamp')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.last = None
+        self.stamp = None
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value, stamp=None):
+        """
+        Adds a value
+
+        :param value: int/float value
+        :param stamp: timestamp of the value (optional)
+        """
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+        self.last = value
+        if stamp is not None:
+            self.stamp = stamp
+
+    def extend(self, values):
+        """
+        Adds several values
+
+        :param values: [] of int/float values
+        """
+        if not isinstance(values, (list, tuple)):
+            values = list(values)
+
+        if values:
+            # accumulated one by one, so the result doesn't depend on batching
+            total = self.sum
+            for value in values:
+                total += value
+            self.sum = total
+            self.count += len(values)
+            self.max = max(self.max, max(values))
+            self.min = min(self.min, min(values))
+            self.last = values[-1]
+
+
+class MetricHandle(object):
+    """
+    Pre-resolved metric of a StatsdClient
+
+    Keeps a reference to the metric storage of the current period, so updates skip name formatting and lookups.
+    Storage is resolved again after every flush.
+    """
+    __slots__ = ('client', 'metric_name', 'generation', 'slot')
+
+    metric_type = None
+
+    def __init__(self, client, metric_name):
+        self.client = client
+        self.metric_name = metric_name
+        self.generation = None
+        self.slot = None
+
+    def resolve(self):
+        self.slot = self.client.slot(self.metric_type, self.metric_name)
+        self.generation = self.client.generation
+        return self.slot
+
+
+class CounterHandle(MetricHandle):
+    __slots__ = ()
+
+    metric_type = 'counter'
+
+    def inc(self, value=1):
+        slot = self.slot if self.generation == self.client.generation else self.resolve()
+        slot[1] += value
+
+
+class TimerHandle(MetricHandle):
+    __slots__ = ()
+
+    metric_type = 'timer'
+
+    def add(self, value):
+        slot = self.slot if self.generation == self.client.generation else self.resolve()
+        slot.append(value)
+
+    def extend(self, values):
+        if values:
+            slot = self.slot if self.generation == self.client.generation else self.resolve()
+            slot.extend(values)
+
+
+class AverageHandle(TimerHandle):
+    __slots__ = ()
+
+    metric_type = 'average'
+
+
 class StatsdClient(object):
-    def __init__(self, address=None, port=None, interval=None, object=None):
+    def __init__(self, address=None, port=None, interval=None, object=None, exact_timers=None, percentiles=None,
+                 gauge_extremes=None):
         # Import context as a class object to avoid circular import on statsd.  This could be refactored later.
         from amplify.agent.common.context import context
         self.context = context
@@ -22,8 +168,80 @@ class StatsdClient(object):
         self.port = port
         self.object = object
         self.interval = interval
+
+        # timers keep all samples only in exact mode, otherwise they are stored in a QuantileSketch
+        if exact_timers is None:
+            exact_timers = context.app_config.get('metrics').get('timers') == 'exact'
+        self.exact_timers = exact_timers
+
+        # gauges report their .min and .max in addition to the average if this is set
+        if gauge_extremes is None:
+            gauge_extremes = context.app_config.get('metrics').get('gauges') == 'extremes'
+        self.gauge_extremes = gauge_extremes
+
+        # extra percentiles for timers (see parse_percentiles), custom filter timers use percentiles of their metric
+        self.percentiles = percentiles or {}
+
         self.current = defaultdict(dict)
         self.delivery = defaultdict(dict)
+        self.generation = 0  # changes every time self.current is replaced
+        self.handles = {}
+
+    def counter_handle(self, metric_name):
+        """
+        Returns a counter handle, handle.inc(value) is the same as incr(metric_name, value)
+
+        :param metric_name: metric name
+        :return: CounterHandle
+        """
+        return self.handle(CounterHandle, metric_name)
+
+    def timer_handle(self, metric_name):
+        """
+        Returns a timer handle, handle.add(value) is the same as timer(metric_name, value)
+
+        :param metric_name: metric name
+        :return: TimerHandle
+        """
+        return self.handle(TimerHandle, metric_name)
+
+    def average_handle(self, metric_name):
+        """
+        Returns an average handle, handle.add(value) is the same as average(metric_name, value)
+
+        :param metric_name: metric name
+        :return: AverageHandle
+        """
+        return self.handle(AverageHandle, metric_name)
+
+    def handle(self, handle_class, metric_name):
+        key = (handle_class.metric_type, metric_name)
+        if key not in self.handles:
+            self.handles[key] = handle_class(self, metric_name)
+        return self.handles[key]
+
+    def slot(self, metric_type, metric_name):
+        """
+        Finds or creates storage of a metric in the current period
+
+        :param metric_type: counter, timer or average
+        :param metric_name: metric name
+        :return: [stamp, value] for counters, storage of values for timers and averages
+        """
+        metrics = self.current[metric_type]
+        if metric_type == 'counter':
+            if metric_name not in metrics:
+                metrics[metric_name] = [[int(time.time()), 0]]
+            return metrics[metric_name][-1]
+        elif metric_name not in metrics:
+            metrics[metric_name] = self.new_timer() if metric_type == 'timer' else RunningAggregate()
+        return metrics[metric_name]
+
+    def new_timer(self):
+        """
+        :return: storage for samples of a timer
+        """
+        return [] if self.exact_timers else QuantileSketch()
 
     def latest(self, metric_name, value, stamp=None):
         """
@@ -35,8 +253,24 @@ class StatsdClient(object):
         """
         timestamp = stamp or int(time.time())
         gauges = self.current['gauge']
-        if metric_name not in gauges or timestamp > gauges[metric_name][0][0]:
-            gauges[metric_name] = [(timestamp, value)]
+        if metric_name not in gauges or timestamp > gauges[metric_name].stamp:
+            gauges[metric_name] = RunningAggregate()
+            gauges[metric_name].append(value, timestamp)
+
+    def maximum(self, metric_name, value, stamp=None):
+        """
+        Stores the maximum of the values of a gauge in the current period, e.g. the lag of the log most behind
+
+        :param metric_name: metric name
+        :param value: metric value
+        :param stamp: timestamp (current timestamp will be used if this is not specified)
+        """
+        timestamp = stamp or int(time.time())
+        gauges = self.current['gauge']
+        if metric_name not in gauges or value > gauges[metric_name].last:
+            gauges[metric_name] = RunningAggregate()
+            gauges[metric_name].append(value)
+        gauges[metric_name].stamp = timestamp
 
     def average(self, metric_name, value):
         """
@@ -45,10 +279,9 @@ class StatsdClient(object):
         :param metric_name:  metric name
         :param value:  metric value
         """
-        if metric_name in self.current['average']:
-            self.current['average'][metric_name].append(value)
-        else:
-            self.current['average'][metric_name] = [value]
+        if metric_name not in self.current['average']:
+            self.current['average'][metric_name] = RunningAggregate()
+        self.current['average'][metric_name].append(value)
 
     def timer(self, metric_name, value):
         """
@@ -60,13 +293,39 @@ class StatsdClient(object):
         Sort the data set by value from highest to lowest and discard the highest 5% of the sorted samples.
         The next highest sample is the 95th percentile value for the data set.
 
+        Unless exact_timers is set, samples are not stored but counted in a QuantileSketch, so median and
+        95 percentile are within its relative accuracy (1%) of exact values, while mean, max and count are exact.
+
         :param metric_name: metric name
         :param value: metric value
         """
         if metric_name in self.current['timer']:
             self.current['timer'][metric_name].append(value)
         else:
-            self.current['timer'][metric_name] = [value]
+            self.current['timer'][metric_name] = self.new_timer()
+            self.current['timer'][metric_name].append(value)
+
+    def average_batch(self, metric_name, values):
+        """
+        Same as average, but stores a whole list of values at once
+
+        :param metric_name: metric name
+        :param values: [] of metric values
+        """
+        if metric_name not in self.current['average']:
+            self.current['average'][metric_name] = RunningAggregate()
+        self.current['average'][metric_name].extend(values)
+
+    def timer_batch(self, metric_name, values):
+        """
+        Same as timer, but stores a whole list of values at once
+
+        :param metric_name: metric name
+        :param values: [] of metric values
+        """
+        if metric_name not in self.current['timer']:
+            self.current['timer'][metric_name] = self.new_timer()
+        self.current['timer'][metric_name].extend(values)
 
     def incr(self, metric_name, value=None, rate=None, stamp=None):
         """
@@ -96,11 +355,11 @@ class StatsdClient(object):
             sample_duration = self.interval * rate
             # write to current slot
             if timestamp < last_stamp + sample_duration:
-                self.current['counter'][metric_name][-1] = [last_stamp, last_value + value]
+                slots[-1][1] = last_value + value
             else:
-                self.current['counter'][metric_name].append([last_stamp, value])
+                slots.append([last_stamp, value])
         else:
-            self.current['counter'][metric_name][-1] = [last_stamp, last_value + value]
+            slots[-1][1] = last_value + value
 
     def agent(self, metric_name, value, stamp=None):
         """
@@ -110,7 +369,8 @@ class StatsdClient(object):
         :param stamp: timestamp (current timestamp will be used if this is not specified)
         """
         timestamp = stamp or int(time.time())
-        self.current['gauge'][metric_name] = [(timestamp, value)]
+        self.current['gauge'][metric_name] = RunningAggregate()
+        self.current['gauge'][metric_name].append(value, timestamp)
 
     def gauge(self, metric_name, value, delta=False, prefix=False, stamp=None):
         """
@@ -123,22 +383,20 @@ class StatsdClient(object):
         timestamp = stamp or int(time.time())
 
         if metric_name in self.current['gauge']:
-            if delta:
-                last_stamp, last_value = self.current['gauge'][metric_name][-1]
-                new_value = last_value + value
-            else:
-                new_value = value
-            self.current['gauge'][metric_name].append((timestamp, new_value))
+            gauge = self.current['gauge'][metric_name]
+            gauge.append(gauge.last + value if delta else value, timestamp)
         else:
-            self.current['gauge'][metric_name] = [(timestamp, value)]
+            self.current['gauge'][metric_name] = RunningAggregate()
+            self.current['gauge'][metric_name].append(value, timestamp)
 
     def flush(self):
         if not self.current:
             return {'object': self.object.definition}
 
+        # swap stores instead of copying them, so nothing can change delivery while it is processed
         results = {}
-        delivery = copy.deepcopy(self.current)
-        self.current = defaultdict(dict)
+        delivery, self.current = self.current, defaultdict(dict)
+        self.generation += 1
 
         # histogram
         if 'timer' in delivery:
@@ -146,13 +404,22 @@ class StatsdClient(object):
             timestamp = int(time.time())
             for metric_name, metric_values in delivery['timer'].iteritems():
                 if len(metric_values):
-                    metric_values.sort()
                     length = len(metric_values)
-                    timers['G|%s' % metric_name] = [[timestamp, sum(metric_values) / float(length)]]
+                    if isinstance(metric_values, QuantileSketch):
+                        total, value_at = metric_values.sum, metric_values.value_at
+                    else:
+                        metric_values.sort()
+                        total, value_at = sum(metric_values), metric_values.__getitem__
+                    timers['G|%s' % metric_name] = [[timestamp, total / float(length)]]
                     timers['C|%s.count' % metric_name] = [[timestamp, length]]
-                    timers['G|%s.max' % metric_name] = [[timestamp, metric_values[-1]]]
-                    timers['G|%s.median' % metric_name] = [[timestamp, metric_values[int(round(length / 2 - 1))]]]
-                    timers['G|%s.pctl95' % metric_name] = [[timestamp, metric_values[-int(round(length * .05))]]]
+                    timers['G|%s.max' % metric_name] = [[timestamp, value_at(-1)]]
+                    timers['G|%s.median' % metric_name] = [[timestamp, value_at(int(round(length / 2 - 1)))]]
+                    timers['G|%s.pctl95' % metric_name] = [[timestamp, value_at(-int(round(length * .05)))]]
+
+                    for percentile in self.percentiles.get(metric_name.split('||')[0], ()):
+                        rank = max(int(math.ceil(length * percentile / 100.0)) - 1, 0)
+                        percentile_name = ('%g' % percentile).replace('.', '_')
+                        timers['G|%s.pctl%s' % (metric_name, percentile_name)] = [[timestamp, value_at(rank)]]
             results['timer'] = timers
 
         # counters
@@ -175,14 +442,11 @@ class StatsdClient(object):
         if 'gauge' in delivery:
             gauges = {}
             for k, v in delivery['gauge'].iteritems():
-                # Aggregate all observed gauges into a single record.
-                last_stamp = v[-1][0]  # Use the oldest timestamp.
-                total_value = 0
-                for timestamp, value in v:
-                    total_value += value
-
-                # Condense list of tuples 'v' into a list of a single tuple using an average value.
-                gauges['G|%s' % k] = [(last_stamp, float(total_value)/len(v))]
+                # Report the average of all observed values with the timestamp of the last one.
+                gauges['G|%s' % k] = [(v.stamp, float(v.sum) / v.count)]
+                if self.gauge_extremes:
+                    gauges['G|%s.min' % k] = [(v.stamp, v.min)]
+                    gauges['G|%s.max' % k] = [(v.stamp, v.max)]
             results['gauge'] = gauges
 
         # avg
@@ -190,12 +454,11 @@ class StatsdClient(object):
             averages = {}
             timestamp = int(time.time())  # Take a new timestamp here because it is not collected previously.
             for metric_name, metric_values in delivery['average'].iteritems():
-                if len(metric_values):
-                    length = len(metric_values)
-                    averages['G|%s' % metric_name] = [[timestamp, sum(metric_values) / float(length)]]
+                if metric_values.count:
+                    averages['G|%s' % metric_name] = [[timestamp, metric_values.sum / float(metric_values.count)]]
             results['average'] = averages
 
         return {
-            'metrics': copy.deepcopy(results),
+            'metrics': results,
             'object': self.object.definition
         }
@@ -116,7 +116,7 @@ class NginxManager(ObjectManager):
                             self.objects.unregister(obj=child_obj)
 
                         self.objects.objects[current_obj.id] = new_obj  # Replace old object in tank.
-                        current_obj.stop()  # stop old object
+                        current_obj.stop(keep_config=True)  # stop old object, the new one uses its config
                     elif current_obj.pid != data['pid']:
                         # check that the object pids didn't change
                         context.log.debug(
@@ -7,7 +7,7 @@ from gevent import queue, GreenletExit
 
 from amplify.agent.data.eventd import EventdClient
 from amplify.agent.data.metad import MetadClient
-from amplify.agent.data.statsd import StatsdClient
+from amplify.agent.data.statsd import StatsdClient, parse_percentiles
 
 from amplify.agent.data.configd import ConfigdClient
 from amplify.agent.common.context import context
@@ -48,7 +48,9 @@ class AbstractObject(object):
         self.queue = queue.Queue()
 
         # data clients
-        self.statsd = StatsdClient(object=self, interval=max(self.intervals.values()))
+        self.statsd = StatsdClient(
+            object=self, interval=max(self.intervals.values()), percentiles=self.timer_percentiles()
+        )
         self.eventd = EventdClient(object=self)
         self.metad = MetadClient(object=self)
         self.configd = self.data.get('configd', ConfigdClient(object=self))
@@ -62,6 +64,34 @@ class AbstractObject(object):
         self.definition_hash_cache = None
         self.local_id_cache = None
 
+    def config_option(self, key):
+        """
+        Option from object config or from the config file section of the object type
+
+        :param key: str option name
+        :return: option value or None
+        """
+        return context.app_config['containers'].get(self.type, {}).get(key) or \
+            context.app_config.get(self.type).get(key)
+
+    def timer_percentiles(self):
+        """
+        Extra percentiles for timers from object config or from the config file section of the object type, e.g.
+
+        [nginx]
+        timer_percentiles = nginx.http.request.time=50,90,99,99.9 nginx.upstream.response.time=99,99.9
+
+        :return: {} of timer name - tuple of percentiles
+        """
+        value = self.config_option('timer_percentiles')
+
+        try:
+            return parse_percentiles(value)
+        except:
+            context.log.error('failed to parse timer_percentiles "%s" for %s' % (value, self.type))
+            context.log.debug('additional info:', exc_info=True)
+            return {}
+
     @abc.abstractproperty
     def definition(self):
         return {'id': self.id, 'type': self.type}
@@ -8,6 +8,7 @@ import rstr
 
 from amplify.agent.common.context import context
 from amplify.agent.common.util import subp
+from amplify.agent.common.util.digest import FileDigests
 from amplify.agent.common.util.glib import glib
 from amplify.agent.common.util.ssl import ssl_analysis
 from amplify.agent.objects.nginx.config.parser import NginxConfigParser
@@ -63,6 +64,9 @@ class NginxConfig(object):
         self.plus_status_external_urls = []
         self.plus_status_internal_urls = []
         self.parser = NginxConfigParser(filename)
+        self.worker = None  # NginxConfigWorker if the config is parsed in a separate process
+        self.digests = FileDigests()  # digests of files and certificates for checksum, kept between parses
+        self.watcher = None  # NginxConfigWatcher if files of the config are watched for changes
         self.wait_until = 0
 
     def full_parse(self):
@@ -72,10 +76,14 @@ class NginxConfig(object):
         try:
             self.parser.parse()
             self._handle_parse()
+        except MemoryError:
+            raise  # results would be incomplete
         except Exception as e:
             context.log.error('failed to parse config at %s (due to %s)' % (self.filename, e.__class__.__name__))
             context.log.debug('additional info:', exc_info=True)
+            rows_cache, glob_cache = self.parser.rows_cache, self.parser.glob_cache
             self.parser = NginxConfigParser(self.filename)  # Re-init parser to discard partial data (if any)
+            self.parser.rows_cache, self.parser.glob_cache = rows_cache, glob_cache  # still good
 
         # Post-handling
 
@@ -85,6 +93,17 @@ class NginxConfig(object):
         # Go through log files and apply exclude rules (log files are added during .__colect_data()
         self._exclude_logs()
 
+    def stop(self):
+        """
+        Stops the worker process and the watcher of the config (if any), they are started again when needed
+        """
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
     def _handle_parse(self):
         self.tree = self.parser.tree
         self.files = self.parser.files
@@ -301,16 +320,25 @@ class NginxConfig(object):
 
         :return: str checksum
         """
+        hits, misses = self.digests.hits, self.digests.misses
+
         checksums = []
-        for file_path, file_data in self.files.iteritems():
-            checksums.append(hashlib.sha256(open(file_path).read()).hexdigest())
+        for file_path in sorted(self.files):
+            file_data = self.files[file_path]
+            checksums.append(self.digests.digest(file_path))
             checksums.append(file_data['permissions'])
             checksums.append(str(file_data['mtime']))
-        for dir_data in self.directories.itervalues():
+        for dir_path in sorted(self.directories):
+            dir_data = self.directories[dir_path]
             checksums.append(dir_data['permissions'])
             checksums.append(str(dir_data['mtime']))
-        for cert in self.ssl_certificates.iterkeys():
-            checksums.append(hashlib.sha256(open(cert).read()).hexdigest())
+        for cert in sorted(self.ssl_certificates):
+            checksums.append(self.digests.digest(cert))
+
+        self.digests.forget_others(set(self.files) | set(self.ssl_certificates))
+        context.log.debug('checksum of %s: %s files hashed, %s digests cached' % (
+            self.filename, self.digests.misses - misses, self.digests.hits - hits
+        ))
         return hashlib.sha256('.'.join(checksums)).hexdigest()
 
     def __parse_listen(self, listen):
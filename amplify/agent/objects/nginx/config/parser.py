@@ -2,32 +2,22 @@
 import glob
 import os
 import re
+import time
 from itertools import izip
 
-from pyparsing import (
-    Regex, Keyword, Literal, White, Word, alphanums, CharsNotIn, Forward, Group,
-    Optional, OneOrMore, ZeroOrMore, pythonStyleComment, lineno, LineStart, LineEnd,
-    oneOf, QuotedString, nestedExpr, ParserElement, ParseResults
-)
-
 from amplify.agent.common.context import context
 from amplify.agent.common.util.escape import prep_raw
+from amplify.agent.objects.nginx.config.scanner import NginxConfigScanner
 
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
-__credits__ = [
-    "Paul McGuire", "Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev",
-    "Grant Hulegaard"
-]
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
 __license__ = ""
 __maintainer__ = "Mike Belov"
 __email__ = "dedm@nginx.com"
 
 
-tokens_cache = {}
-
-
 IGNORED_DIRECTIVES = [
     'ssl_certificate_key',
     'ssl_client_certificate',
@@ -39,228 +29,29 @@ IGNORED_DIRECTIVES = [
 ]
 
 
-def set_line_number(string, location, tokens):
-    # check and limit CPU usage
-    context.check_and_limit_cpu_consumption()
-
-    if len(tokens) == 1:
-        line_number = lineno(location, string)
-        tokens_cache[tokens[0]] = line_number
-        tokens.line_number = line_number
-    else:
-        for item in tokens:
-            tokens.line_number = tokens_cache.get(item)
-
-
 class NginxConfigParser(object):
     """
     Nginx config parser originally based on https://github.com/fatiherikli/nginxparser
 
     Heavily customized and extended by Amplify team.
 
-    Optimized by Paul McGuire author of the pyparsing library (https://www.linkedin.com/in/ptmcg).  Paul's
-    optimizations (with minor compatibility tweaks during incorporation by Amplify team) resulted in over a 50%
-    performance improvement (~59%).
+    Files are read by NginxConfigScanner (a hand-written replacement of the pyparsing grammar used before),
+    the results are combined into a tree here.
 
     Parses single file into json structure
+
+    Parsed rows of every file are kept between runs with the stat signature of the file (inode, size, mtime),
+    so only changed files are read and scanned again when the same parser runs parse() once more.
+    Include globs are resolved on every run (results are cached until the directory changes), and the tree and index
+    are linked again from the rows.
     """
 
     max_size = 20*1024*1024  # 20 mb
 
-    # line starts/ends
-    line_start = LineStart().suppress()
-    line_end = LineEnd().suppress()
-
-    # constants
-    left_brace = Literal("{").suppress()
-    left_parentheses = Literal("(").suppress()
-    right_brace = Literal("}").suppress()
-    right_parentheses = Literal(")").suppress()
-    semicolon = Literal(";").suppress()
-    # space = White().suppress()
-    singleQuote = Literal("'").suppress()
-    doubleQuote = Literal('"').suppress()
-
-    # keywords
-    IF, SET, REWRITE, PERL_SET, LOG_FORMAT, ALIAS, RETURN, ERROR_PAGE, MAP, SERVER_NAME, SUB_FILTER, ADD_HEADER = (
-        map(
-            lambda x: x.setParseAction(set_line_number),
-            map(
-                Keyword,
-                "if set rewrite perl_set log_format alias return "
-                "error_page map server_name sub_filter add_header".split()
-            )
-        )
-    )
-
-    # IF = Keyword('if').setParseAction(set_line_number)
-    # SET = Keyword('set').setParseAction(set_line_number)
-    # REWRITE = Keyword('rewrite').setParseAction(set_line_number)
-    # PERL_SET = Keyword('perl_set').setParseAction(set_line_number)
-    # LOG_FORMAT = Keyword('log_format').setParseAction(set_line_number)
-    # ALIAS = Keyword('alias').setParseAction(set_line_number)
-    # RETURN = Keyword('return').setParseAction(set_line_number)
-    # ERROR_PAGE = Keyword('error_page').setParseAction(set_line_number)
-    # MAP = Keyword('map').setParseAction(set_line_number)
-    # SERVER_NAME = Keyword('server_name').setParseAction(set_line_number)
-    # SUB_FILTER = Keyword('sub_filter').setParseAction(set_line_number)
-    # ADD_HEADER = Keyword('add_header').setParseAction(set_line_number)
-
-    # lua keys
-    start_with_lua_key = Regex(r'lua_\S+').setParseAction(set_line_number)
-    contains_by_lua_key = Regex(r'\S+_by_lua\S*').setParseAction(set_line_number)
-
-    key = (
-        ~MAP & ~ALIAS & ~PERL_SET & ~IF & ~SET & ~REWRITE & ~SERVER_NAME & ~SUB_FILTER & ~ADD_HEADER
-    ) + Word(alphanums + '$_:%?"~<>\/-+.,*()[]"' + "'").setParseAction(set_line_number)
-
-    # For some reason this version from Paul McGuire does not trigger "set_line_number"...but the above does
-    # key = ~(MAP | ALIAS | PERL_SET | IF | SET | REWRITE | SERVER_NAME | SUB_FILTER) + \
-    #     Word(alphanums + '$_:%?"~<>\/-+.,*()[]"' + "'").setParseAction(set_line_number)
-
-    # values
-    value_string = QuotedString('"')  # Regex(r'"([^"]|\s)*\"')  # string value repurposed from map types
-    value_one = Regex(r'[^{};]*"[^\";]+"[^{};]*')
-    value_two = Regex(r'[^{};]*\'[^\';]+\'')
-    value_three = Regex(r'[^{};]+((\${[\d|\w]+(?=})})|[^{};])+')
-    value_four = Regex(r'[^{};]+(?!${.+})')
-    value = (value_string | value_one | value_two | value_three | value_four).setParseAction(set_line_number)
-    quotedValue = Regex(r'"[^;]+"|\'[^;]+\'').setParseAction(set_line_number)
-    rewrite_value = CharsNotIn(";").setParseAction(set_line_number)
-    any_value = CharsNotIn(";").setParseAction(set_line_number)
-    non_space_value = Regex(r'[^\'\";\s]+').setParseAction(set_line_number)
-    if_value = nestedExpr().setParseAction(set_line_number)  # Regex(r'\(.*\)')
-    language_include_value = CharsNotIn("'").setParseAction(set_line_number)
-    strict_value = CharsNotIn("{};").setParseAction(set_line_number)
-    sub_filter_value = (non_space_value | Regex(r"\'(.|\n)+?\'", )).setParseAction(set_line_number)
-    add_header_value = Regex(r'[^{};]*"[^"]+"').setParseAction(set_line_number)
-
-    # map values
-    map_value_one = QuotedString("'")  # Regex(r'\'([^\']|\s)*\'')
-    map_value_two = value_string
-    map_value_three = Regex(r'((\\\s|[^{};\s])*)')
-    map_value = (map_value_one | map_value_two | map_value_three).setParseAction(set_line_number)
-
-    # modifier for location uri [ = | ~ | ~* | ^~ ]
-    # ~ modifier = Literal("=") | Literal("~*") | Literal("~") | Literal("^~")
-    modifier = oneOf("= ~* ~ ^~")
-    assignment = (
-        key + Optional(value + Optional(value)) + semicolon
-        #
-        # could also write as
-        # key + value*(0,2) + semicolon
-    ).setParseAction(set_line_number)
-
-    # String helpers
-    string = (QuotedString("'") | QuotedString('"')).setParseAction(set_line_number)
-    multi_line_string = (
-        QuotedString("'", multiline=True) |
-        QuotedString('"', multiline=True)
-    ).setParseAction(set_line_number)
-    multi_line_string_unquoted = (
-        QuotedString("'", multiline=True, unquoteResults=False) |
-        QuotedString('"', multiline=True, unquoteResults=False)
-    ).setParseAction(set_line_number)
-
-    set = (
-        SET + any_value + semicolon
-    ).setParseAction(set_line_number)
-
-    rewrite = (
-        REWRITE + rewrite_value + semicolon
-    ).setParseAction(set_line_number)
-
-    perl_set = (
-        PERL_SET + key +
-        multi_line_string +
-        semicolon
-        # ~ singleQuote + language_include_value + singleQuote + semicolon
-    ).setParseAction(set_line_number)
-
-    lua_content = (
-        (start_with_lua_key | contains_by_lua_key) +
-        multi_line_string +
-        semicolon
-        # ~ singleQuote + language_include_value + singleQuote + semicolon
-    ).setParseAction(set_line_number)
-
-    alias = (
-        ALIAS + any_value + semicolon
-    ).setParseAction(set_line_number)
-
-    return_ = (
-        (RETURN | ERROR_PAGE) + value + Optional(any_value) + semicolon
-    ).setParseAction(set_line_number)
-
-    log_format = (
-        LOG_FORMAT + strict_value + any_value + semicolon
-    ).setParseAction(set_line_number)
-
-    server_name = (
-        SERVER_NAME + any_value + semicolon
-    ).setParseAction(set_line_number)
-
-    sub_filter = (
-        SUB_FILTER + sub_filter_value + sub_filter_value + semicolon
-    ).setParseAction(set_line_number)
-
-    add_header = (
-        ADD_HEADER + (non_space_value | string) +
-        Optional(multi_line_string_unquoted | add_header_value | non_space_value) +
-        Optional(non_space_value) +
-        semicolon
-    ).setParseAction(set_line_number)
-
-    # script
-    map_block = Forward()
-    map_block << Group(
-        Group(
-            MAP + map_value + map_value
-        ).setParseAction(set_line_number) +
-        left_brace +
-        Group(
-            ZeroOrMore(
-                Group(map_value + Optional(map_value) + semicolon)
-            ).setParseAction(set_line_number)
-        ) +
-        right_brace
-    )
-
-    block = Forward()
-    block << Group(
-        (
-            Group(
-                key + Optional(modifier) +
-                Optional(value + Optional(value))
-            ) |
-            Group(IF + if_value)
-        ).setParseAction(set_line_number) +
-        left_brace -  # <----- use '-' operator instead of '+' to get better error messages
-        Group(
-            ZeroOrMore(
-                Group(add_header) | Group(log_format) | Group(lua_content) | Group(perl_set) |
-                Group(set) | Group(rewrite) | Group(alias) | Group(return_) |
-                Group(assignment) | Group(server_name) | Group(sub_filter) |
-                map_block | block
-            ).setParseAction(set_line_number)
-        ).setParseAction(set_line_number) +
-        right_brace
-    )
-
-    script = OneOrMore(
-        Group(add_header) |
-        Group(log_format) | Group(perl_set) | Group(lua_content) | Group(alias) | Group(return_) |
-        Group(assignment) | Group(set) | Group(rewrite) | Group(sub_filter) |
-        map_block | block
-    ).ignore(pythonStyleComment)
-
     INCLUDE_RE = re.compile(r'[^#]*include\s+(?P<include_file>.*);')
     SSL_CERTIFICATE_RE = re.compile(r'[^#]*ssl_certificate\s+(?P<cert_file>.*);')
 
     def __init__(self, filename='/etc/nginx/nginx.conf'):
-        global tokens_cache
-        tokens_cache = {}
-
         self.filename = filename
         self.folder = '/'.join(self.filename.split('/')[:-1])  # stores path to folder with main config
         self.files = {}  # to prevent cycle files and line indexing
@@ -277,12 +68,26 @@ class NginxConfigParser(object):
         self.file_errors = []  # For broken files
         self.directory_errors = []  # for broken directories
 
+        self.rows_cache = {}  # file path - (signature, lines count, parsed rows), kept between runs
+        self.glob_cache = {}  # include pattern - (directory signature, file names), kept between runs
+
     def parse(self):
-        self.directories, self.files, self.parsed_cache = {}, {}, {}  # drop results from the previous run
-        self.tree = self.__logic_parse(self.__pyparse(self.filename))  # parse
+        # drop results from the previous run
+        self.directories, self.files, self.parsed_cache = {}, {}, {}
+        self.broken_files, self.broken_directories = set(), set()
+        self.file_errors, self.directory_errors = [], []
+        self.index, self.ssl_certificates, self.errors = [], [], []
+        self.directory_map = {}
+
+        self.tree = self.__logic_parse(self.__parse_files(self.filename))  # parse
         self.construct_directory_map()  # construct a tree of structure
         self.parsed_cache = {}  # drop cached, as it is no longer needed
 
+        # forget files that are not included anymore
+        for file_path in self.rows_cache.keys():
+            if file_path not in self.files:
+                del self.rows_cache[file_path]
+
     @staticmethod
     def get_filesystem_info(path):
         """
@@ -304,6 +109,20 @@ class NginxConfigParser(object):
 
         return size, mtime, permissions
 
+    @staticmethod
+    def get_file_signature(path):
+        """
+        Returns a signature that changes when a file is replaced or modified
+
+        :param path: str path to file
+        :return: (int, int, float) - inode, size, mtime or None if the file can't be stat'ed
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime
+
     def resolve_local_path(self, path):
         """
         Resolves local path
@@ -364,6 +183,35 @@ class NginxConfigParser(object):
         else:
             populate_directory(directory_path)
 
+    def glob(self, pattern):
+        """
+        Expands a glob pattern, results are cached until the mtime of the directory changes.
+        Patterns with wildcards in directory names are expanded every time.
+
+        :param pattern: str absolute path with wildcards in the file name
+        :return: [] of str file names
+        """
+        directory = os.path.dirname(pattern)
+        if glob.has_magic(directory):
+            return glob.glob(pattern)
+
+        try:
+            stat = os.stat(directory)
+            signature = stat.st_ino, stat.st_mtime
+        except OSError:
+            return glob.glob(pattern)
+
+        cached = self.glob_cache.get(pattern)
+        if cached and cached[0] == signature:
+            return list(cached[1])
+
+        result = glob.glob(pattern)
+
+        # a file added right now may not change the mtime (timestamps are coarser than the clock), check it next time
+        if time.time() - stat.st_mtime > 1:
+            self.glob_cache[pattern] = signature, result
+        return list(result)
+
     def resolve_includes(self, path):
         """
         Takes include path and returns all included files
@@ -378,7 +226,7 @@ class NginxConfigParser(object):
         # load all files
         result = []
         if '*' in path:
-            for filename in glob.glob(path):
+            for filename in self.glob(path):
                 result.append(filename)
         else:
             result.append(path)
@@ -437,7 +285,17 @@ class NginxConfigParser(object):
 
         return files_result, self.directories
 
-    def __pyparse(self, path):
+    def parse_source(self, source):
+        """
+        Parses contents of a single file
+
+        :param source: str file contents
+        :return: [] of rows (see NginxConfigScanner)
+        """
+        # tabs are expanded because pyparsing did it before and values with tabs should stay the same
+        return NginxConfigScanner(source.expandtabs()).parse()
+
+    def __parse_files(self, path):
         """
         Loads and parses all files
 
@@ -460,8 +318,17 @@ class NginxConfigParser(object):
                         self.file_errors.append(('NaasException', 'too large, %s bytes' % size))
                         continue
 
-                    source = open(file_path).read()
-                    lines_count = source.count('\n')
+                    # stat goes before read, so a file changed in between is read again on the next run
+                    signature = self.get_file_signature(file_path)
+                    cached = self.rows_cache.get(file_path)
+                    if cached and signature is not None and cached[0] == signature:
+                        source = None
+                        lines_count = cached[1]
+                    else:
+                        source = open(file_path).read()
+                        lines_count = source.count('\n')
+                except MemoryError:
+                    raise  # not a problem of the file
                 except Exception as e:
                     exception_name = e.__class__.__name__
                     exception_message = e.strerror if hasattr(e, 'strerror') else e.message
@@ -484,6 +351,14 @@ class NginxConfigParser(object):
                         'permissions': permissions
                     }
 
+                if source is None:
+                    # the file is not changed since the previous run
+                    parsed = cached[2]
+                    if parsed is not None:
+                        self.parsed_cache[file_index] = parsed
+                        result[file_index] = parsed
+                    continue
+
                 # Replace windows line endings with unix ones
                 source = source.replace('\r\n', '\n')
 
@@ -496,6 +371,7 @@ class NginxConfigParser(object):
                         break
 
                 if all_lines_commented:
+                    self.rows_cache[file_path] = (signature, lines_count, None)
                     continue
 
                 # replace \' with " because otherwise we cannot parse it
@@ -503,7 +379,9 @@ class NginxConfigParser(object):
                 source = source.replace(slash_quote, '"')
 
                 try:
-                    parsed = list(self.script.parseString(source, parseAll=True))
+                    parsed = self.parse_source(source)
+                except MemoryError:
+                    raise  # not a problem of the file
                 except Exception as e:
                     exception_name = e.__class__.__name__
                     message = 'failed to parse %s due to %s' % (file_path, exception_name)
@@ -513,7 +391,8 @@ class NginxConfigParser(object):
                     context.log.debug('additional info:', exc_info=True)
                     continue
 
-                self.parsed_cache[file_index] = parsed[:]
+                self.rows_cache[file_path] = (signature, lines_count, parsed)
+                self.parsed_cache[file_index] = parsed
                 result[file_index] = parsed
             else:
                 # if we already have the file parsed
@@ -526,29 +405,25 @@ class NginxConfigParser(object):
         """
         Parses input files and updates result dict
 
-        :param files: dict of files from pyparsing
+        :param files: dict of parsed files (file index - rows)
         :return: dict of config tree
         """
         if result is None:
             result = {}
 
-        for file_index, rowsp in files.iteritems():
-            rows = rowsp[:]
-            while len(rows):
-                row = rows.pop(0)
-                row_as_list = row.asList()
-
-                if isinstance(row_as_list[0], list):
+        for file_index, rows in files.iteritems():
+            for line_number, row, subrows in rows:
+                if subrows is not None:
                     # this is a new key
-                    key_bucket, value_bucket = row
-                    key = key_bucket[0]
+                    key = row[0]
+
+                    subtree_indexed = self.__idx_save(
+                        self.__logic_parse({file_index: subrows}),
+                        file_index, line_number
+                    )
 
-                    if len(key_bucket) == 1:
+                    if len(row) == 1:
                         # simple key, with one param
-                        subtree_indexed = self.__idx_save(
-                            self.__logic_parse({file_index: row[1]}),
-                            file_index, row.line_number
-                        )
                         if key == 'server':
                             # work with servers
                             if key in result:
@@ -560,34 +435,10 @@ class NginxConfigParser(object):
                     else:
                         # compound key (for locations and upstreams for example)
 
-                        def flatten(l):
-                            """Helper function that flattens a list of lists into a single list"""
-                            flattened = []
-                            for element in l:
-                                if not isinstance(element, list):
-                                    flattened.append(element)
-                                elif isinstance(element, ParseResults):
-                                    flattened += flatten(element.asList())
-                                else:
-                                    flattened += flatten(element)
-                            return flattened
-
-                        # with some changes to how we use pyparse we now might get "ParseResults" back...handle it here
-                        # typically occurs on "if" statements/blocks
-                        if not isinstance(key_bucket[1], (str, unicode)):
-                            key_bucket = key_bucket.asList() if isinstance(key_bucket, ParseResults) else key_bucket
-                            parse_results = key_bucket.pop()
-                            key_bucket += flatten(parse_results)
-
                         # remove all redundant spaces
-                        parts = filter(lambda x: x, ' '.join(key_bucket[1:]).split(' '))
+                        parts = filter(None, ' '.join(row[1:]).split(' '))
                         sub_key = ' '.join(parts)
 
-                        subtree_indexed = self.__idx_save(
-                            self.__logic_parse({file_index: row[1]}),
-                            file_index, row.line_number
-                        )
-
                         if key in result:
                             result[key][sub_key] = subtree_indexed
                         else:
@@ -616,7 +467,7 @@ class NginxConfigParser(object):
                         if gwe:
                             format_name, format_value = gwe.group(1), gwe.group(2)
 
-                            indexed_value = self.__idx_save(format_value, file_index, row.line_number)
+                            indexed_value = self.__idx_save(format_value, file_index, line_number)
                             # Handle odd Python auto-escaping of raw strings when packing/unpacking.
                             indexed_value = (prep_raw(indexed_value[0]), indexed_value[1])
 
@@ -625,14 +476,14 @@ class NginxConfigParser(object):
                             else:
                                 result[key] = {format_name: indexed_value}
                     elif key == 'include':
-                        indexed_value = self.__idx_save(value, file_index, row.line_number)
+                        indexed_value = self.__idx_save(value, file_index, line_number)
 
                         if key in result:
                             result[key].append(indexed_value)
                         else:
                             result[key] = [indexed_value]
 
-                        included_files = self.__pyparse(value)
+                        included_files = self.__parse_files(value)
                         self.__logic_parse(included_files, result=result)
                     elif key in ('access_log', 'error_log'):
                         # Handle access_log and error_log edge cases
@@ -643,7 +494,7 @@ class NginxConfigParser(object):
                             continue  # skip directives that are use nginx variables and it's not if
 
                         # Otherwise handle normally (see ending else below).
-                        indexed_value = self.__idx_save(value, file_index, row.line_number)
+                        indexed_value = self.__idx_save(value, file_index, line_number)
                         self.__simple_save(result, key, indexed_value)
                     elif key == 'ssl_certificate':
                         if value == '':
@@ -657,13 +508,13 @@ class NginxConfigParser(object):
                         self.populate_directories(cert_path)
 
                         # save config value
-                        indexed_value = self.__idx_save(value, file_index, row.line_number)
+                        indexed_value = self.__idx_save(value, file_index, line_number)
                         self.__simple_save(result, key, indexed_value)
                     elif key == 'add_header':
-                        indexed_value = self.__idx_save(value.replace('/s/', ' '), file_index, row.line_number)
+                        indexed_value = self.__idx_save(value.replace('/s/', ' '), file_index, line_number)
                         self.__simple_save(result, key, indexed_value)
                     else:
-                        indexed_value = self.__idx_save(value, file_index, row.line_number)
+                        indexed_value = self.__idx_save(value, file_index, line_number)
                         self.__simple_save(result, key, indexed_value)
 
         return result
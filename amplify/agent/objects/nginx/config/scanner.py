@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+import re
+from bisect import bisect_left
+
+from amplify.agent.common.context import context
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# whitespace and "#" comments between tokens
+SKIP_RE = re.compile(r'(?:[ \n\t\r]*#[^\n]*)*[ \n\t\r]*')
+COMMENTS_RE = re.compile(r'(?:[ \n\t\r]*#[^\n]*)*')
+NEWLINE_RE = re.compile(r'\n')
+
+# keys
+KEY_RE = re.compile(r'[a-zA-Z0-9$_:%?"~<>\\/\-+.,*()\[\]\']+')
+KEYWORD_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$')
+KEYWORD_RE = re.compile(r'[a-zA-Z0-9_$]*')
+RESERVED_KEYS = frozenset(('map', 'alias', 'perl_set', 'if', 'set', 'rewrite', 'server_name', 'sub_filter', 'add_header'))
+LUA_KEY_RES = (re.compile(r'lua_\S+'), re.compile(r'\S+_by_lua\S*'))
+MODIFIER_RE = re.compile(r'=|~\*|~|\^~')
+
+# values (the first one is a quoted string and gets unquoted)
+VALUE_RES = (
+    re.compile(r'"[^"\n\r]*"'),
+    re.compile(r'[^{};]*"[^\";]+"[^{};]*'),
+    re.compile(r'[^{};]*\'[^\';]+\''),
+    re.compile(r'[^{};]+((\${[\d|\w]+(?=})})|[^{};])+'),
+    re.compile(r'[^{};]+(?!${.+})'),
+)
+ANY_VALUE_RE = re.compile(r'[^;]+')
+STRICT_VALUE_RE = re.compile(r'[^{};]+')
+NON_SPACE_VALUE_RE = re.compile(r'[^\'\";\s]+')
+ADD_HEADER_VALUE_RE = re.compile(r'[^{};]*"[^"]+"')
+SUB_FILTER_VALUE_RE = re.compile(r"\'(.|\n)+?\'")
+MAP_VALUE_RES = (re.compile(r"'[^'\n\r]*'"), re.compile(r'"[^"\n\r]*"'), re.compile(r'((\\\s|[^{};\s])*)'))
+
+# quoted strings
+STRING_RES = (re.compile(r"'[^'\n\r]*'"), re.compile(r'"[^"\n\r]*"'))
+MULTI_LINE_STRING_RES = (re.compile(r"'[^']*'"), re.compile(r'"[^"]*"'))
+CONDITION_STRING_RE = re.compile(
+    r'''(?:"(?:[^"\n\r\\]|(?:"")|(?:\\x[0-9a-fA-F]+)|(?:\\.))*")|(?:'(?:[^'\n\r\\]|(?:'')|(?:\\x[0-9a-fA-F]+)|(?:\\.))*')'''
+)
+CONDITION_WORD_RE = re.compile(r'[^() \n\t\r]')
+
+
+class ParseException(Exception):
+    pass
+
+
+class ParseSyntaxException(ParseException):
+    """
+    A block was opened but not closed - no other way to read the file is tried after that
+    """
+    pass
+
+
+class NginxConfigScanner(object):
+    """
+    Linear time replacement of the pyparsing grammar which NginxConfigParser used before.
+
+    The source is read char by char with a recursive descent over blocks.  Token rules (where whitespace
+    is skipped, which regex a value matches, which line a directive is attributed to) are kept exactly as
+    they were in the grammar, so parsed trees and indexes don't change.
+
+    Parses one file into a list of rows:
+        (line_number, [key, value, ...], None) for directives
+        (line_number, [key, param, ...], [rows]) for blocks
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.length = len(source)
+        self.newlines = [match.start() for match in NEWLINE_RE.finditer(source)]
+        self.statements = 0
+        self.keyword_loc, self.keyword_word = None, None
+
+    def parse(self):
+        """
+        :return: [] of rows
+        """
+        end, rows = self.rows(0, in_block=False)
+        if not rows or self.skip(end) != self.length:
+            raise ParseException('failed to parse at line %s' % self.line_number(self.skip(end)))
+        return rows
+
+    def rows(self, loc, in_block=True):
+        rows = []
+        while True:
+            statement = self.statement(loc, in_block)
+            if statement is None:
+                return loc, rows
+
+            loc, row = statement
+            rows.append(row)
+
+            # check and limit CPU usage
+            self.statements += 1
+            if not self.statements % 100:
+                context.check_and_limit_cpu_consumption()
+
+    def statement(self, loc, in_block):
+        start = self.skip(loc)
+        rules = self.block_rules if in_block else self.rules
+        for rule in rules:
+            result = rule(self, start)
+            if result is not None:
+                end, tokens, mark = result
+                line_number = self.line_number(mark if len(tokens) > 1 else start)
+                return end, (line_number, tokens, None)
+
+        for rule in (NginxConfigScanner.map_block, NginxConfigScanner.block):
+            result = rule(self, start)
+            if result is not None:
+                end, tokens, rows = result
+                return end, (self.line_number(start), tokens, rows)
+
+    def line_number(self, loc):
+        return bisect_left(self.newlines, loc) + 1
+
+    # chars and tokens
+
+    def skip(self, loc):
+        return SKIP_RE.match(self.source, loc).end()
+
+    def skip_comments(self, loc):
+        return COMMENTS_RE.match(self.source, loc).end()
+
+    def word(self, loc):
+        """
+        Keyword chars at the location (the last result is kept, as every rule starts by checking its keyword)
+
+        :return: str or None if the location is in the middle of a word
+        """
+        if loc != self.keyword_loc:
+            self.keyword_loc = loc
+            if loc == 0 or self.source[loc - 1] not in KEYWORD_CHARS:
+                self.keyword_word = KEYWORD_RE.match(self.source, loc).group()
+            else:
+                self.keyword_word = None
+        return self.keyword_word
+
+    def keyword(self, loc, word):
+        """
+        :return: int end of the keyword or None
+        """
+        if self.word(loc) == word:
+            return loc + len(word)
+
+    def literal(self, loc, char):
+        loc = self.skip(loc)
+        if self.source.startswith(char, loc):
+            return loc + 1
+
+    def match(self, loc, regex):
+        """
+        :return: (int end, str token, int start) or None
+        """
+        start = self.skip(loc)
+        result = regex.match(self.source, start)
+        if result is not None:
+            return result.end(), result.group(), start
+
+    def chars(self, loc, regex):
+        """
+        Like match, but only comments are skipped before the token - whitespace becomes a part of it
+        """
+        start = self.skip_comments(loc)
+        result = regex.match(self.source, start)
+        if result is not None:
+            return result.end(), result.group(), start
+
+    def quoted(self, loc, regexes, unquote=True):
+        for regex in regexes:
+            result = self.match(loc, regex)
+            if result is not None:
+                end, token, start = result
+                return end, token[1:-1] if unquote else token, start
+
+    def key(self, loc):
+        start = self.skip(loc)
+        if self.word(start) not in RESERVED_KEYS:
+            return self.match(start, KEY_RE)
+
+    def value(self, loc):
+        start = self.skip(loc)
+        if self.source.startswith('"', start):
+            result = VALUE_RES[0].match(self.source, start)
+            if result is not None:
+                return result.end(), result.group()[1:-1], start
+
+        for regex in VALUE_RES[1:]:
+            result = regex.match(self.source, start)
+            if result is not None:
+                return result.end(), result.group(), start
+
+    def map_value(self, loc):
+        return self.quoted(loc, MAP_VALUE_RES[:2]) or self.match(loc, MAP_VALUE_RES[2])
+
+    def values(self, loc, tokens):
+        """
+        Up to two values after a key.  The second one is attributed to the place where the first one ended
+
+        :return: (int end, int mark) or None
+        """
+        first = self.value(loc)
+        if first is None:
+            return None
+
+        end, token, mark = first
+        tokens.append(token)
+
+        second = self.value(end)
+        if second is None:
+            return end, mark
+
+        tokens.append(second[1])
+        return second[0], end
+
+    def condition(self, loc):
+        """
+        Words and quoted strings inside parentheses (nested ones are flattened)
+
+        :return: (int end, [] of str) or None
+        """
+        loc = self.literal(loc, '(')
+        if loc is None:
+            return None
+
+        words, source, length = [], self.source, self.length
+        while True:
+            start = self.skip(loc)
+
+            quoted = CONDITION_STRING_RE.match(source, start)
+            if quoted is not None:
+                loc = quoted.end()
+                words.append(quoted.group())
+                continue
+
+            if source.startswith('(', start):
+                nested = self.condition(start)
+                if nested is not None:
+                    loc, nested_words = nested
+                    words += nested_words
+                    continue
+
+            end = start
+            while end < length and CONDITION_WORD_RE.match(source, end) and not CONDITION_STRING_RE.match(source, end):
+                end += 1
+            if end == start:
+                break
+
+            loc = end
+            words.append(source[start:end].strip())
+
+        loc = self.literal(loc, ')')
+        if loc is not None:
+            return loc, words
+
+    # directives: each rule returns (int end, [] of str tokens, int mark) or None
+    # line number of a directive is the line of its mark, or the line of the key if there is only a key
+
+    def add_header(self, start):
+        end = self.keyword(start, 'add_header')
+        if end is None:
+            return None
+
+        tokens = ['add_header']
+        result = self.match(end, NON_SPACE_VALUE_RE)
+        if result is None:
+            result = self.quoted(end, STRING_RES)
+            if result is None:
+                return None
+            result = result[0], result[1], end
+
+        end, token, mark = result
+        tokens.append(token)
+
+        result = self.quoted(end, MULTI_LINE_STRING_RES, unquote=False)
+        if result is not None:
+            result = result[0], result[1], end
+        else:
+            result = self.match(end, ADD_HEADER_VALUE_RE) or self.match(end, NON_SPACE_VALUE_RE)
+
+        if result is not None:
+            end, token, mark = result
+            tokens.append(token)
+
+        result = self.match(end, NON_SPACE_VALUE_RE)
+        if result is not None:
+            end, token, mark = result
+            tokens.append(token)
+
+        end = self.literal(end, ';')
+        if end is not None:
+            return end, tokens, mark
+
+    def log_format(self, start):
+        end = self.keyword(start, 'log_format')
+        if end is None:
+            return None
+
+        name = self.chars(end, STRICT_VALUE_RE)
+        if name is None:
+            return None
+
+        value = self.chars(name[0], ANY_VALUE_RE)
+        if value is None:
+            return None
+
+        end, token, mark = value
+        end = self.literal(end, ';')
+        if end is not None:
+            return end, ['log_format', name[1], token], mark
+
+    def perl_set(self, start):
+        end = self.keyword(start, 'perl_set')
+        if end is None:
+            return None
+
+        key = self.key(end)
+        if key is None:
+            return None
+
+        return self.language_value(key[0], ['perl_set', key[1]])
+
+    def lua_content(self, start):
+        for regex in LUA_KEY_RES:
+            result = regex.match(self.source, start)
+            if result is not None:
+                return self.language_value(result.end(), [result.group()])
+
+    def language_value(self, loc, tokens):
+        result = self.quoted(loc, MULTI_LINE_STRING_RES)
+        if result is None:
+            return None
+
+        tokens.append(result[1])
+        end = self.literal(result[0], ';')
+        if end is not None:
+            return end, tokens, loc
+
+    def any_value(self, start, word):
+        end = self.keyword(start, word)
+        if end is None:
+            return None
+
+        value = self.chars(end, ANY_VALUE_RE)
+        if value is None:
+            return None
+
+        end, token, mark = value
+        end = self.literal(end, ';')
+        if end is not None:
+            return end, [word, token], mark
+
+    def set(self, start):
+        return self.any_value(start, 'set')
+
+    def rewrite(self, start):
+        return self.any_value(start, 'rewrite')
+
+    def alias(self, start):
+        return self.any_value(start, 'alias')
+
+    def server_name(self, start):
+        return self.any_value(start, 'server_name')
+
+    def return_(self, start):
+        for word in ('return', 'error_page'):
+            end = self.keyword(start, word)
+            if end is not None:
+                break
+        else:
+            return None
+
+        value = self.value(end)
+        if value is None:
+            return None
+
+        tokens, mark = [word, value[1]], end
+        end = value[0]
+
+        value = self.chars(end, ANY_VALUE_RE)
+        if value is not None:
+            end, token, mark = value
+            tokens.append(token)
+
+        end = self.literal(end, ';')
+        if end is not None:
+            return end, tokens, mark
+
+    def assignment(self, start):
+        key = self.key(start)
+        if key is None:
+            return None
+
+        end, token, mark = key
+        tokens = [token]
+
+        values = self.values(end, tokens)
+        if values is not None:
+            end, mark = values
+
+        end = self.literal(end, ';')
+        if end is not None:
+            return end, tokens, mark
+
+    def sub_filter(self, start):
+        end = self.keyword(start, 'sub_filter')
+        if end is None:
+            return None
+
+        tokens = ['sub_filter']
+        for _ in xrange(2):
+            mark = end
+            result = self.match(end, NON_SPACE_VALUE_RE) or self.match(end, SUB_FILTER_VALUE_RE)
+            if result is None:
+                return None
+            end = result[0]
+            tokens.append(result[1])
+
+        end = self.literal(end, ';')
+        if end is not None:
+            return end, tokens, mark
+
+    rules = (add_header, log_format, perl_set, lua_content, alias, return_, assignment, set, rewrite, sub_filter)
+    block_rules = (
+        add_header, log_format, lua_content, perl_set, set, rewrite, alias, return_, assignment, server_name, sub_filter
+    )
+
+    # blocks: each rule returns (int end, [] of str header tokens, [] of rows) or None
+
+    def map_block(self, start):
+        end = self.keyword(start, 'map')
+        if end is None:
+            return None
+
+        tokens = ['map']
+        for _ in xrange(2):
+            result = self.map_value(end)
+            if result is None:
+                return None
+            end = result[0]
+            tokens.append(result[1])
+
+        end = self.literal(end, '{')
+        if end is None:
+            return None
+
+        rows = []
+        while True:
+            entry_start = self.skip(end)
+            result = self.map_value(entry_start)
+            if result is None:
+                break
+
+            entry_end, token, _ = result
+            entry = [token]
+            result = self.map_value(entry_end)
+            if result is not None:
+                entry_end = result[0]
+                entry.append(result[1])
+
+            entry_end = self.literal(entry_end, ';')
+            if entry_end is None:
+                break
+
+            end = entry_end
+            rows.append((self.line_number(entry_start), entry, None))
+
+        end = self.literal(end, '}')
+        if end is not None:
+            return end, tokens, rows
+
+    def block(self, start):
+        key = self.key(start)
+        if key is not None:
+            end, token, _ = key
+            tokens = [token]
+
+            modifier = self.match(end, MODIFIER_RE)
+            if modifier is not None:
+                end = modifier[0]
+                tokens.append(modifier[1])
+
+            values = self.values(end, tokens)
+            if values is not None:
+                end = values[0]
+        else:
+            end = self.keyword(start, 'if')
+            if end is None:
+                return None
+
+            condition = self.condition(end)
+            if condition is None:
+                return None
+
+            end, words = condition
+            tokens = ['if', ' '.join(words)]
+
+        end = self.literal(end, '{')
+        if end is None:
+            return None
+
+        body_end, rows = self.rows(end)
+
+        end = self.literal(body_end, '}')
+        if end is None:
+            raise ParseSyntaxException('expected "}" at line %s' % self.line_number(self.skip(body_end)))
+        return end, tokens, rows
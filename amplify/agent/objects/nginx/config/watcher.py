@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import os
+
+from gevent.event import Event
+
+from amplify.agent.common.context import context
+from amplify.agent.common.util import inotify
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class NginxConfigWatcher(object):
+    """
+    Tells if files and directories of a config might have changed since the previous check, so the collector
+    doesn't have to read all config files just to find out that nothing changed.
+
+    Directories of the files (and of the files symlinks point to) are watched with the inotify instance shared by
+    the process (see inotify.shared_watches()), any event in them means a change.  If inotify is not available (or
+    runs out of watches), the files and directories are stat'ed on every check instead.  Paths which are new for the watcher also count as a change once, because they could have
+    been changed before they were watched.
+    """
+
+    watch_mask = inotify.IN_MODIFY | inotify.IN_ATTRIB | inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | \
+        inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF
+
+    def __init__(self):
+        self.dirty = True  # nothing is known yet
+        self.paths = set()
+        self.stats = {}  # path - stat signature, when polling
+        self.watches = set()  # watched directories, when inotify is used
+        self._changes = Event()  # set on events in any of the watched directories
+        self._shared = None  # inotify.FileWatches
+
+        if inotify.available():
+            try:
+                self._shared = inotify.shared_watches()
+            except OSError as e:
+                context.log.debug('could not use inotify to watch configs: %s, will poll' % e)
+
+    @staticmethod
+    def stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime, stat.st_mode
+
+    def changed(self):
+        """
+        :return: bool - True if something might have changed since the previous call
+        """
+        if self._shared is not None:
+            try:
+                self._shared.read()  # events which the reader greenlet hasn't dispatched yet
+            except OSError as e:
+                context.log.debug('failed to read inotify events: %s, will poll' % e)
+                self._poll()
+                self.dirty = True
+
+            if self._changes.is_set():
+                self._changes.clear()
+                self.dirty = True
+        else:
+            for path in self.paths:
+                stat = self.stat(path)
+                if stat != self.stats.get(path):
+                    self.stats[path] = stat
+                    self.dirty = True
+
+        dirty, self.dirty = self.dirty, False
+        return dirty
+
+    def watch(self, paths):
+        """
+        Sets files and directories to watch, usually right after the config structure is collected
+
+        :param paths: iterable of str paths of files and directories
+        """
+        paths = set(paths)
+        if paths - self.paths:
+            self.dirty = True
+        self.paths = paths
+
+        if self._shared is not None:
+            directories = set()
+            for path in paths:
+                if path.endswith('/'):
+                    directories.add(os.path.realpath(path))
+                else:
+                    # the directory of the link and the directory of the file it points to
+                    directories.add(os.path.realpath(os.path.dirname(path)))
+                    directories.add(os.path.dirname(os.path.realpath(path)))
+
+            # a directory which doesn't exist yet is watched through its closest existing parent
+            for directory in list(directories):
+                while not os.path.isdir(directory) and directory != '/':
+                    directories.discard(directory)
+                    directory = os.path.dirname(directory)
+                    directories.add(directory)
+
+            try:
+                for directory in self.watches - directories:
+                    self.watches.discard(directory)
+                    self._shared.unsubscribe_directory(directory, self._changes)
+                for directory in directories:
+                    # a removed directory is not watched by the kernel anymore, even if it is created again
+                    if directory not in self.watches or not self._shared.watching(directory):
+                        self._shared.subscribe_directory(directory, self.watch_mask, event=self._changes)
+                        self.watches.add(directory)
+            except OSError as e:
+                context.log.debug('failed to watch config directories: %s, will poll' % e)
+                self._poll()
+                self.dirty = True
+
+        if self._shared is None:
+            for path in paths:
+                if path not in self.stats:
+                    self.stats[path] = self.stat(path)
+            for path in set(self.stats) - paths:
+                del self.stats[path]
+
+    def _poll(self):
+        """
+        Switches to polling
+        """
+        self.stop()
+        self.stats = dict((path, self.stat(path)) for path in self.paths)
+
+    def stop(self):
+        if self._shared is not None:
+            for directory in self.watches:
+                self._shared.unsubscribe_directory(directory, self._changes)
+            self._shared = None
+        self.watches = set()
+
+    def __del__(self):
+        self.stop()
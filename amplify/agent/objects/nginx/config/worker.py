@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Parses nginx configs in a separate process.
+
+Parsing of a large config takes seconds of CPU, and the agent's collectors, the bridge and the syslog listeners
+would stall for all that time if it ran in the agent's event loop.  The worker is a fresh python process (not a fork,
+because a forked child would run the agent's greenlets as soon as it yields to the hub) which lives as long as
+the config object.  It keeps the parser's cache of rows between requests, so only changed files are read again.
+
+Messages go through the worker's stdin and stdout, each one prefixed with its length.  The setup message is pickled
+(it carries the agent config) and is answered with "ready" once the worker is set up, the rest are marshalled, because unmarshalling is several times faster and results are
+received in the agent's event loop.  Results are sent attribute by attribute, so other greenlets can run in between.
+The last message carries the checksum and the counters of file digests computed or taken from the worker's cache.
+"""
+import cPickle
+import gc
+import marshal
+import os
+import resource
+import struct
+import sys
+
+import gevent
+from gevent import subprocess
+
+from amplify.agent.common.context import context
+from amplify.agent.common.errors import AmplifyWorkerError
+from amplify.agent.common.util.digest import FileDigests
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+DEFAULT_TIMEOUT = 120.0  # seconds
+DEFAULT_MEMORY_LIMIT = 1024  # MB of virtual memory
+
+# NginxConfig attributes filled by parsing and ssl analysis, they are sent back to the agent
+PARSED_ATTRIBUTES = (
+    'tree',
+    'files',
+    'directories',
+    'directory_map',
+    'index',
+    'parser_errors',
+    'log_formats',
+    'access_logs',
+    'error_logs',
+    'ssl_certificates',
+    'stub_status_urls',
+    'plus_status_external_urls',
+    'plus_status_internal_urls',
+)
+
+HEADER = struct.Struct('!I')
+
+
+def write_message(f, message, dumps=marshal.dumps):
+    data = dumps(message)
+    f.write(HEADER.pack(len(data)) + data)
+    f.flush()
+
+
+def read_message(f, loads=marshal.loads):
+    """
+    :return: message or None if the other side has closed the pipe
+    """
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+
+    size, = HEADER.unpack(header)
+    data = f.read(size)
+    if len(data) < size:
+        return None
+
+    return loads(data)
+
+
+def unmarshal(data):
+    """
+    Unmarshals without garbage collection, which otherwise runs many times over the whole heap while millions of
+    new objects are created (marshalled data has no reference cycles anyway)
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return marshal.loads(data)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def pickle(message):
+    return cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+
+
+class NginxConfigWorker(object):
+    """
+    Agent side of the worker: starts the process and sends parse requests to it
+    """
+
+    command = [sys.executable, '-m', __name__]
+
+    def __init__(self, config, timeout=DEFAULT_TIMEOUT, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """
+        :param config: NginxConfig to parse (its attributes are updated with the results)
+        :param timeout: float max seconds to wait for a result, the worker is killed after that
+        :param memory_limit: int max MB of virtual memory of the worker
+        """
+        self.config = config
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.process = None
+
+    def start(self):
+        """
+        Starts the process and waits until it is set up
+
+        :raises AmplifyWorkerError: "failed to start" if the process couldn't be started or exited during the setup
+        """
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))  # the agent may have extended its path
+        try:
+            self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                env=env,
+                close_fds=True
+            )
+            write_message(self.process.stdin, dict(
+                app=context.app_name,
+                app_config=context.app_config,
+                app_config_values=context.app_config.config,  # class level dict, it is not pickled with the object
+                filename=self.config.filename,
+                binary=self.config.binary,
+                prefix=self.config.prefix,
+                memory_limit=self.memory_limit * 1024 * 1024
+            ), dumps=pickle)
+            ready = read_message(self.process.stdout)
+        except (IOError, OSError) as e:
+            context.log.debug('failed to start config worker due to %s' % e.__class__.__name__, exc_info=True)
+            ready = None
+
+        if ready is None:
+            self.stop()
+            raise AmplifyWorkerError(message='failed to start', payload=dict(command=' '.join(self.command)))
+        context.log.debug('started config worker for %s, pid %s' % (self.config.filename, self.process.pid))
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        process, self.process = self.process, None
+        try:
+            process.kill()
+        except OSError:
+            pass  # already finished
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+        context.log.debug('stopped config worker for %s, pid %s' % (self.config.filename, process.pid))
+
+    def parse(self, ssl_analysis=False):
+        """
+        Parses the config (and runs ssl analysis) in the worker and updates the config with the results.
+        The worker is stopped if it fails or doesn't finish in time, a new one is started with the next request.
+
+        :param ssl_analysis: bool - run ssl analysis of certificates or not
+        :return: str checksum of the config
+        """
+        results = {}
+        try:
+            with gevent.Timeout(self.timeout):
+                if self.process is None:
+                    self.start()
+
+                write_message(self.process.stdin, dict(ssl_analysis=ssl_analysis))
+                while True:
+                    response = read_message(self.process.stdout, loads=unmarshal)
+                    if response is None:
+                        returncode = self.process.wait()
+                        self.stop()
+                        raise AmplifyWorkerError(message='exited', payload=dict(returncode=returncode))
+
+                    kind, name, value = response
+                    if kind == 'error':
+                        if name == 'MemoryError':
+                            self.stop()  # the worker exits by itself, but there is no need to wait for that
+                        raise AmplifyWorkerError(message=name, payload=dict(memory_limit=self.memory_limit))
+                    elif kind == 'done':
+                        checksum, digest_hits, digest_misses = value
+                        break
+
+                    results[name] = value
+                    gevent.sleep(0)  # a large tree takes a while to unmarshal, let others run
+        except gevent.Timeout:
+            self.stop()
+            raise AmplifyWorkerError(message='timed out', payload=dict(timeout=self.timeout))
+        except (IOError, OSError) as e:
+            self.stop()
+            raise AmplifyWorkerError(message=e.__class__.__name__)
+
+        # update the config only when all results are received
+        for attribute in PARSED_ATTRIBUTES:
+            setattr(self.config, attribute, results[attribute])
+
+        # digests are cached in the worker, only their counters are kept by the agent
+        self.config.digests.hits += digest_hits
+        self.config.digests.misses += digest_misses
+        context.log.debug('checksum of %s in config worker: %s files hashed, %s digests cached' % (
+            self.config.filename, digest_misses, digest_hits
+        ))
+        return checksum
+
+
+def main():
+    """
+    Worker side: parses the config on every request until the agent closes the pipe
+    """
+    requests = sys.stdin
+    responses = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)  # stdout is only for responses, anything printed goes to stderr
+
+    setup = read_message(requests, loads=cPickle.loads)
+    if setup is None:
+        return
+
+    app_config = setup['app_config']
+    app_config.config = setup['app_config_values']
+    context.setup(app=setup['app'], app_config=app_config)
+
+    from amplify.agent.objects.nginx.config.config import NginxConfig
+
+    resource.setrlimit(resource.RLIMIT_AS, (setup['memory_limit'], setup['memory_limit']))
+    write_message(responses, ('ready', None, None))
+
+    rows_cache, glob_cache, digests = {}, {}, FileDigests()
+    while True:
+        request = read_message(requests)
+        if request is None:
+            break
+
+        try:
+            config = NginxConfig(setup['filename'], binary=setup['binary'], prefix=setup['prefix'])
+            config.parser.rows_cache, config.parser.glob_cache = rows_cache, glob_cache
+            config.digests = digests
+            config.full_parse()
+            rows_cache, glob_cache = config.parser.rows_cache, config.parser.glob_cache
+
+            if request['ssl_analysis']:
+                config.run_ssl_analysis()
+
+            hits, misses = digests.hits, digests.misses
+            checksum = config.checksum()
+            for attribute in PARSED_ATTRIBUTES:
+                write_message(responses, ('value', attribute, getattr(config, attribute)))
+            write_message(responses, ('done', None, (checksum, digests.hits - hits, digests.misses - misses)))
+        except MemoryError:
+            write_message(responses, ('error', 'MemoryError', None))
+            break
+        except Exception as e:
+            context.log.error('config worker failed to parse %s due to %s' % (setup['filename'], e.__class__.__name__))
+            context.log.debug('additional info:', exc_info=True)
+            write_message(responses, ('error', e.__class__.__name__, None))
+        finally:
+            config = None  # not needed until the next request
+
+
+if __name__ == '__main__':
+    main()
@@ -60,3 +60,134 @@ class Filter(object):
                     return False
 
         return True
+
+
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+MAX_COMBINED_GROUPS = 99  # sre supports only 100 groups per regex
+
+
+class FilterFieldIndex(object):
+    """
+    Conditions of all filters for one variable of a parsed line
+    """
+    def __init__(self, key):
+        self.key = key
+        self.exact = {}  # value - [] of filter indexes (for values that are not valid regexes)
+        self.prefixes = {}  # length - {} of literal - [] of filter indexes (re.match of a literal is a prefix check)
+        self.combined = []  # [] of (combined regex, [] of (group, filter index))
+        self.regexes = []  # [] of (regex, filter index) which can't be combined
+        self.pending = []  # [] of (regex, filter index) to be combined
+
+    def add(self, filter_value, index):
+        if isinstance(filter_value, RE_TYPE):
+            pattern = filter_value.pattern
+            if filter_value.flags == 0 and not REGEX_SPECIAL_CHARS.intersection(pattern):
+                literals = self.prefixes.setdefault(len(pattern), {})
+                literals.setdefault(pattern, []).append(index)
+            elif filter_value.flags == 0 and '(?P' not in pattern and not re.search(r'\\[0-9]', pattern):
+                self.pending.append((filter_value, index))
+            else:
+                self.regexes.append((filter_value, index))
+        elif isinstance(filter_value, str):
+            self.exact.setdefault(filter_value, []).append(index)
+
+    def compile(self):
+        """
+        Combines regexes into alternations of optional lookaheads, so every regex gets its own group in one match
+        """
+        chunks, chunk, group = [], [], 1
+        for filter_value, index in self.pending:
+            if group + 1 + filter_value.groups > MAX_COMBINED_GROUPS:
+                chunks.append(chunk)
+                chunk, group = [], 1
+            chunk.append((filter_value, index, group))
+            group += 1 + filter_value.groups
+
+        if chunk:
+            chunks.append(chunk)
+
+        for chunk in chunks:
+            pattern = ''.join('(?=(%s))?' % filter_value.pattern for filter_value, _, _ in chunk)
+            try:
+                self.combined.append((re.compile(pattern), [(group, index) for _, index, group in chunk]))
+            except:
+                self.regexes.extend((filter_value, index) for filter_value, index, _ in chunk)
+
+        self.pending = []
+
+    def match(self, value):
+        """
+        :param value: str value of the variable
+        :return: [] of indexes of filters whose condition matched
+        """
+        matched = []
+
+        if value in self.exact:
+            matched.extend(self.exact[value])
+
+        for length, literals in self.prefixes.iteritems():
+            prefix = value[:length]
+            if prefix in literals:
+                matched.extend(literals[prefix])
+
+        for combined_regex, groups in self.combined:
+            result = combined_regex.match(value)
+            if result:
+                for group, index in groups:
+                    if result.group(group) is not None:
+                        matched.append(index)
+
+        for filter_value, index in self.regexes:
+            if filter_value.match(value):
+                matched.append(index)
+
+        return matched
+
+
+class FilterIndex(object):
+    """
+    All filters of a log compiled into one structure, so a parsed line is matched against all of them at once:
+    every variable is converted to str once, exact values and plain literals are checked with hash lookups,
+    and regexes for the same variable share a single combined regex
+
+    Gives the same results as calling Filter.match for every filter
+    """
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.conditions = [len(log_filter.data) for log_filter in self.filters]
+        self.unconditional = [index for index, conditions in enumerate(self.conditions) if not conditions]
+        self.fields = {}
+
+        for index, log_filter in enumerate(self.filters):
+            for filter_key, filter_value in log_filter.data.iteritems():
+                if filter_key not in self.fields:
+                    self.fields[filter_key] = FilterFieldIndex(filter_key)
+                self.fields[filter_key].add(filter_value, index)
+
+        for field in self.fields.itervalues():
+            field.compile()
+
+    def matching(self, parsed):
+        """
+        :param parsed: {} of parsed string
+        :return: [] of matched filters (in the same order as they were passed)
+        """
+        hits = {}
+        for filter_key, field in self.fields.iteritems():
+            if filter_key in parsed:
+                for index in field.match(str(parsed[filter_key])):
+                    hits[index] = hits.get(index, 0) + 1
+
+        matched = [index for index, count in hits.iteritems() if count == self.conditions[index]]
+        if self.unconditional:
+            matched.extend(self.unconditional)
+
+        return [self.filters[index] for index in sorted(matched)]
+
+    def match(self, parsed):
+        """
+        :param parsed: {} of parsed string
+        :return: set of filter_rule_id of matched filters
+        """
+        return set(log_filter.filter_rule_id for log_filter in self.matching(parsed))
@@ -15,13 +15,189 @@ __email__ = "dedm@nginx.com"
 
 REQUEST_RE = re.compile(r'(?P<request_method>[A-Z]+) (?P<request_uri>/.*) (?P<server_protocol>.+)')
 
+COMBINED_FORMAT = '$remote_addr - $remote_user [$time_local] "$request" ' + \
+                  '$status $body_bytes_sent "$http_referer" "$http_user_agent"'
+
+
+def parse_time_value(value):
+    """
+    Parses a time variable (like "0.010, 2.001") to a list of floats
+
+    :param value: str value
+    :return: [] of floats or None if there is nothing to store
+    """
+    # skip empty vars
+    if value == '-':
+        return None
+
+    array_value = []
+    for x in value.replace(' ', '').split(','):
+        x = float(x)
+        # workaround for an old nginx bug with time. ask lonerr@ for details
+        if x > 10000000:
+            continue
+        else:
+            array_value.append(x)
+    return array_value or None
+
+
+def parse_comma_separated_value(value):
+    """
+    Parses a comma separated variable (like "200, 502") to a list of strings
+
+    :param value: str value
+    :return: [] of str
+    """
+    if ',' in value:
+        return value.replace(' ', '').split(',')  # remove spaces and split values into list
+    else:
+        return [value]
+
+
+class NginxAccessLogTokenizer(object):
+    """
+    Regex-free tokenizer for the combined format and its simple extensions, where every extra variable is separated
+    by a space and is either quoted or has a name, for example:
+
+    $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent"
+    "$http_x_forwarded_for" rt=$request_time ua="$upstream_addr" cs=$upstream_cache_status
+
+    Lines are split on quotes and brackets with plain str methods.  Since nginx escapes quotes inside of values (as
+    \x22), the result is the same as the regex would give.  If a line doesn't fit the expected shape the tokenizer
+    returns None, so the caller can fall back to regex.
+    """
+    combined_keys = [
+        'remote_addr', 'remote_user', 'time_local', 'request',
+        'status', 'body_bytes_sent', 'http_referer', 'http_user_agent'
+    ]
+
+    item_re = re.compile(r'(?P<name>[^"$\s]*)(?P<quote>"?)\$(?P<key>[a-zA-Z0-9_]+)(?P=quote)$')
+
+    def __init__(self, keys, items):
+        """
+        :param keys: [] of variable names in the order of tokenize() results
+        :param items: [] of (opening, quoted, terminator, validator) for variables after the combined part
+        """
+        self.keys = keys
+        self.items = items
+
+    @classmethod
+    def compile(cls, raw_format, variable_regex):
+        """
+        Creates a tokenizer for a format if it has a known shape
+
+        :param raw_format: str prepared log format
+        :param variable_regex: function that returns regex string for a variable
+        :return: NginxAccessLogTokenizer or None
+        """
+        if raw_format == COMBINED_FORMAT:
+            raw_items = []
+        elif raw_format.startswith(COMBINED_FORMAT + ' '):
+            raw_items = raw_format[len(COMBINED_FORMAT) + 1:].split(' ')
+        else:
+            return None
+
+        keys = list(cls.combined_keys)
+        parsed_items = []
+
+        for raw_item in raw_items:
+            match = cls.item_re.match(raw_item)
+            if not match:
+                return None
+
+            name, quoted, key = match.group('name'), bool(match.group('quote')), match.group('key')
+
+            # unquoted variables are only allowed with a name, otherwise we don't know where they end
+            if not quoted and not name:
+                return None
+
+            keys.append(key)
+            parsed_items.append((' %s%s' % (name, '"' if quoted else ''), quoted, variable_regex(key)))
+
+        items = []
+        for i, (opening, quoted, rxp) in enumerate(parsed_items):
+            # unquoted variable ends where the next one starts (or at the end of line)
+            terminator = parsed_items[i + 1][0] if not quoted and i + 1 < len(parsed_items) else None
+
+            if rxp == '.+':
+                validator = None
+            elif rxp == '\d+':
+                validator = str.isdigit
+            else:
+                validator = re.compile('(?:%s)$' % rxp).match
+
+            items.append((opening, quoted, terminator, validator))
+
+        return cls(keys, items)
+
+    def tokenize(self, line):
+        """
+        Splits the line into values
+
+        :param line: log line
+        :return: [] of values in the order of self.keys or None if line doesn't fit the format
+        """
+        if '\n' in line:
+            return None
+
+        # $remote_addr - $remote_user [$time_local]
+        head, quote, rest = line.partition('"')
+        if not quote or not head.endswith('] '):
+            return None
+
+        left, bracket, time_local = head[:-2].rpartition(' [')
+        remote_addr, dash, remote_user = left.rpartition(' - ')
+        if not (bracket and dash and remote_addr and remote_user and time_local):
+            return None
+
+        # "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent"
+        parts = rest.split('"', 5)
+        if len(parts) != 6 or parts[3] != ' ' or not (parts[0] and parts[2] and parts[4]):
+            return None
+
+        request, numbers, http_referer, _, http_user_agent, rest = parts
+        status, space, body_bytes_sent = numbers[1:-1].partition(' ')
+        if numbers[:1] != ' ' or numbers[-1:] != ' ' or not (status.isdigit() and body_bytes_sent.isdigit()):
+            return None
+
+        values = [remote_addr, remote_user, time_local, request, status, body_bytes_sent, http_referer, http_user_agent]
+
+        # extra variables
+        pos, length = 0, len(rest)
+        for opening, quoted, terminator, validator in self.items:
+            if not rest.startswith(opening, pos):
+                return None
+            pos += len(opening)
+
+            if quoted:
+                end = rest.find('"', pos)
+                if end < 0:
+                    return None
+                value, pos = rest[pos:end], end + 1
+            elif terminator is None:
+                value, pos = rest[pos:], length
+            else:
+                # regex is greedy, so the value goes up to the last occurrence of the next variable
+                end = rest.rfind(terminator, pos)
+                if end < 0:
+                    return None
+                value, pos = rest[pos:end], end
+
+            if not value or (validator is not None and not validator(value)):
+                return None
+            values.append(value)
+
+        if pos != length:
+            return None
+
+        return values
+
 
 class NginxAccessLogParser(object):
     """
     Nginx access log parser
     """
-    combined_format = '$remote_addr - $remote_user [$time_local] "$request" ' + \
-                      '$status $body_bytes_sent "$http_referer" "$http_user_agent"'
+    combined_format = COMBINED_FORMAT
 
     default_variable = ['.+', str]
 
@@ -59,14 +235,31 @@ class NginxAccessLogParser(object):
         'upstream_status'
     ]
 
-    def __init__(self, raw_format=None):
+    def __init__(self, raw_format=None, fields=None):
         """
         Takes raw format and generates regex
+
+        If fields are specified, variables that are not in fields are matched by the regex but never captured nor
+        converted, so they don't appear in parse() results.
+
         :param raw_format: raw log format
+        :param fields: iterable of variable names to parse (all variables if None), "upstream*" means any variable
+                       starting with "upstream"
         """
         self.raw_format = self.combined_format if raw_format is None else raw_format
 
+        self.fields = None
+        self.field_prefixes = tuple()
+        if fields is not None:
+            self.fields = set(field for field in fields if not field.endswith('*'))
+            self.field_prefixes = tuple(field[:-1] for field in fields if field.endswith('*'))
+
+            # request_method, request_uri and server_protocol are taken from $request if they aren't in the format
+            if self.fields.intersection(self.request_variables):
+                self.fields.add('request')
+
         self.keys = []
+        self.groups = []  # captured keys in the order of regex groups
         self.regex_string = r''
         self.regex = None
         current_key = None
@@ -78,12 +271,19 @@ class NginxAccessLogParser(object):
             key_without_dollar = current_key[1:]
             self.keys.append(key_without_dollar)
             rxp = self.common_variables.get(key_without_dollar, self.default_variable)[0]
+
+            # variables that nobody needs are matched, but not captured
+            if not self.is_field(key_without_dollar):
+                self.regex_string += '(?:%s)' % rxp
+                return
+
             # Handle formats with multiple instances of the same variable.
             var_count = self.keys.count(key_without_dollar)
             if var_count > 1:  # Duplicate variables will be named starting at 2 (var, var2, var3, etc...)
                 regex_var_name = '%s_occurance_%s' % (key_without_dollar, var_count)
             else:
                 regex_var_name = key_without_dollar
+            self.groups.append(key_without_dollar)
             self.regex_string += '(?P<%s>%s)' % (regex_var_name, rxp)
 
         for char in self.raw_format:
@@ -121,6 +321,58 @@ class NginxAccessLogParser(object):
             finalize_key()
 
         self.regex = re.compile(self.regex_string)
+        self.plan = self.compile_plan(self.groups)
+
+        # well-known formats can be split without regex
+        self.tokenizer = NginxAccessLogTokenizer.compile(
+            self.raw_format, lambda key: self.common_variables.get(key, self.default_variable)[0]
+        )
+        self.tokenizer_plan = self.compile_plan(self.tokenizer.keys) if self.tokenizer else None
+        self.tokenizer_misses = 0  # lines that didn't fit the tokenizer and were parsed with regex
+
+    def is_field(self, key):
+        """
+        Checks that a variable should be parsed
+
+        :param key: str variable name
+        :return: bool
+        """
+        if self.fields is None:
+            return True
+        return key in self.fields or key.startswith(self.field_prefixes)
+
+    def compile_plan(self, keys):
+        """
+        Compiles the format into a list of steps, so that parse() doesn't have to make any decisions based on key
+        names for every line.
+
+        Each step is a tuple of (value index, key, converter, finalizer), where the finalizer is an optional function
+        that gets a converted value and returns the value to store (or None if nothing should be stored).
+
+        :param keys: [] of variable names in the order of matched values
+        :return: [] of steps
+        """
+        plan = []
+        seen = set()
+
+        for index, key in enumerate(keys):
+            # duplicate variables always hold the value of the first occurrence
+            if key in seen or not self.is_field(key):
+                continue
+            seen.add(key)
+
+            converter = self.common_variables.get(key, self.default_variable)[1]
+
+            if key.endswith('_time'):
+                finalizer = parse_time_value
+            elif key in self.comma_separated_keys:
+                finalizer = parse_comma_separated_value
+            else:
+                finalizer = None
+
+            plan.append((index, key, converter, finalizer))
+
+        return plan
 
     def parse(self, line):
         """
@@ -133,47 +385,35 @@ class NginxAccessLogParser(object):
         result = {'malformed': False}
 
         # parse the line
-        common = self.regex.match(line)
+        values, plan = None, self.plan
 
-        if common:
-            for key in self.keys:
-                # key local vars
-                time_var = False
+        if self.tokenizer is not None:
+            values = self.tokenizer.tokenize(line)
+            if values is None:
+                self.tokenizer_misses += 1
+            else:
+                plan = self.tokenizer_plan
 
-                func = self.common_variables[key][1] if key in self.common_variables \
-                    else self.default_variable[1]
+        if values is None:
+            common = self.regex.match(line)
+            if common:
+                values = common.groups()
+
+        if values is not None:
+            for index, key, converter, finalizer in plan:
                 try:
-                    value = func(common.group(key))
+                    value = converter(values[index])
                 # for example gzip ratio can be '-' and float
                 except ValueError:
                     value = 0
 
-                # time variables should be parsed to array of float
-                if key.endswith('_time'):
-                    time_var = True
-                    # skip empty vars
-                    if value != '-':
-                        array_value = []
-                        for x in value.replace(' ', '').split(','):
-                            x = float(x)
-                            # workaround for an old nginx bug with time. ask lonerr@ for details
-                            if x > 10000000:
-                                continue
-                            else:
-                                array_value.append(x)
-                        if array_value:
-                            result[key] = array_value
-
-                # Handle comma separated keys
-                if key in self.comma_separated_keys:
-                    if ',' in value:
-                        list_value = value.replace(' ', '').split(',')  # remove spaces and split values into list
-                        result[key] = list_value
-                    else:
-                        result[key] = [value]
+                # time and comma separated variables should be parsed to lists
+                if finalizer is not None:
+                    value = finalizer(value)
+                    if value is None:
+                        continue
 
-                if key not in result and not time_var:
-                    result[key] = value
+                result[key] = value
         else:
             context.default_log.debug(
                 'could not parse line "%s" with regex "%s"' % (
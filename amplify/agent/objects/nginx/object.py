@@ -14,7 +14,7 @@ from amplify.agent.objects.nginx.binary import nginx_v
 from amplify.agent.objects.nginx.config.config import NginxConfig
 from amplify.agent.objects.nginx.filters import Filter
 from amplify.agent.pipelines.syslog import SyslogTail
-from amplify.agent.pipelines.file import FileTail
+from amplify.agent.pipelines.file import InotifyFileTail, shared_tail
 
 
 __author__ = "Mike Belov"
@@ -173,6 +173,15 @@ class NginxObject(AbstractObject):
                     context.log.debug('bad response from stub/plus status url %s' % full_url)
         return None
 
+    def stop(self, keep_config=False):
+        """
+        :param keep_config: bool - don't stop the config worker and watcher, because the config is passed on
+                            to a new object
+        """
+        if not keep_config:
+            self.config.stop()
+        super(NginxObject, self).stop()
+
     def __setup_pipeline(self, name):
         """
         Sets up a pipeline/tail object for a collector based on "filename".
@@ -183,17 +192,23 @@ class NginxObject(AbstractObject):
         tail = None
         try:
             if name.startswith('syslog'):
-                address_bucket = name.split(',', 1)[0]
-                host, port, address = net.ipv4_address(
-                    address=address_bucket.split('=')[1], full_format=True, silent=True
-                )
-                # Right now we assume AFNET address/port...e.g. no support for unix sockets
-
-                if address in context.listeners:
-                    port = int(port)  # socket requires integer port
-                    tail = SyslogTail(address=(host, port))
+                # e.g. "syslog:server=127.0.0.1:514,facility=local7,tag=nginx,severity=info"
+                params = dict(param.split('=', 1) for param in name.split(':', 1)[1].split(',') if '=' in param)
+                address = params.get('server', '')
+                tag = params.get('tag', 'nginx')  # nginx default
+
+                if address.startswith('unix:'):
+                    if address in context.listeners:
+                        tail = SyslogTail(address=address[5:], tag=tag)
+                else:
+                    host, port, address = net.ipv4_address(address=address, full_format=True, silent=True)
+                    if address in context.listeners:
+                        port = int(port)  # socket requires integer port
+                        tail = SyslogTail(address=(host, port), tag=tag)
+            elif self.config_option('log_wakeups') == 'inotify':
+                tail = shared_tail(name, tail_cls=InotifyFileTail)
             else:
-                tail = FileTail(name)
+                tail = shared_tail(name)
         except Exception as e:
             context.log.error(
                 'failed to initialize pipeline for "%s" due to %s (maybe has no rights?)' % (name, e.__class__.__name__)
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import time
 
 
 __author__ = "Grant Hulegaard"
@@ -32,6 +33,22 @@ class Pipeline(object):
     def next(self):
         return self.__next__()
 
+    def wait(self, timeout):
+        """
+        Blocks until there may be new data or timeout passes.  Pipelines that can't tell when data comes just sleep.
+
+        :param timeout: float seconds
+        """
+        time.sleep(timeout)
+
+    def report(self, statsd):
+        """
+        Sends internal metrics of the pipeline (if it has any) to statsd of a collector's object
+
+        :param statsd: StatsdClient
+        """
+        pass
+
     # This is a Pipeline API requirement
     def stop(self):
         """As collectors stop, pipelines should too."""
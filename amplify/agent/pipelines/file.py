@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
 import time
 from os import stat
 
+import ujson
+
 from amplify.agent.common.context import context
+from amplify.agent.common.util import inotify
 
 from amplify.agent.pipelines.abstract import Pipeline
 
@@ -18,6 +22,119 @@ __email__ = "dedm@nginx.com"
 # this one is used to store offset between objects' reloads
 OFFSET_CACHE = {}
 
+CHUNK_SIZE = 1024 * 1024  # bytes read from a file at once
+
+# this one is used to store offsets between agent restarts, see offset_store()
+OFFSET_STORE = None
+
+# readers of files tailed by several collectors, (device, inode) - SharedFileReader, see shared_tail()
+SHARED_READERS = {}
+
+
+class OffsetStore(object):
+    """
+    Offsets of tailed files which survive agent restarts
+
+    Offsets are kept by path together with device and inode of the file, so a file which was rotated or replaced
+    while the agent was down is not read from a wrong position.  The state file is replaced atomically (a temporary
+    file is written and renamed) and not more often than once per interval.
+    """
+
+    interval = 10
+
+    def __init__(self, filename=None, max_backlog=None):
+        self.filename = filename
+        self.max_backlog = max_backlog
+        self.offsets = {}  # path - (device, inode, offset)
+        self.dirty = False
+        self.last_save = 0
+        self.load()
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename, 'r') as f:
+                for path, device, inode, offset in ujson.loads(f.read()):
+                    self.offsets[path] = (device, inode, offset)
+        except:
+            context.log.error('failed to load tail offsets from "%s"' % self.filename)
+            context.log.debug('additional info:', exc_info=True)
+
+    def get(self, path, device, inode, size):
+        """
+        Returns offset to resume tailing a file from
+
+        :param path: str path of the file
+        :param device: int st_dev of the file
+        :param inode: int st_ino of the file
+        :param size: int current size of the file
+        :return: int offset or None if the file was not tailed before
+        """
+        if path not in self.offsets:
+            return None
+
+        saved_device, saved_inode, offset = self.offsets[path]
+        if (saved_device, saved_inode) != (device, inode) or offset > size:
+            return 0  # the file was rotated or truncated, so all of it is new
+
+        return offset
+
+    def update(self, path, device, inode, offset):
+        if self.offsets.get(path) != (device, inode, offset):
+            self.offsets[path] = (device, inode, offset)
+            self.dirty = True
+
+    def checkpoint(self, force=False):
+        """
+        Saves offsets if they were changed and the previous save was long enough ago
+
+        :param force: bool save regardless of time
+        """
+        if self.filename and self.dirty and (force or time.time() >= self.last_save + self.interval):
+            self.save()
+
+    def save(self):
+        temporary_filename = '%s.tmp' % self.filename
+        try:
+            with open(temporary_filename, 'w') as f:
+                f.write(ujson.dumps([
+                    [path, device, inode, offset] for path, (device, inode, offset) in self.offsets.iteritems()
+                ]))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temporary_filename, self.filename)
+            self.dirty = False
+        except:
+            context.log.error('failed to save tail offsets to "%s"' % self.filename)
+            context.log.debug('additional info:', exc_info=True)
+        self.last_save = time.time()
+
+
+def tail_option(name):
+    """
+    :param name: str name of an int option from the [tail] section
+    :return: int value or None if it is not set or 0
+    """
+    value = context.app_config.get('tail').get(name)
+    return int(value) or None if value else None
+
+
+def offset_store():
+    """
+    Returns the offset store configured in the [tail] section, creates it if needed
+
+    :return: OffsetStore
+    """
+    global OFFSET_STORE
+    if OFFSET_STORE is None:
+        OFFSET_STORE = OffsetStore(
+            filename=context.app_config.get('tail').get('offsets') or None,
+            max_backlog=tail_option('max_backlog')
+        )
+    return OFFSET_STORE
+
 
 class FileTail(Pipeline):
     """
@@ -28,37 +145,117 @@ class FileTail(Pipeline):
     Copyright (C) 2011 Brad Greenlee <brad@footle.org>
 
     https://raw.githubusercontent.com/bgreenlee/pygtail/master/pygtail/core.py
+
+    The file is read in chunks of chunk_size bytes, which are split into lines.  A line without the trailing newline
+    is not returned until the rest of it is written.  The offset always points to the first unread line.
+
+    A new tail of a file starts from its end, unless the offset of the file was saved before the agent restart.
+
+    When the file is rotated, the old file is read till its end before switching to the new one.  When the file is
+    truncated in place (copytruncate), it is read from the start.
+
+    Every iteration (or a series of read_batch calls until an empty one) is a cycle, which stops after max_lines
+    lines or max_time milliseconds, even if the end of the file is not reached yet.  The next cycle continues from
+    the first unread line.  If more than max_lag bytes are unread at the start of a cycle, they are skipped.
     """
 
-    def __init__(self, filename):
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, filename, chunk_size=None, offsets=None, max_lines=None, max_time=None, max_lag=None):
         super(FileTail, self).__init__(name='file:%s' % filename)
         self.filename = filename
+        self.offsets = offsets if offsets is not None else offset_store()
         self._fh = None
 
-        # open a file and seek to the end
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+        # budget of a cycle and skip-ahead threshold (0 turns them off)
+        self.max_lines = max_lines if max_lines is not None else tail_option('max_lines')
+        self.max_time = max_time if max_time is not None else tail_option('max_time')
+        self.max_lag = max_lag if max_lag is not None else tail_option('max_lag')
+
+        self._cycle = False  # True if a cycle is started
+        self._cycle_lines = 0
+        self._cycle_deadline = None
+
+        self.behind = False  # True if the previous cycle ran out of budget before the end of the file
+        self.lag_bytes = 0  # unread bytes at the end of the previous cycle
+        self.skipped_bytes = 0  # bytes skipped because of max_lag
+
+        self._lines = []  # complete lines of read chunks, without newlines
+        self._position = 0  # index of the first unread line in self._lines
+        self._partial = ''  # the last line of read chunks, if it is not complete yet
+        self._rotated = False  # True while the rest of a rotated file is read
+        self._size = None  # size of the file at the last rotation check
+
+        self.recovered_bytes = 0  # bytes read from rotated or truncated files, which used to be lost
+
+        # save inode to determine rotations
+        self._update_inode()
+
         if self.filename not in OFFSET_CACHE:
-            with open(self.filename, "r") as f:
-                f.seek(0, 2)
-                self._offset = OFFSET_CACHE[self.filename] = f.tell()
+            self._offset = OFFSET_CACHE[self.filename] = self._initial_offset()
         else:
             self._offset = OFFSET_CACHE[self.filename]
 
-        # save inode to determine rotations
-        self._inode = self._st_ino()
+        # keep the file open, so it can be read till the end after rotation
+        self._fh = open(self.filename, "r")
+        self._fh.seek(self._offset)
 
     def __del__(self):
-        if self._filehandle():
+        if not self._is_closed():
             self._fh.close()
 
     def __iter__(self):
         self._filehandle()
+        self._start_cycle()
         return self
 
     def _st_ino(self):
         return stat(self.filename).st_ino
 
     def _update_inode(self):
-        self._inode = self._st_ino()
+        st = stat(self.filename)
+        self._inode, self._device = st.st_ino, st.st_dev
+
+    def _initial_offset(self):
+        """
+        Returns the offset saved before the agent restart, but leaves no more than max_backlog bytes to read.
+        Returns the end of the file if there is no saved offset.
+
+        :return: int offset
+        """
+        size = stat(self.filename).st_size
+        offset = self.offsets.get(self.filename, self._device, self._inode, size)
+        if offset is None:
+            return size
+
+        max_backlog = self.offsets.max_backlog
+        if max_backlog is not None and size - offset > max_backlog:
+            context.log.info(
+                'skipping %s bytes of "%s" that were written while the agent was down' % (
+                    size - offset - max_backlog, self.filename
+                )
+            )
+            offset = self._next_line_offset(size - max_backlog)
+        else:
+            context.log.debug('resuming "%s" from offset %s' % (self.filename, offset))
+
+        return offset
+
+    def _next_line_offset(self, offset):
+        """
+        :param offset: int offset
+        :return: int offset of the first line which starts at offset or later
+        """
+        if offset <= 0:
+            return 0
+
+        with open(self.filename, "r") as f:
+            f.seek(offset - 1)
+            f.readline()
+            return f.tell()
 
     def _file_was_rotated(self):
         """
@@ -71,7 +268,8 @@ class FileTail(Pipeline):
 
         while tries < 2:  # Try twice before moving on.
             try:
-                new_inode = self._st_ino()
+                st = stat(self.filename)
+                new_inode, self._size = st.st_ino, st.st_size
             except:
                 time.sleep(0.5)
                 tries += 1
@@ -91,19 +289,127 @@ class FileTail(Pipeline):
         """
         Return the next line in the file, updating the offset.
         """
-        try:
-            line = self._get_next_line()
-        except StopIteration:
+        if not self._cycle:
+            self._start_cycle()
+
+        if self._position >= len(self._lines) and not self._read_chunks():
             # we've reached the end of the file;
-            self._update_offset()
-            raise
-        return line
+            self._end_cycle(behind=False)
+            raise StopIteration
+
+        # time is checked not for every line, it's not free
+        if (self.max_lines and self._cycle_lines >= self.max_lines) or \
+                (self._cycle_deadline and not self._cycle_lines % 256 and time.time() >= self._cycle_deadline):
+            self._end_cycle(behind=True)
+            raise StopIteration
+
+        line = self._lines[self._position]
+        self._position += 1
+        self._cycle_lines += 1
+        return line.rstrip()
+
+    def read_batch(self, max_lines=None):
+        """
+        Returns up to max_lines unread lines at once, which is much cheaper than iterating over lines one by one.
+        Returns an empty list when there is nothing to read or the budget of the cycle is spent.
+
+        :param max_lines: int max number of lines (all unread lines if None)
+        :return: [] of lines
+        """
+        if not self._cycle:
+            self._start_cycle()
+
+        if self.max_lines:
+            budget = self.max_lines - self._cycle_lines
+            max_lines = budget if max_lines is None else min(max_lines, budget)
+
+        batch = []
+        rotation_checked = False
+        while max_lines is None or len(batch) < max_lines:
+            if self._cycle_deadline and time.time() >= self._cycle_deadline:
+                break
+
+            if self._position >= len(self._lines) and not self._read_chunks():
+                if rotation_checked:
+                    break
+
+                # the end of the file, check if it's time to switch to a new one
+                self._filehandle()
+                rotation_checked = True
+                continue
+
+            end = len(self._lines) if max_lines is None else self._position + max_lines - len(batch)
+            batch.extend([line.rstrip() for line in self._lines[self._position:end]])
+            self._position = min(end, len(self._lines))
+
+        if not batch:
+            self._end_cycle(behind=not rotation_checked)
+            return batch
+
+        self._cycle_lines += len(batch)
+        self._update_offset()
+        return batch
 
     def readlines(self):
         """
-        Read in all unread lines and return them as a list.
+        Read in all unread lines (within the budget of a cycle) and return them as a list.
         """
-        return [line for line in self]
+        self._filehandle()
+        self._start_cycle()
+
+        lines = []
+        while True:
+            batch = self.read_batch()
+            if not batch:
+                return lines
+            lines.extend(batch)
+
+    def wait(self, timeout):
+        if self.behind:
+            # the budget was spent, continue as soon as other greenlets had their turn
+            time.sleep(0)
+        else:
+            super(FileTail, self).wait(timeout)
+
+    def _start_cycle(self):
+        self._cycle = True
+        self._cycle_lines = 0
+        self._cycle_deadline = time.time() + self.max_time / 1000.0 if self.max_time else None
+
+        if self.max_lag and not self._rotated and not self._is_closed():
+            size = os.fstat(self._fh.fileno()).st_size
+            lag = size - self._unread_offset()
+            if lag > self.max_lag:
+                self._skip_to(size)
+
+    def _end_cycle(self, behind):
+        self._cycle = False
+        self.behind = behind
+        self._update_offset()
+
+        if self._is_closed():
+            self.lag_bytes = 0
+        else:
+            self.lag_bytes = max(os.fstat(self._fh.fileno()).st_size - self._unread_offset(), 0)
+
+    def _skip_to(self, size):
+        """
+        Skips unread lines up to size, an incomplete line at the end is kept
+        """
+        offset = self._unread_offset()
+        start = max(size - self.chunk_size, offset)
+        self._fh.seek(start)
+        newline = self._fh.read(size - start).rfind('\n')
+        self._fh.seek(start + newline + 1 if newline >= 0 else size)
+        self._drop_buffer()
+
+        skipped = self._fh.tell() - offset
+        self.skipped_bytes += skipped
+        context.log.warning(
+            'skipped %s bytes of "%s" because the agent was too far behind (max_lag is %s)' % (
+                skipped, self.filename, self.max_lag
+            )
+        )
 
     def _is_closed(self):
         if not self._fh:
@@ -115,25 +421,354 @@ class FileTail(Pipeline):
         Return a filehandle to the file being tailed, with the position set
         to the current offset.
         """
-        file_was_rotated = self._file_was_rotated()
+        if self._rotated:
+            return self._fh  # the rest of the old file is not read yet
 
-        if not self._fh or self._is_closed() or file_was_rotated:
-            if not self._is_closed():
-                self._fh.close()
+        file_was_rotated = self._file_was_rotated()
 
+        if file_was_rotated and not self._is_closed():
+            # keep reading the old file, _read_chunks() switches to the new one at the end of it
+            context.log.debug('"%s" was rotated, reading the rest of the old file' % self.filename)
+            self._rotated = True
+        elif not self._is_closed() and self._size < self._fh.tell():
+            self._truncated()
+        elif self._is_closed():
             if file_was_rotated:
                 self._update_inode()
                 self._offset = OFFSET_CACHE[self.filename] = 0
+            else:
+                self._drop_buffer()
 
             self._fh = open(self.filename, "r")
             self._fh.seek(self._offset)
         return self._fh
 
+    def _switch_to_new_file(self):
+        """
+        Switches from the end of a rotated file to the new one
+        """
+        # the old file won't get the rest of an incomplete line
+        if self._partial:
+            self._lines.append(self._partial)
+            self._partial = ''
+
+        self._fh.close()
+        self._rotated = False
+        self._update_inode()
+        self._offset = OFFSET_CACHE[self.filename] = 0
+        self._fh = open(self.filename, "r")
+
+    def _truncated(self):
+        """
+        Starts reading the file from the start after it was truncated in place (like logrotate copytruncate does)
+        """
+        context.log.debug('"%s" was truncated, reading it from the start' % self.filename)
+
+        # lines written after truncation would be skipped if we waited for the file to grow up to the old offset
+        self.recovered_bytes += self._size
+        self._partial = ''
+        self._fh.seek(0)
+        self._offset = OFFSET_CACHE[self.filename] = 0
+
+    def _drop_buffer(self):
+        """
+        Forgets lines which were read but not returned, they will be read again from self._offset
+        """
+        self._lines, self._position, self._partial = [], 0, ''
+
+    def _read_chunks(self):
+        """
+        Reads chunks until there is at least one complete line or the end of the file is reached
+
+        :return: bool True if there are new lines
+        """
+        if self._is_closed():
+            return False
+
+        self._lines, self._position = [], 0
+        while True:
+            chunk = self._fh.read(self.chunk_size)
+            if not chunk:
+                if not self._rotated:
+                    return False
+
+                self._switch_to_new_file()
+                if self._lines:
+                    return True
+                continue
+
+            if self._rotated:
+                self.recovered_bytes += len(chunk)
+
+            lines = (self._partial + chunk).split('\n')
+            self._partial = lines.pop()
+            if lines:
+                self._lines = lines
+                return True
+
     def _update_offset(self):
-        self._offset = OFFSET_CACHE[self.filename] = self._filehandle().tell()
+        """
+        Saves offset of the first unread line
+        """
+        if self._is_closed():
+            return
+
+        if self._rotated:
+            # a new tail should start from the start of the new file, the old one can't be opened by name
+            self._offset = OFFSET_CACHE[self.filename] = 0
+            return
+
+        # unread lines may be left from a rotated file, nothing is read from the new one yet then
+        self._offset = OFFSET_CACHE[self.filename] = max(self._unread_offset(), 0)
+
+        self.offsets.update(self.filename, self._device, self._inode, self._offset)
+        self.offsets.checkpoint()
+
+    def _unread_offset(self):
+        """
+        :return: int offset of the first unread line in the open file
+        """
+        offset = self._fh.tell() - len(self._partial)
+        for i in xrange(self._position, len(self._lines)):
+            offset -= len(self._lines[i]) + 1
+        return offset
+
+    def report(self, statsd):
+        if self.recovered_bytes:
+            statsd.incr('amplify.agent.tail.recovered_bytes', self.recovered_bytes)
+            self.recovered_bytes = 0
+
+        if self.skipped_bytes:
+            statsd.incr('amplify.agent.tail.skipped_bytes', self.skipped_bytes)
+            self.skipped_bytes = 0
+
+        # one series per object with the lag of the log most behind, the lag of every file goes to the debug log
+        statsd.maximum('amplify.agent.tail.lag_bytes', self.lag_bytes)
+        if self.lag_bytes:
+            context.log.debug('%s bytes of "%s" are not read yet' % (self.lag_bytes, self.filename))
+
+    def stop(self):
+        self.offsets.checkpoint(force=True)
+
+
+class InotifyFileTail(FileTail):
+    """
+    FileTail which wakes up a waiting collector as soon as the file is written (Linux only)
+
+    The directory of the file is watched, so events keep coming after rotation.  All tails share one inotify
+    instance, see inotify.shared_watches().  Wakeups are not more frequent than min_interval, so lines are processed in small
+    batches instead of one by one.  Works like FileTail when inotify is not available.
+    """
+
+    min_interval = 0.5
+
+    watch_mask = inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_MOVED_TO
+
+    def __init__(self, filename, min_interval=None, **kwargs):
+        self._wakeup = None  # gevent.event.Event set on events of the file
+        super(InotifyFileTail, self).__init__(filename, **kwargs)
+        self._last_wakeup = time.time()
+
+        if min_interval is not None:
+            self.min_interval = min_interval
+
+        if inotify.available():
+            try:
+                self._wakeup = inotify.shared_watches().subscribe(self.filename, self.watch_mask)
+            except OSError as e:
+                context.log.debug('could not watch "%s" with inotify: %s, will poll' % (self.filename, e))
+
+    def wait(self, timeout):
+        if self._wakeup is None or self.behind:
+            return super(InotifyFileTail, self).wait(timeout)
+
+        # let lines accumulate for at least min_interval since the previous wakeup
+        elapsed = time.time() - self._last_wakeup
+        if elapsed < self.min_interval:
+            time.sleep(self.min_interval - elapsed)
+
+        self._wakeup.wait(max(self._last_wakeup + timeout - time.time(), 0))
+        self._wakeup.clear()  # events from now on wake up the next wait
+        self._last_wakeup = time.time()
+
+    def stop(self):
+        if self._wakeup is not None:
+            inotify.SHARED_WATCHES.unsubscribe(self.filename, self._wakeup)
+            self._wakeup = None
+        super(InotifyFileTail, self).stop()
+
+    def __del__(self):
+        self.stop()
+        super(InotifyFileTail, self).__del__()
+
+
+class SharedFileReader(object):
+    """
+    Reads a file once for all SharedFileTail subscribers
+
+    Lines are kept in a buffer until every subscriber gets them, or until there are more than max_buffer of them.  A
+    subscriber which falls behind the buffer skips the dropped lines, so a slow subscriber doesn't block the others
+    and doesn't make the buffer grow.  The file is read when a subscriber has no buffered lines left.
+    """
 
-    def _get_next_line(self):
-        line = self._fh.readline()
-        if not line:
+    max_buffer = 100000  # lines
+
+    def __init__(self, tail):
+        self.tail = tail
+        self.key = tail._device, tail._inode
+        self.subscribers = []
+
+        self.lines = []
+        self.first_seq = 0  # sequence number of the first buffered line
+        self.end_seq = 0  # sequence number of the next line to be read
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        subscriber.seq = self.end_seq
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+        if not self.subscribers:
+            if SHARED_READERS.get(self.key) is self:
+                del SHARED_READERS[self.key]
+            self.tail.stop()
+
+    def read(self, subscriber):
+        """
+        :param subscriber: SharedFileTail
+        :return: [] of lines the subscriber didn't get yet
+        """
+        if subscriber.seq >= self.end_seq:
+            self._fetch()
+
+        if subscriber.seq < self.first_seq:
+            subscriber.skipped_lines += self.first_seq - subscriber.seq
+            subscriber.seq = self.first_seq
+
+        lines = self.lines[subscriber.seq - self.first_seq:]
+        subscriber.seq = self.end_seq
+        self._trim()
+        return lines
+
+    def unread_bytes(self, subscriber):
+        """
+        :param subscriber: SharedFileTail
+        :return: int bytes of buffered lines the subscriber didn't get yet plus unread bytes of the file
+        """
+        start = max(subscriber.seq - self.first_seq, 0)
+        return self.tail.lag_bytes + sum(len(line) + 1 for line in self.lines[start:])
+
+    def _fetch(self):
+        lines = self.tail.readlines()
+        self.lines.extend(lines)
+        self.end_seq += len(lines)
+
+        # the file could be rotated, new subscribers of the new file should get this reader
+        key = self.tail._device, self.tail._inode
+        if key != self.key:
+            if SHARED_READERS.get(self.key) is self:
+                del SHARED_READERS[self.key]
+            SHARED_READERS.setdefault(key, self)
+            self.key = key
+
+    def _trim(self):
+        seq = min(subscriber.seq for subscriber in self.subscribers) if self.subscribers else self.end_seq
+        seq = max(seq, self.end_seq - self.max_buffer)
+        if seq > self.first_seq:
+            del self.lines[:seq - self.first_seq]
+            self.first_seq = seq
+
+
+class SharedFileTail(Pipeline):
+    """
+    Pipeline which gets lines of a file from a SharedFileReader, see shared_tail()
+
+    Every subscriber keeps its own position in the stream of lines, lag and counters.
+    """
+
+    def __init__(self, filename, reader):
+        super(SharedFileTail, self).__init__(name='file:%s' % filename)
+        self.filename = filename
+        self.reader = reader
+
+        self.seq = 0  # sequence number of the next line to get from the reader
+        self.lag_bytes = 0
+        self.skipped_lines = 0  # lines dropped from the reader's buffer before this subscriber got them
+
+        self._lines = []
+        self._position = 0
+
+        reader.subscribe(self)
+
+    def __iter__(self):
+        self._lines = self.reader.read(self)
+        self._position = 0
+        return self
+
+    def __next__(self):
+        if self._position >= len(self._lines):
+            self.lag_bytes = self.reader.unread_bytes(self)
             raise StopIteration
-        return line.rstrip()
+
+        line = self._lines[self._position]
+        self._position += 1
+        return line
+
+    def readlines(self):
+        lines = self.reader.read(self)
+        self.lag_bytes = self.reader.unread_bytes(self)
+        return lines
+
+    def wait(self, timeout):
+        if self.seq < self.reader.end_seq:
+            # other subscribers have read lines for this one already
+            time.sleep(0)
+        else:
+            self.reader.tail.wait(timeout)
+
+    def report(self, statsd):
+        tail = self.reader.tail
+        if tail.recovered_bytes:
+            statsd.incr('amplify.agent.tail.recovered_bytes', tail.recovered_bytes)
+            tail.recovered_bytes = 0
+
+        if tail.skipped_bytes:
+            statsd.incr('amplify.agent.tail.skipped_bytes', tail.skipped_bytes)
+            tail.skipped_bytes = 0
+
+        if self.skipped_lines:
+            statsd.incr('amplify.agent.tail.skipped_lines', self.skipped_lines)
+            self.skipped_lines = 0
+
+        # one series per object with the lag of the log most behind, the lag of every file goes to the debug log
+        statsd.maximum('amplify.agent.tail.lag_bytes', self.lag_bytes)
+        if self.lag_bytes:
+            context.log.debug('%s bytes of "%s" are not read yet' % (self.lag_bytes, self.filename))
+
+    def stop(self):
+        if self.reader is not None:
+            self.reader.unsubscribe(self)
+            self.reader = None
+
+
+def shared_tail(filename, tail_cls=FileTail):
+    """
+    Returns a pipeline for a file which shares one reader with other pipelines of the same file.  Files are the same
+    if they have the same device and inode, so different paths of one file (links, mounts) share a reader too.
+
+    :param filename: str path of the file
+    :param tail_cls: FileTail class used by a new reader
+    :return: SharedFileTail
+    """
+    st = stat(filename)
+    key = st.st_dev, st.st_ino
+
+    reader = SHARED_READERS.get(key)
+    if reader is None:
+        reader = SHARED_READERS[key] = SharedFileReader(tail_cls(filename))
+    else:
+        context.log.debug('"%s" is already tailed as "%s", sharing the reader' % (filename, reader.tail.filename))
+
+    return SharedFileTail(filename, reader)
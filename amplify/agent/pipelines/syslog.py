@@ -7,12 +7,16 @@ SyslogTail spawns coroutine which in turns spawns an asyncore implemented syslog
 the received messages when iterated.
 """
 # -*- coding: utf-8 -*-
-import copy
 import asyncore
+import errno
+import grp
+import os
 import socket
+import stat
 import time
 from collections import deque
 
+from gevent import select
 from threading import current_thread
 from amplify.agent.common.util.threads import spawn
 
@@ -36,53 +40,280 @@ __email__ = "grant.hulegaard@nginx.com"
 
 SYSLOG_ADDRESSES = set()
 
+# address - SyslogListener, one listener serves all tails of the address (with different tags)
+SYSLOG_LISTENERS = {}
+
 
 class AmplifyAddresssAlreadyInUse(AmplifyException):
     description = "Couldn't start socket listener because address already in use"
 
 
+def kernel_drops(sock):
+    """
+    Returns the number of datagrams the kernel dropped because the receive buffer of a UDP socket was full
+
+    :param sock: socket.socket
+    :return: int drops or None if they are unknown (not Linux, closed socket)
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except (OSError, socket.error):
+        return None
+
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except IOError:
+            continue
+
+        # sl local_address rem_address st tx_queue:rx_queue tr:tm->when retrnsmt uid timeout inode ref pointer drops
+        for line in lines:
+            fields = line.split()
+            if len(fields) > 12 and fields[9] == inode:
+                return int(fields[12])
+
+    return None
+
+
+def listener_definition(address):
+    """
+    Finds the [listener_*] section of the agent config with the address
+
+    :param address: str address as it is written in the config
+    :return: dict section or {} if there is none
+    """
+    for name in context.app_config.get('listeners').get('keys', '').split(','):
+        definition = context.app_config.get('listener_%s' % name.strip())
+        if definition and definition.get('address') == address:
+            return definition
+    return {}
+
+
+class SyslogQueue(object):
+    """Messages with one syslog tag which wait for a SyslogTail, and their counters"""
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.cache = deque(maxlen=maxlen)
+        self.received = 0
+        self.dropped = 0  # messages pushed out of the cache before a collector got them
+
+    def append(self, message):
+        self.received += 1
+        if len(self.cache) == self.maxlen:
+            self.dropped += 1
+        self.cache.append(message)
+
+    def swap(self):
+        """
+        Replaces the cache with an empty one instead of copying and clearing it, so no messages are lost in between
+
+        :return: deque of messages
+        """
+        cache, self.cache = self.cache, deque(maxlen=self.maxlen)
+        return cache
+
+
 class SyslogServer(asyncore.dispatcher):
-    """Simple socket server that creates a socket and listens for and caches UDP packets"""
+    """
+    Simple socket server that creates a socket and listens for UDP packets.  Messages are put to queues by their
+    syslog tag, so one socket can serve any number of logs.
+    """
+
+    family = socket.AF_INET
+    chunk_size = 8192
+    max_batch = 10000  # max datagrams received at once, so other greenlets are not starved
 
-    def __init__(self, cache, address, chunk_size=8192):
-        # Explicitly passed shared cache object
-        self.cache = cache
+    def __init__(self, queues, address, chunk_size=None, receive_buffer=None):
+        # Explicitly passed shared tag - SyslogQueue dict
+        self.queues = queues
 
         # Custom constants
-        self.chunk_size = chunk_size
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+        # Counters
+        self.received = 0
+        self.unmatched = 0  # messages with tags nobody waits for
+        self.invalid = 0  # messages which couldn't be handled
 
         # Old-style class super
         asyncore.dispatcher.__init__(self)
 
         # asyncore server init
-        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)  # asyncore socket wrapper
-        self.bind(address)  # bind afore wrapped socket to address
+        self.create_socket(self.family, socket.SOCK_DGRAM)  # asyncore socket wrapper
+        self._set_receive_buffer(receive_buffer)
+        self._bind(address)
         self.address = self.socket.getsockname()  # use socket api to retrieve address (address we actually bound to)
         SYSLOG_ADDRESSES.add(self.address)
         context.log.debug('Syslog server binding to %s' % str(self.address))
 
+    def _bind(self, address):
+        self.bind(address)  # bind afore wrapped socket to address
+
+    def _set_receive_buffer(self, size):
+        if size is None:
+            size = context.app_config.get('listeners').get('receive_buffer')
+        if not size:
+            return
+
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(size))
+            context.log.debug(
+                'syslog receive buffer is %s bytes (asked for %s)' % (
+                    self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), size
+                )
+            )
+        except socket.error as e:
+            context.log.warning('failed to set syslog receive buffer to %s bytes due to %s' % (size, e))
+
     def handle_read(self):
-        """Called when a read event happens on the socket"""
-        data = bytes.decode(self.recv(self.chunk_size).strip())
+        """
+        Called when a read event happens on the socket.  Receives all datagrams which are in the socket buffer, not
+        just one, so the buffer doesn't overflow under load.
+        """
+        for _ in xrange(self.max_batch):
+            try:
+                data = self.socket.recv(self.chunk_size)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+
+            self.received += 1
+            try:
+                self.handle_message(data)
+            except Exception:
+                # a bad datagram must not stop the intake of all logs sent to the socket
+                self.invalid += 1
+                context.log.error('error handling syslog message (address:%s, message:%r)' % (self.address, data))
+                context.log.debug('additional info:', exc_info=True)
+
+    def handle_message(self, data):
+        # lines are kept as bytes like lines of files, non-ascii ones come e.g. from "escape=json" formats
+        data = data.strip()
         try:
-            log_record = data.split('amplify: ', 1)[1]  # this implicitly relies on the nginx syslog format specifically
-            self.cache.append(log_record)
+            # "<PRI>TIMESTAMP HOSTNAME TAG: MESSAGE", this implicitly relies on the nginx syslog format specifically
+            header, log_record = data.split(': ', 1)
+            tag = header.rsplit(' ', 1)[-1]
         except Exception as e:
-            context.log.error('error handling syslog message (address:%s, message:"%s")' % (self.address, data))
+            self.invalid += 1
+            context.log.error('error handling syslog message (address:%s, message:%r)' % (self.address, data))
             context.log.debug('additional info:', exc_info=True)
+            return
+
+        queue = self.queues.get(tag)
+        if queue is None:
+            self.unmatched += 1
+        else:
+            queue.append(log_record)
+
+    def kernel_drops(self):
+        return kernel_drops(self.socket) if self.socket is not None else None
 
     def close(self):
         context.log.debug('SyslogServer closing')
         asyncore.dispatcher.close(self)
 
 
+class UnixSyslogServer(SyslogServer):
+    """
+    SyslogServer for a unix datagram socket (nginx "syslog:server=unix:/path")
+
+    Unix datagrams don't go through the network stack and are not dropped when the socket buffer is full (nginx
+    waits or gets an error instead).  The socket file is created with mode and group from the [listener_*] section
+    with its address, so nginx workers can write to it.  A stale socket file of a previous run is replaced, but not
+    one which is still received on (e.g. by another agent).
+    """
+
+    family = socket.AF_UNIX
+    chunk_size = 65536
+    mode = 0o660  # nginx workers should get access with "group", not everyone
+
+    def _bind(self, path):
+        definition = listener_definition('unix:%s' % path)
+
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise socket.error(errno.EADDRINUSE, '%s exists and is not a socket' % path)
+            if self._in_use(path):
+                raise socket.error(errno.EADDRINUSE, '%s is used by another process' % path)
+            os.remove(path)
+
+        self.bind(path)
+        self.path = path
+
+        try:
+            mode, group = definition.get('mode'), definition.get('group')
+            os.chmod(path, int(mode, 8) if mode else self.mode)
+            if group:
+                os.chown(path, -1, grp.getgrnam(group).gr_gid)
+        except (OSError, KeyError, ValueError) as e:
+            context.log.warning('failed to set permissions of "%s" due to %s' % (path, e))
+
+    @staticmethod
+    def _in_use(path):
+        """
+        :param path: str path of an existing socket file
+        :return: bool - True if somebody receives on the socket, False if it is stale
+        """
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            probe.connect(path)
+            return True
+        except socket.error as e:
+            if e.errno == errno.ECONNREFUSED:
+                return False
+            raise
+        finally:
+            probe.close()
+
+    def kernel_drops(self):
+        return None
+
+    def close(self):
+        SyslogServer.close(self)
+        if getattr(self, 'path', None) and os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class SyslogListener(AbstractManager):
     """This is just a container to manage the SyslogServer listen/handle loop."""
     name = 'syslog_listener'
 
-    def __init__(self, cache, address, **kwargs):
+    def __init__(self, address, **kwargs):
         super(SyslogListener, self).__init__(**kwargs)
-        self.server = SyslogServer(cache, address)
+        self.queues = {}  # tag - SyslogQueue
+        server_cls = UnixSyslogServer if isinstance(address, basestring) else SyslogServer
+        self.server = server_cls(self.queues, address)
+        self.addresses = set((address, self.server.address))
+        self.thread = None
+
+        # counters of the socket at the last report
+        self.reported_unmatched = 0
+        self.reported_invalid = 0
+        self.reported_kernel_drops = 0
+
+    def pop_counters(self):
+        """
+        Returns counters of the socket since the previous call, so they are reported once for all tails
+
+        :return: (int unmatched, int invalid, int kernel drops)
+        """
+        unmatched = self.server.unmatched - self.reported_unmatched
+        self.reported_unmatched = self.server.unmatched
+
+        invalid = self.server.invalid - self.reported_invalid
+        self.reported_invalid = self.server.invalid
+
+        kernel = self.server.kernel_drops()
+        if kernel is None:
+            kernel = self.reported_kernel_drops
+        kernel_drops = kernel - self.reported_kernel_drops
+        self.reported_kernel_drops = kernel
+
+        return unmatched, invalid, kernel_drops
 
     def start(self):
         current_thread().name = self.name
@@ -91,28 +322,42 @@ class SyslogListener(AbstractManager):
         self.running = True
 
         while self.running:
-            self._wait(0.1)
-            # This means that we don't increment every time a UDP message is handled, but rather every listen "period"
-            context.inc_action_id()
-            asyncore.loop(timeout=self.interval, count=10)
-            # count is arbitrary since timeout is unreliable at breaking asyncore.loop
+            try:
+                # gevent select lets other greenlets run while waiting (asyncore.loop would block all of them)
+                readable, _, _ = select.select([self.server.socket], [], [], self.interval)
+                if readable:
+                    # This means that we don't increment every time a UDP message is handled, but rather every wakeup
+                    context.inc_action_id()
+                    self.server.handle_read()
+            except Exception:
+                if not self.running:
+                    break  # the socket is closed by stop()
+
+                # the listener is shared by all logs sent to the socket, it has to keep running
+                context.log.error('syslog listener %s failed, will continue' % str(self.server.address))
+                context.log.debug('additional info:', exc_info=True)
+                time.sleep(self.interval)
 
     def stop(self):
+        self.running = False
         self.server.close()
         super(SyslogListener, self).stop()
 
 
 class SyslogTail(Pipeline):
-    """Generalized Pipeline wrapper to provide a developer API for interacting with UDP listener."""
-    def __init__(self, address, maxlen=10000, **kwargs):
-        super(SyslogTail, self).__init__(name='syslog:%s' % str(address))
+    """
+    Generalized Pipeline wrapper to provide a developer API for interacting with UDP listener.  Tails of one address
+    share a listener and get messages with their own syslog tag.
+    """
+    def __init__(self, address, maxlen=10000, tag='amplify', **kwargs):
+        super(SyslogTail, self).__init__(name='syslog:%s,tag=%s' % (str(address), tag))
         self.kwargs = kwargs  # only have to record this due to new listener fail-over logic
         self.maxlen = maxlen
-        self.cache = deque(maxlen=self.maxlen)
+        self.queue = SyslogQueue(maxlen=self.maxlen)
         self.address = address  # This stores the address that we were passed
+        self.tag = tag
         self.listener = None
         self.listener_setup_attempts = 0
-        self.thread = None
 
         # Try to start listener right away, handle the exception
         try:
@@ -128,6 +373,10 @@ class SyslogTail(Pipeline):
 
         self.running = True
 
+    @property
+    def cache(self):
+        return self.queue.cache
+
     def __iter__(self):
         if not self.listener and self.listener_setup_attempts < 3:
             try:
@@ -154,41 +403,86 @@ class SyslogTail(Pipeline):
                     )
                     context.log.debug('additional info:', exc_info=True)
 
-        current_cache = copy.deepcopy(self.cache)
+        current_cache = self.queue.swap()
         context.log.debug('SyslogTail returned %s lines captured from %s' % (len(current_cache), self.name))
-        self.cache.clear()
         return iter(current_cache)
 
+    def report(self, statsd):
+        if not self.listener:
+            return
+
+        received, dropped = self.queue.received, self.queue.dropped
+        self.queue.received = self.queue.dropped = 0
+        unmatched, invalid, kernel_drops = self.listener.pop_counters()
+
+        if dropped:
+            context.log.warning(
+                '%s dropped %s messages because the cache was full (maxlen is %s)' % (self.name, dropped, self.maxlen)
+            )
+
+        if unmatched:
+            context.log.debug(
+                '%s messages to %s had tags nobody listens to (%s)' % (
+                    unmatched, self.address, ', '.join(sorted(self.listener.queues))
+                )
+            )
+
+        for metric_name, value in (
+            ('amplify.agent.syslog.received', received),
+            ('amplify.agent.syslog.dropped', dropped),
+            ('amplify.agent.syslog.unmatched', unmatched),
+            ('amplify.agent.syslog.invalid', invalid),
+            ('amplify.agent.syslog.kernel_dropped', kernel_drops),
+        ):
+            if value:
+                statsd.incr(metric_name, value)
+
     def _setup_listener(self, **kwargs):
-        if self.address in SYSLOG_ADDRESSES:
+        listener = SYSLOG_LISTENERS.get(self.address)
+
+        if (listener is None and self.address in SYSLOG_ADDRESSES) or (listener and self.tag in listener.queues):
             self.listener_setup_attempts += 1
             raise AmplifyAddresssAlreadyInUse(
                 message='Cannot initialize "%s" because address is already in use' % self.name,
                 payload=dict(
                     address=self.address,
+                    tag=self.tag,
                     used=list(SYSLOG_ADDRESSES)
                 )
             )
 
-        SYSLOG_ADDRESSES.add(self.address)
-        self.listener = SyslogListener(cache=self.cache, address=self.address, **kwargs)
-        self.thread = spawn(self.listener.start)
+        if listener is None:
+            listener = SyslogListener(address=self.address, **kwargs)
+            for address in listener.addresses:
+                SYSLOG_ADDRESSES.add(address)
+                SYSLOG_LISTENERS[address] = listener
+            listener.thread = spawn(listener.start)
+        else:
+            context.log.debug('%s shares the listener of %s' % (self.name, str(listener.server.address)))
+
+        listener.queues[self.tag] = self.queue
+        self.listener = listener
 
     def stop(self):
         if self.running:
-            # Remove from used addresses
-            for address in set((self.address, self.listener.server.address)):
-                SYSLOG_ADDRESSES.remove(address)
+            listener, self.listener = self.listener, None
+
+            if listener:
+                listener.queues.pop(self.tag, None)
 
-            self.listener.stop()  # Close the UDP server
-            self.thread.kill()  # Kill the greenlet
+                # the last tail of the address stops the listener
+                if not listener.queues:
+                    # Remove from used addresses
+                    for address in listener.addresses:
+                        SYSLOG_ADDRESSES.discard(address)
+                        SYSLOG_LISTENERS.pop(address, None)
 
-            # Unassign variables to reduce reference count for GC
-            self.listener = None
-            self.thread = None
+                    listener.thread.kill()  # Kill the greenlet first, so it doesn't wait for a closed socket
+                    listener.stop()  # Close the UDP server
+                    listener.thread = None
 
             # For good measure clear the cache to free memory and set running variable manually to False
-            self.cache.clear()
+            self.queue.cache.clear()
             self.running = False
             context.log.debug('SyslogTail stopped')
 
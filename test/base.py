@@ -60,6 +60,8 @@ class BaseTestCase(TestCase):
 
         import amplify.agent.pipelines.file
         amplify.agent.pipelines.file.OFFSET_CACHE = {}
+        amplify.agent.pipelines.file.OFFSET_STORE = None
+        amplify.agent.pipelines.file.SHARED_READERS = {}
 
     def teardown_method(self, method):
         pass
@@ -36,3 +36,10 @@ def collected_metric(matcher=None):
         has_length(2),
         contains(greater_than(1476820876), matcher or anything())
     )
+
+
+def collected_gauge(matcher=None):
+    return has_properties(
+        stamp=greater_than(1476820876),
+        last=matcher or anything()
+    )
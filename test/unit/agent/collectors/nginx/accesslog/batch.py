@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from hamcrest import *
+
+from amplify.agent.collectors.nginx.accesslog import NginxAccessLogsCollector
+from amplify.agent.objects.nginx.filters import Filter
+from test.base import NginxCollectorTestCase
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class LogsBatchTestCase(NginxCollectorTestCase):
+
+    log_format = '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent ' + \
+                 '"$http_referer" "$http_user_agent" rt=$request_time ua="$upstream_addr" ' + \
+                 'us="$upstream_status" ut="$upstream_response_time" ul="$upstream_response_length" ' + \
+                 'cs=$upstream_cache_status bs=$bytes_sent rl=$request_length gz=$gzip_ratio'
+
+    lines = [
+        '1.2.3.4 - - [22/Jan/2010:19:34:21 +0300] "GET /foo/ HTTP/1.1" 200 11078 "-" "curl/7.35.0" ' +
+        'rt=0.010 ua="10.0.0.1:80, 10.0.0.2:80" us="502, 200" ut="2.001, 0.345" ul="0, 11078" cs=MISS ' +
+        'bs=11300 rl=120 gz=2.50',
+
+        '1.2.3.4 - - [22/Jan/2010:19:34:22 +0300] "POST /api/ HTTP/1.0" 201 2 "-" "curl/7.35.0" ' +
+        'rt=0.100 ua="10.0.0.1:80" us="201" ut="0.099" ul="2" cs=- bs=200 rl=512 gz=-',
+
+        '1.2.3.4 - - [22/Jan/2010:19:34:23 +0300] "GET /img/a.png HTTP/2.0" 304 0 "-" "curl/7.35.0" ' +
+        'rt=0.000 ua="-" us="-" ut="-" ul="-" cs=HIT bs=150 rl=90 gz=-',
+
+        '1.2.3.4 - - [22/Jan/2010:19:34:24 +0300] "PROPFIND /dav/ HTTP/1.1" 499 0 "-" "curl/7.35.0" ' +
+        'rt=1.500 ua="10.0.0.3:80" us="504" ut="1.499" ul="0" cs=- bs=0 rl=300 gz=-',
+
+        '1.2.3.4 - - [22/Jan/2010:19:34:25 +0300] "GET /img/b.png HTTP/1.1" 404 150 "-" "curl/7.35.0" ' +
+        'rt=0.002 ua="-" us="-" ut="-" ul="-" cs=- bs=300 rl=95 gz=1.10',
+
+        '1.2.3.4 - - [22/Jan/2010:19:34:26 +0300] "XX / HTTP/1.1" 400 166 "-" "-" ' +
+        'rt=0.001 ua="-" us="-" ut="-" ul="-" cs=- bs=166 rl=0 gz=-',
+    ]
+
+    filters = [
+        Filter(filter_rule_id=1, metric='nginx.http.status.2xx', data=[{'$request_method': 'GET'}]),
+        Filter(filter_rule_id=2, metric='nginx.http.request.time', data=[{'$request_uri': '/img.*'}]),
+        Filter(filter_rule_id=3, metric='nginx.upstream.response.time', data=[{'$status': '200'}]),
+        Filter(filter_rule_id=4, metric='nginx.http.request.length', data=[{'$server_protocol': 'HTTP/1.1'}]),
+        Filter(filter_rule_id=5, metric='nginx.upstream.next.count', data=[{'$request_method': 'GET'}]),
+        Filter(filter_rule_id=6, metric='nginx.http.method.get', data=[{'$status': '500'}]),
+    ]
+
+    def collect(self, batch_size):
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, log_format=self.log_format, tail=self.lines, batch_size=batch_size
+        )
+        collector.collect()
+
+        # drop timestamps, they are not related to the way lines are aggregated
+        metrics = self.fake_object.statsd.flush()['metrics']
+        return dict(
+            (metric_type, dict((name, [value for stamp, value in values]) for name, values in store.iteritems()))
+            for metric_type, store in metrics.iteritems()
+        )
+
+    def test_batch_equals_per_line(self):
+        self.fake_object.filters = self.filters
+        per_line = self.collect(batch_size=0)
+
+        for batch_size in (1, 2, 2000):
+            assert_that(self.collect(batch_size=batch_size), equal_to(per_line))
+
+        # make sure that the check is not trivial
+        assert_that(per_line['counter']['C|nginx.http.method.get'], equal_to([3]))
+        assert_that(per_line['counter']['C|nginx.http.status.discarded'], equal_to([1]))
+        assert_that(per_line['counter']['C|nginx.http.request.malformed'], equal_to([1]))
+        assert_that(per_line['counter']['C|nginx.upstream.next.count||5'], equal_to([1]))
+        assert_that(per_line['timer']['G|nginx.http.request.time||2'], equal_to([0.001]))
+        assert_that(per_line['average']['G|nginx.http.request.length'], equal_to([223.4]))
+
+    def test_unknown_method_disables_batches(self):
+        def custom_method(data, matched_filters=None):
+            self.fake_object.statsd.incr('custom.count')
+
+        collector = NginxAccessLogsCollector(object=self.fake_object, log_format=self.log_format, tail=self.lines)
+        collector.register(custom_method)
+        collector.collect_batch = None  # must not be called
+        collector.collect()
+
+        metrics = self.fake_object.statsd.flush()['metrics']
+        assert_that(metrics['counter']['C|custom.count'][0][1], equal_to(5))
+        assert_that(metrics['counter']['C|nginx.http.method.get'][0][1], equal_to(3))
@@ -190,3 +190,18 @@ class LogsFiltersTestCase(NginxCollectorTestCase):
         # check our metric
         assert_that(counter['C|nginx.http.status.2xx'][0][1], equal_to(1))
         assert_that(counter['C|nginx.http.status.2xx||2'][0][1], equal_to(1))
+
+    def test_filter_variables_are_parsed(self):
+        self.fake_object.filters = [
+            Filter(
+                filter_rule_id=1,
+                metric='nginx.http.status.2xx',
+                data=[
+                    {'$http_user_agent': '.*Slackbot.*'}
+                ]
+            )
+        ]
+
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=self.lines)
+        assert_that(collector.parser.regex_string, contains_string('<http_user_agent>'))
+        assert_that(collector.parser.regex_string, is_not(contains_string('<http_referer>')))
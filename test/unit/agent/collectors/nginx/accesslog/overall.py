@@ -2,6 +2,7 @@
 from hamcrest import *
 
 from amplify.agent.collectors.nginx.accesslog import NginxAccessLogsCollector
+from amplify.agent.objects.nginx.log.access import NginxAccessLogParser
 from test.base import NginxCollectorTestCase
 
 __author__ = "Mike Belov"
@@ -288,7 +289,8 @@ class LogsOverallTestCase(NginxCollectorTestCase):
         collector.collect()
 
         # Make sure that variable name with number is properly formatted...
-        regex_string = collector.parser.regex_string
+        assert_that(collector.parser.keys, has_items('geoip_country_code', 'geoip_country_code3'))
+        regex_string = NginxAccessLogParser(log_format).regex_string
         assert_that(regex_string, contains_string('<geoip_country_code>'))
         assert_that(regex_string, contains_string('<geoip_country_code3>'))
 
@@ -299,3 +301,54 @@ class LogsOverallTestCase(NginxCollectorTestCase):
         # check some values
         counter = metrics['counter']
         assert_that(counter['C|nginx.http.status.2xx'][0][1], equal_to(7))
+
+    def test_unused_variables_are_not_parsed(self):
+        """
+        Variables that are not used by collector methods or filters should be skipped by the parser
+        """
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=[])
+
+        assert_that(collector.parser.keys, has_items('http_referer', 'http_user_agent'))
+        assert_that(collector.parser.regex_string, is_not(contains_string('<http_user_agent>')))
+        assert_that(collector.parser.regex_string, contains_string('<request>'))
+
+        line = \
+            '127.0.0.1 - - [18/Jun/2015:17:22:33 +0000] "POST /1.0/589fjinijenfirjf/meta/ HTTP/1.1" ' + \
+            '202 2 "-" "python-requests/2.2.1 CPython/2.7.6 Linux/3.13.0-48-generic"'
+        parsed = collector.parser.parse(line)
+
+        assert_that(parsed, is_not(has_key('http_user_agent')))
+        assert_that(parsed, is_not(has_key('remote_addr')))
+        assert_that(parsed['status'], equal_to('202'))
+        assert_that(parsed['body_bytes_sent'], equal_to(2))
+        assert_that(parsed['request_method'], equal_to('POST'))
+
+    def test_parser_path_metrics(self):
+        lines = [
+            '127.0.0.1 - - [18/Jun/2015:17:22:33 +0000] "POST /1.0/589fjinijenfirjf/meta/ HTTP/1.1" ' +
+            '202 2 "-" "python-requests/2.2.1 CPython/2.7.6 Linux/3.13.0-48-generic"',
+
+            '52.6.158.18 - - [18/Jun/2015:17:22:40 +0000] "GET /#/objects HTTP/1.1" 416 84 ' +
+            '"-" "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)" "extra"'
+        ]
+
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=lines)
+        collector.collect()
+
+        counter = self.fake_object.statsd.flush()['metrics']['counter']
+        assert_that(counter['C|amplify.agent.log.parser.tokenizer'][0][1], equal_to(1))
+        assert_that(counter['C|amplify.agent.log.parser.regex'][0][1], equal_to(1))
+
+        # nothing is counted for idle logs
+        collector.tail = []
+        collector.collect()
+        counter = self.fake_object.statsd.flush()['metrics']['counter']
+        assert_that(counter, is_not(has_key('C|amplify.agent.log.parser.tokenizer')))
+        assert_that(counter, is_not(has_key('C|amplify.agent.log.parser.regex')))
+
+        # formats without a tokenizer are always parsed with regex, that is not counted
+        collector = NginxAccessLogsCollector(object=self.fake_object, log_format='$request_time', tail=['0.010'])
+        assert_that(collector.parser.tokenizer, none())
+        collector.collect()
+        counter = self.fake_object.statsd.flush()['metrics'].get('counter', {})
+        assert_that(counter, is_not(has_key('C|amplify.agent.log.parser.regex')))
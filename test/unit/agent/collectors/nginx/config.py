@@ -2,7 +2,9 @@
 from hamcrest import *
 
 from amplify.agent.common.context import context
+from amplify.agent.common.errors import AmplifyWorkerError
 from amplify.agent.managers.nginx import NginxManager
+from amplify.agent.objects.nginx.config.worker import NginxConfigWorker
 from test.base import RealNginxTestCase
 
 __author__ = "Mike Belov"
@@ -34,6 +36,9 @@ class ConfigCollectorTestCase(RealNginxTestCase):
         cfg_collector.collect()
         assert_that(nginx_obj.configd.current, not_(empty()))
 
+        # files were hashed for the checksum of the first parse
+        assert_that(nginx_obj.statsd.current['counter'], has_key('amplify.agent.config.digest_misses'))
+
     def test_skip_parse_until_change(self):
         manager = NginxManager()
 
@@ -71,6 +76,28 @@ class ConfigCollectorTestCase(RealNginxTestCase):
         cfg_collector.collect(no_delay=True)
         assert_that(NginxConfig.__full_parse_calls, equal_to(2))
 
+    def test_parse_again_after_failure(self):
+        manager = NginxManager()
+        manager._discover_objects()
+        nginx_obj = manager.objects.objects[manager.objects.objects_by_type[manager.type][0]]
+        cfg_collector = nginx_obj.collectors[0]
+        config = nginx_obj.config
+
+        # make the next parse fail
+        cfg_collector.previous['files'] = {}
+        cfg_collector.parse_in_worker = True
+        config.worker = NginxConfigWorker(config, timeout=0.01)
+        assert_that(calling(cfg_collector.parse_config).with_args(no_delay=True), raises(AmplifyWorkerError))
+        assert_that(cfg_collector.previous['files'], equal_to({}))
+
+        # nothing has changed, but the config is parsed again
+        config.worker.timeout = 120.0
+        cfg_collector.parse_config(no_delay=True)
+        assert_that(cfg_collector.previous['files'], not_(equal_to({})))
+
+        nginx_obj.stop()
+        assert_that(config.worker, none())
+
     def test_test_run_time(self):
         container = NginxManager()
         container._discover_objects()
@@ -367,25 +367,31 @@ class UpstreamCollectorTestCase(BaseTestCase):
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 1}}}, 3))
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 2}}}, 14))
         upstream_collector.collect()
-        assert_that(gauges['plus.upstream.peer.count'], equal_to([(14, 2)]))
+        assert_that(gauges['plus.upstream.peer.count'].stamp, equal_to(14))
+        assert_that(gauges['plus.upstream.peer.count'].last, equal_to(2))
+        assert_that(gauges['plus.upstream.peer.count'], has_length(1))
 
         # shows that the metric works even if the plus_cache data has been collected before
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 4}}}, 16))
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 2}}}, 20))
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 8}}}, 99))
         upstream_collector.collect()
-        assert_that(gauges['plus.upstream.peer.count'], equal_to([(99, 8)]))
+        assert_that(gauges['plus.upstream.peer.count'].stamp, equal_to(99))
+        assert_that(gauges['plus.upstream.peer.count'].last, equal_to(8))
+        assert_that(gauges['plus.upstream.peer.count'], has_length(1))
 
         # shows that only peers with state == 'up' count towards upstream.peer.count
         test_peer['state'] = 'down'
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 5}}}, 110))
         upstream_collector.collect()
-        assert_that(gauges['plus.upstream.peer.count'], equal_to([(99, 8)]))  # doesn't change because state is 'down'
+        assert_that(gauges['plus.upstream.peer.count'].stamp, equal_to(99))  # doesn't change because state is 'down'
+        assert_that(gauges['plus.upstream.peer.count'].last, equal_to(8))
 
         test_peer['state'] = 'up'
         context.plus_cache.put('test_status', ({"upstreams": {"trac-backend": {"peers": [test_peer] * 2}}}, 120))
         upstream_collector.collect()
-        assert_that(gauges['plus.upstream.peer.count'], equal_to([(120, 2)]))
+        assert_that(gauges['plus.upstream.peer.count'].stamp, equal_to(120))
+        assert_that(gauges['plus.upstream.peer.count'].last, equal_to(2))
 
     def test_collect_complete(self):
         upstream = NginxUpstreamObject(local_name='uploader', parent_local_id='nginx123', root_uuid='root123')
@@ -587,8 +593,8 @@ class UpstreamCollectorTestCase(BaseTestCase):
         ):
             assert_that(timers, has_key(key))
 
-        assert_that(timers['plus.upstream.header.time'][0], equal_to(16.749))
-        assert_that(timers['plus.upstream.response.time'][0], equal_to(16.75))
+        assert_that(timers['plus.upstream.header.time'].max, equal_to(16.749))
+        assert_that(timers['plus.upstream.response.time'].max, equal_to(16.75))
 
     def test_collect_complete_old_plus(self):
         upstream = NginxUpstreamObject(local_name='secretupstream', parent_local_id='nginx123', root_uuid='root123')
@@ -633,8 +639,8 @@ class UpstreamCollectorTestCase(BaseTestCase):
         ):
             assert_that(gauges, has_key(key))
 
-        assert_that(gauges['plus.upstream.conn.active'][0][1], equal_to(0))
-        assert_that(gauges['plus.upstream.peer.count'][0][1], equal_to(2))
+        assert_that(gauges['plus.upstream.conn.active'].last, equal_to(0))
+        assert_that(gauges['plus.upstream.peer.count'].last, equal_to(2))
 
 
 
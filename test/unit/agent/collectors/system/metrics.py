@@ -7,7 +7,7 @@ from hamcrest import *
 from amplify.agent.collectors.system.metrics import SystemMetricsCollector
 from amplify.agent.managers.system import SystemManager
 from test.base import BaseTestCase
-from test.helpers import collected_metric
+from test.helpers import collected_metric, collected_gauge
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -57,45 +57,45 @@ class SystemMetricsCollectorTestCase(BaseTestCase):
         # check gauges
         assert_that(self.metrics, has_key('gauge'))
         gauges = self.metrics['gauge']
-        assert_that(gauges, has_entry('amplify.agent.cpu.system', collected_metric()))
-        assert_that(gauges, has_entry('amplify.agent.cpu.user', collected_metric()))
-        assert_that(gauges, has_entry('amplify.agent.mem.rss', collected_metric()))
-        assert_that(gauges, has_entry('amplify.agent.mem.vms', collected_metric()))
-        assert_that(gauges, has_entry('amplify.agent.status', collected_metric()))
-        assert_that(gauges, has_entry('system.cpu.idle', collected_metric()))
-        assert_that(gauges, has_entry('system.cpu.iowait', collected_metric()))
-        assert_that(gauges, has_entry('system.cpu.stolen', collected_metric()))
-        assert_that(gauges, has_entry('system.cpu.system', collected_metric()))
-        assert_that(gauges, has_entry('system.cpu.user', collected_metric()))
-        assert_that(gauges, has_entry('system.disk.free', collected_metric()))
-        assert_that(gauges, has_entry('system.disk.in_use', collected_metric()))
-        assert_that(gauges, has_entry('system.disk.total', collected_metric()))
-        assert_that(gauges, has_entry('system.disk.used', collected_metric()))
-        assert_that(gauges, has_entry('system.load.1', collected_metric()))
-        assert_that(gauges, has_entry('system.load.15', collected_metric()))
-        assert_that(gauges, has_entry('system.load.5', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.available', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.buffered', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.cached', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.free', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.pct_used', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.total', collected_metric()))
-        assert_that(gauges, has_entry('system.mem.used', collected_metric()))
-        assert_that(gauges, has_entry('system.swap.free', collected_metric()))
-        assert_that(gauges, has_entry('system.swap.pct_free', collected_metric()))
-        assert_that(gauges, has_entry('system.swap.total', collected_metric()))
-        assert_that(gauges, has_entry('system.swap.used', collected_metric()))
-        assert_that(gauges, has_entry(starts_with('system.disk.total|'), collected_metric()))
-        assert_that(gauges, has_entry(starts_with('system.disk.used|'), collected_metric()))
-        assert_that(gauges, has_entry(starts_with('system.disk.free|'), collected_metric()))
-        assert_that(gauges, has_entry(starts_with('system.disk.in_use|'), collected_metric()))
-        assert_that(gauges, has_entry(starts_with('system.io.wait_r|'), collected_metric()))
-        assert_that(gauges, has_entry(starts_with('system.io.wait_w|'), collected_metric()))
+        assert_that(gauges, has_entry('amplify.agent.cpu.system', collected_gauge()))
+        assert_that(gauges, has_entry('amplify.agent.cpu.user', collected_gauge()))
+        assert_that(gauges, has_entry('amplify.agent.mem.rss', collected_gauge()))
+        assert_that(gauges, has_entry('amplify.agent.mem.vms', collected_gauge()))
+        assert_that(gauges, has_entry('amplify.agent.status', collected_gauge()))
+        assert_that(gauges, has_entry('system.cpu.idle', collected_gauge()))
+        assert_that(gauges, has_entry('system.cpu.iowait', collected_gauge()))
+        assert_that(gauges, has_entry('system.cpu.stolen', collected_gauge()))
+        assert_that(gauges, has_entry('system.cpu.system', collected_gauge()))
+        assert_that(gauges, has_entry('system.cpu.user', collected_gauge()))
+        assert_that(gauges, has_entry('system.disk.free', collected_gauge()))
+        assert_that(gauges, has_entry('system.disk.in_use', collected_gauge()))
+        assert_that(gauges, has_entry('system.disk.total', collected_gauge()))
+        assert_that(gauges, has_entry('system.disk.used', collected_gauge()))
+        assert_that(gauges, has_entry('system.load.1', collected_gauge()))
+        assert_that(gauges, has_entry('system.load.15', collected_gauge()))
+        assert_that(gauges, has_entry('system.load.5', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.available', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.buffered', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.cached', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.free', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.pct_used', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.total', collected_gauge()))
+        assert_that(gauges, has_entry('system.mem.used', collected_gauge()))
+        assert_that(gauges, has_entry('system.swap.free', collected_gauge()))
+        assert_that(gauges, has_entry('system.swap.pct_free', collected_gauge()))
+        assert_that(gauges, has_entry('system.swap.total', collected_gauge()))
+        assert_that(gauges, has_entry('system.swap.used', collected_gauge()))
+        assert_that(gauges, has_entry(starts_with('system.disk.total|'), collected_gauge()))
+        assert_that(gauges, has_entry(starts_with('system.disk.used|'), collected_gauge()))
+        assert_that(gauges, has_entry(starts_with('system.disk.free|'), collected_gauge()))
+        assert_that(gauges, has_entry(starts_with('system.disk.in_use|'), collected_gauge()))
+        assert_that(gauges, has_entry(starts_with('system.io.wait_r|'), collected_gauge()))
+        assert_that(gauges, has_entry(starts_with('system.io.wait_w|'), collected_gauge()))
 
     def test_agent_memory_info(self):
         gauges = self.metrics['gauge']
-        assert_that(gauges['amplify.agent.mem.rss'], collected_metric(greater_than(0)))
-        assert_that(gauges['amplify.agent.mem.vms'], collected_metric(greater_than(0)))
+        assert_that(gauges['amplify.agent.mem.rss'], collected_gauge(greater_than(0)))
+        assert_that(gauges['amplify.agent.mem.vms'], collected_gauge(greater_than(0)))
 
 
 class MetricsParsersTestCase(BaseTestCase):
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import tempfile
+
+from hamcrest import *
+
+from amplify.agent.common.util.digest import FileDigests
+from test.base import BaseTestCase
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class FileDigestsTestCase(BaseTestCase):
+
+    def setup_method(self, method):
+        super(FileDigestsTestCase, self).setup_method(method)
+        self.folder = tempfile.mkdtemp()
+        self.first, self.second = self.folder + '/first.pem', self.folder + '/second.pem'
+        self.write(self.first, 'first')
+        self.write(self.second, 'second')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.folder)
+        super(FileDigestsTestCase, self).teardown_method(method)
+
+    @staticmethod
+    def write(path, contents):
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def test_cached(self):
+        digests = FileDigests()
+        assert_that(digests.digest(self.first), equal_to(hashlib.sha256('first').hexdigest()))
+        assert_that(digests.digest(self.second), equal_to(hashlib.sha256('second').hexdigest()))
+        assert_that(digests.digest(self.first), equal_to(hashlib.sha256('first').hexdigest()))
+        assert_that((digests.hits, digests.misses), equal_to((1, 2)))
+
+    def test_changed(self):
+        digests = FileDigests()
+        digests.digest(self.first)
+
+        self.write(self.first, 'changed')
+        assert_that(digests.digest(self.first), equal_to(hashlib.sha256('changed').hexdigest()))
+
+        # replaced by another file of the same size and mtime
+        stat = os.stat(self.first)
+        self.write(self.second, 'CHANGED')
+        os.utime(self.second, (stat.st_atime, stat.st_mtime))
+        os.rename(self.second, self.first)
+        assert_that(digests.digest(self.first), equal_to(hashlib.sha256('CHANGED').hexdigest()))
+        assert_that((digests.hits, digests.misses), equal_to((0, 3)))
+
+    def test_forget_others(self):
+        digests = FileDigests()
+        digests.digest(self.first)
+        digests.digest(self.second)
+
+        digests.forget_others({self.second})
+        assert_that(digests.digests, only_contains(self.second))
+
+    def test_missing_file(self):
+        digests = FileDigests()
+        assert_that(calling(digests.digest).with_args(self.folder + '/missing.pem'), raises(OSError))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import random
+
+from hamcrest import *
+
+from amplify.agent.common.util.sketch import QuantileSketch, RELATIVE_ACCURACY
+from test.base import BaseTestCase
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class QuantileSketchTestCase(BaseTestCase):
+
+    def samples(self):
+        rnd = random.Random(42)
+        return {
+            'lognormal': [rnd.lognormvariate(-3, 1.5) for _ in xrange(20000)],
+            'uniform': [rnd.uniform(0, 60) for _ in xrange(5000)],
+            'rounded': [float('%.3f' % rnd.expovariate(10)) for _ in xrange(5000)],  # lots of zeros and duplicates
+            'mixed': [rnd.uniform(-1, 1) for _ in xrange(1000)] + [0] * 100,
+            'small': [0.5, 0.1, 0.3],
+        }
+
+    def assert_close(self, estimate, exact):
+        assert_that(abs(estimate - exact), less_than_or_equal_to(RELATIVE_ACCURACY * abs(exact) + 1e-9))
+
+    def test_ranks(self):
+        for name, values in self.samples().iteritems():
+            sketch = QuantileSketch()
+            sketch.extend(values)
+            exact = sorted(values)
+
+            assert_that(len(sketch), equal_to(len(values)))
+            assert_that(sketch.min, equal_to(exact[0]))
+            assert_that(sketch.max, equal_to(exact[-1]))
+            assert_that(sketch.sum, close_to(sum(values), 1e-6))
+
+            for rank in range(0, len(exact), max(1, len(exact) / 200)) + [-1, -len(exact)]:
+                self.assert_close(sketch.value_at(rank), exact[rank])
+
+    def test_percentiles(self):
+        # the same indexes StatsdClient.flush uses
+        for name, values in self.samples().iteritems():
+            sketch = QuantileSketch()
+            sketch.extend(values)
+            exact, length = sorted(values), len(values)
+
+            self.assert_close(sketch.value_at(int(round(length / 2 - 1))), exact[int(round(length / 2 - 1))])
+            self.assert_close(sketch.value_at(-int(round(length * .05))), exact[-int(round(length * .05))])
+            self.assert_close(sketch.value_at(-int(round(length * .01))), exact[-int(round(length * .01))])
+
+    def test_merge(self):
+        values = self.samples()['lognormal']
+        whole, first, second = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        whole.extend(values)
+        first.extend(values[:5000])
+        second.extend(values[5000:])
+        first.merge(second)
+        first.merge(QuantileSketch())
+
+        for attr in ('count', 'min', 'max', 'zeros', 'positive', 'negative'):
+            assert_that(getattr(first, attr), equal_to(getattr(whole, attr)))
+        assert_that(first.sum, close_to(whole.sum, 1e-6))
+
+        assert_that(calling(first.merge).with_args(QuantileSketch(relative_accuracy=0.02)), raises(ValueError))
+
+    def test_bounded(self):
+        rnd = random.Random(42)
+        sketch = QuantileSketch()
+        sketch.extend(rnd.uniform(0, 86400) for _ in xrange(100000))
+        assert_that(len(sketch.positive), less_than(1000))
+
+    def test_empty(self):
+        sketch = QuantileSketch()
+        assert_that(len(sketch), equal_to(0))
+        assert_that(calling(sketch.value_at).with_args(0), raises(IndexError))
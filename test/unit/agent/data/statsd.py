@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import random
+
+from hamcrest import *
+
+from amplify.agent.common.context import context
+from amplify.agent.common.util.sketch import QuantileSketch
+from amplify.agent.data.statsd import StatsdClient, RunningAggregate, parse_percentiles
+from amplify.agent.objects.abstract import AbstractObject
+from test.base import BaseTestCase
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class FakeObject(object):
+    definition = {'type': 'nginx', 'local_id': 'abc'}
+
+
+class StatsdHandlesTestCase(BaseTestCase):
+
+    def setup_method(self, method):
+        super(StatsdHandlesTestCase, self).setup_method(method)
+        self.statsd = StatsdClient(object=FakeObject())
+
+    def test_handles_are_cached(self):
+        counter = self.statsd.counter_handle('nginx.http.status.2xx')
+        assert_that(self.statsd.counter_handle('nginx.http.status.2xx'), same_instance(counter))
+        assert_that(self.statsd.timer_handle('nginx.http.status.2xx'), is_not(same_instance(counter)))
+
+    def test_counter(self):
+        counter = self.statsd.counter_handle('nginx.http.status.2xx')
+        counter.inc()
+        self.statsd.incr('nginx.http.status.2xx', 2)
+        counter.inc(3)
+
+        assert_that(self.statsd.current['counter']['nginx.http.status.2xx'], has_length(1))
+        assert_that(self.statsd.current['counter']['nginx.http.status.2xx'][0][1], equal_to(6))
+
+        metrics = self.statsd.flush()['metrics']
+        assert_that(metrics['counter']['C|nginx.http.status.2xx'][0][1], equal_to(6))
+
+    def test_timer_and_average(self):
+        self.statsd = StatsdClient(object=FakeObject(), exact_timers=True)
+        timer = self.statsd.timer_handle('nginx.http.request.time')
+        timer.add(0.5)
+        self.statsd.timer('nginx.http.request.time', 1.5)
+        timer.extend([1.0, 2.0])
+        timer.extend([])
+
+        average = self.statsd.average_handle('nginx.http.request.length')
+        average.add(10)
+        self.statsd.average('nginx.http.request.length', 20)
+
+        assert_that(self.statsd.current['timer']['nginx.http.request.time'], equal_to([0.5, 1.5, 1.0, 2.0]))
+        assert_that(self.statsd.current['average']['nginx.http.request.length'].sum, equal_to(30))
+        assert_that(self.statsd.current['average']['nginx.http.request.length'], has_length(2))
+
+        metrics = self.statsd.flush()['metrics']
+        assert_that(metrics['timer']['C|nginx.http.request.time.count'][0][1], equal_to(4))
+        assert_that(metrics['average']['G|nginx.http.request.length'][0][1], equal_to(15))
+
+    def test_handles_survive_flush(self):
+        counter = self.statsd.counter_handle('nginx.http.status.2xx')
+        timer = self.statsd.timer_handle('nginx.http.request.time')
+        counter.inc()
+        timer.add(1.0)
+        self.statsd.flush()
+
+        # nothing is reported if handles were not used
+        metrics = self.statsd.flush()
+        assert_that(metrics, is_not(has_key('metrics')))
+
+        counter.inc(5)
+        timer.add(2.0)
+        metrics = self.statsd.flush()['metrics']
+        assert_that(metrics['counter']['C|nginx.http.status.2xx'][0][1], equal_to(5))
+        assert_that(metrics['timer']['G|nginx.http.request.time.max'][0][1], equal_to(2.0))
+
+
+class StatsdAggregatesTestCase(BaseTestCase):
+
+    def test_running_aggregate(self):
+        aggregate = RunningAggregate()
+        aggregate.append(3, stamp=10)
+        aggregate.extend([1, 5, 2])
+        aggregate.extend(value for value in [4])
+        aggregate.extend([])
+
+        assert_that(aggregate, has_length(5))
+        assert_that(aggregate.sum, equal_to(15))
+        assert_that(aggregate.min, equal_to(1))
+        assert_that(aggregate.max, equal_to(5))
+        assert_that(aggregate.last, equal_to(4))
+        assert_that(aggregate.stamp, equal_to(10))
+
+    def test_gauge(self):
+        statsd = StatsdClient(object=FakeObject())
+        statsd.gauge('nginx.http.conn.current', 10, stamp=100)
+        statsd.gauge('nginx.http.conn.current', 5, delta=True, stamp=101)
+        statsd.gauge('nginx.http.conn.current', 3, stamp=102)
+        statsd.latest('nginx.workers.count', 4, stamp=100)
+        statsd.latest('nginx.workers.count', 2, stamp=99)
+        statsd.agent('amplify.agent.status', 1, stamp=100)
+        statsd.maximum('amplify.agent.tail.lag_bytes', 0, stamp=100)
+        statsd.maximum('amplify.agent.tail.lag_bytes', 500, stamp=101)
+        statsd.maximum('amplify.agent.tail.lag_bytes', 20, stamp=102)
+
+        # the store doesn't grow
+        assert_that(statsd.current['gauge']['nginx.http.conn.current'], instance_of(RunningAggregate))
+
+        gauges = statsd.flush()['metrics']['gauge']
+        assert_that(gauges, equal_to({
+            'G|nginx.http.conn.current': [(102, 28 / 3.0)],
+            'G|nginx.workers.count': [(100, 4.0)],
+            'G|amplify.agent.status': [(100, 1.0)],
+            'G|amplify.agent.tail.lag_bytes': [(102, 500.0)],
+        }))
+
+    def test_gauge_extremes(self):
+        statsd = StatsdClient(object=FakeObject(), gauge_extremes=True)
+        for stamp, value in enumerate([5, 1, 9, 3]):
+            statsd.gauge('nginx.http.conn.current', value, stamp=stamp + 1)
+
+        gauges = statsd.flush()['metrics']['gauge']
+        assert_that(gauges['G|nginx.http.conn.current'], equal_to([(4, 4.5)]))
+        assert_that(gauges['G|nginx.http.conn.current.min'], equal_to([(4, 1)]))
+        assert_that(gauges['G|nginx.http.conn.current.max'], equal_to([(4, 9)]))
+
+    def test_average(self):
+        statsd = StatsdClient(object=FakeObject())
+        statsd.average('nginx.http.request.length', 10)
+        statsd.average_batch('nginx.http.request.length', [20, 30, 40])
+        statsd.average_batch('nginx.http.gzip.ratio', [1.5, 2.5])
+
+        averages = statsd.flush()['metrics']['average']
+        assert_that(averages['G|nginx.http.request.length'][0][1], equal_to(25))
+        assert_that(averages['G|nginx.http.gzip.ratio'][0][1], equal_to(2))
+
+
+class StatsdTimersTestCase(BaseTestCase):
+
+    def flush_timer(self, values, **kwargs):
+        statsd = StatsdClient(object=FakeObject(), **kwargs)
+        for value in values:
+            statsd.timer('nginx.http.request.time', value)
+        return statsd.flush()['metrics']['timer']
+
+    def test_sketch_is_default(self):
+        statsd = StatsdClient(object=FakeObject())
+        statsd.timer('nginx.http.request.time', 1.0)
+        assert_that(statsd.current['timer']['nginx.http.request.time'], instance_of(QuantileSketch))
+
+    def test_exact_from_config(self):
+        context.app_config['metrics']['timers'] = 'exact'
+        try:
+            statsd = StatsdClient(object=FakeObject())
+            statsd.timer('nginx.http.request.time', 1.0)
+            assert_that(statsd.current['timer']['nginx.http.request.time'], equal_to([1.0]))
+        finally:
+            context.app_config['metrics']['timers'] = 'sketch'
+
+    def test_sketch_vs_exact(self):
+        rnd = random.Random(1)
+        for values in (
+            [rnd.lognormvariate(-2, 1) for _ in xrange(10000)],
+            [float('%.3f' % rnd.expovariate(20)) for _ in xrange(3000)],
+            [0.25, 0.5, 0.1],
+            [2.346],
+        ):
+            exact = self.flush_timer(values, exact_timers=True)
+            sketch = self.flush_timer(values)
+            assert_that(sorted(sketch.keys()), equal_to(sorted(exact.keys())))
+
+            for key in ('C|nginx.http.request.time.count', 'G|nginx.http.request.time.max'):
+                assert_that(sketch[key][0][1], equal_to(exact[key][0][1]))
+
+            mean = 'G|nginx.http.request.time'
+            assert_that(sketch[mean][0][1], close_to(exact[mean][0][1], 1e-9))
+
+            for key in ('G|nginx.http.request.time.median', 'G|nginx.http.request.time.pctl95'):
+                estimate, value = sketch[key][0][1], exact[key][0][1]
+                assert_that(abs(estimate - value), less_than_or_equal_to(0.01 * value + 1e-9))
+
+
+class StatsdPercentilesTestCase(BaseTestCase):
+
+    def test_parse(self):
+        assert_that(parse_percentiles(None), equal_to({}))
+        assert_that(
+            parse_percentiles('nginx.http.request.time=50,99.9,99 nginx.upstream.response.time=99'),
+            equal_to({'nginx.http.request.time': (50, 99, 99.9), 'nginx.upstream.response.time': (99, )})
+        )
+        assert_that(
+            parse_percentiles({'nginx.http.request.time': [99, '99.9']}),
+            equal_to({'nginx.http.request.time': (99, 99.9)})
+        )
+        assert_that(calling(parse_percentiles).with_args('nginx.http.request.time'), raises(ValueError))
+        assert_that(calling(parse_percentiles).with_args('nginx.http.request.time=101'), raises(ValueError))
+
+    def test_flush(self):
+        percentiles = parse_percentiles('nginx.http.request.time=50,90,99,99.9')
+        for exact_timers in (True, False):
+            statsd = StatsdClient(object=FakeObject(), exact_timers=exact_timers, percentiles=percentiles)
+            for value in xrange(1, 1001):
+                statsd.timer('nginx.http.request.time', value / 1000.0)
+                statsd.timer('nginx.http.request.time||3', value / 1000.0)
+                statsd.timer('nginx.upstream.response.time', value / 1000.0)
+
+            timers = statsd.flush()['metrics']['timer']
+            for metric_name in ('nginx.http.request.time', 'nginx.http.request.time||3'):
+                for suffix, value in (('pctl50', 0.5), ('pctl90', 0.9), ('pctl99', 0.99), ('pctl99_9', 0.999)):
+                    assert_that(timers['G|%s.%s' % (metric_name, suffix)][0][1], close_to(value, value * 0.01))
+
+            assert_that(timers, has_key('G|nginx.upstream.response.time.pctl95'))
+            assert_that(timers, is_not(has_key('G|nginx.upstream.response.time.pctl99')))
+
+    def test_single_sample(self):
+        statsd = StatsdClient(object=FakeObject(), percentiles={'nginx.http.request.time': (99.9, )})
+        statsd.timer('nginx.http.request.time', 0.5)
+        timers = statsd.flush()['metrics']['timer']
+        assert_that(timers['G|nginx.http.request.time.pctl99_9'][0][1], equal_to(0.5))
+
+    def test_object_config(self):
+        class PercentilesObject(AbstractObject):
+            type = 'nginx'
+
+        context.app_config['containers']['nginx']['timer_percentiles'] = 'nginx.http.request.time=99'
+        try:
+            statsd = PercentilesObject(data={}).statsd
+            assert_that(statsd.percentiles, equal_to({'nginx.http.request.time': (99, )}))
+        finally:
+            del context.app_config['containers']['nginx']['timer_percentiles']
+
+
+class StatsdFlushTestCase(BaseTestCase):
+
+    def test_flush_swaps_stores(self):
+        statsd = StatsdClient(object=FakeObject())
+        statsd.incr('nginx.http.status.2xx')
+        statsd.timer('nginx.http.request.time', 1.0)
+        current = statsd.current
+
+        metrics = statsd.flush()['metrics']
+        assert_that(statsd.current, is_not(same_instance(current)))
+        assert_that(statsd.current, has_length(0))
+        assert_that(metrics['counter']['C|nginx.http.status.2xx'][0][1], equal_to(1))
+
+        # new values go to the fresh store and don't change the delivered one
+        statsd.incr('nginx.http.status.2xx', 5)
+        assert_that(current['counter']['nginx.http.status.2xx'][0][1], equal_to(1))
+        assert_that(statsd.flush()['metrics']['counter']['C|nginx.http.status.2xx'][0][1], equal_to(5))
@@ -299,6 +299,19 @@ class MiscConfigTestCase(BaseTestCase):
         new_checksum = config.checksum()
         assert_that(new_checksum, not_(equal_to(old_checksum)))
 
+    def test_checksum_digests_cached(self):
+        config = NginxConfig(simple_config)
+        config.full_parse()
+        checksum = config.checksum()
+        assert_that(config.digests.hits, equal_to(0))
+        assert_that(config.digests.misses, equal_to(len(config.files)))
+
+        # files are not read again
+        config.full_parse()
+        assert_that(config.checksum(), equal_to(checksum))
+        assert_that(config.digests.hits, equal_to(len(config.files)))
+        assert_that(config.digests.misses, equal_to(len(config.files)))
+
 
 class ExcludeConfigTestCase(BaseTestCase):
     """
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import shutil
+import tempfile
 
 from hamcrest import *
 
 from amplify.agent.objects.nginx.config.parser import NginxConfigParser, IGNORED_DIRECTIVES
 from test.base import BaseTestCase
+from test.unit.agent.objects.nginx.config.pyparsing_grammar import PyparsingNginxConfigParser
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -31,6 +34,7 @@ sub_filter_config = os.getcwd() + '/test/fixtures/nginx/custom/sub_filter.conf'
 proxy_pass_config = os.getcwd() + '/test/fixtures/nginx/custom/proxy_pass.conf'
 quoted_location_with_semicolon = os.getcwd() + '/test/fixtures/nginx/quoted_location_with_semicolon/nginx.conf'
 complex_add_header = os.getcwd() + '/test/fixtures/nginx/complex_add_header/nginx.conf'
+fixtures = os.getcwd() + '/test/fixtures/nginx'
 
 
 class ParserTestCase(BaseTestCase):
@@ -389,3 +393,125 @@ class ParserTestCase(BaseTestCase):
         cfg.parse()
 
         assert_that(cfg.errors, has_length(0))
+
+
+class ParserCacheTestCase(BaseTestCase):
+
+    def setup_method(self, method):
+        super(ParserCacheTestCase, self).setup_method(method)
+        self.folder = tempfile.mkdtemp()
+        os.mkdir(self.folder + '/sites')
+        self.write('nginx.conf', 'http {\n    include sites/*.conf;\n}\n')
+        for i in xrange(3):
+            self.write('sites/%s.conf' % i, 'server {\n    listen %s;\n}\n' % (8080 + i))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.folder)
+        super(ParserCacheTestCase, self).teardown_method(method)
+
+    def write(self, name, source):
+        with open('%s/%s' % (self.folder, name), 'w') as f:
+            f.write(source)
+
+    def parse(self, cfg):
+        """
+        Parses and returns names of files that were scanned
+        """
+        scanned = []
+        parse_source = cfg.parse_source
+
+        def counting_parse_source(source):
+            scanned.append(source)
+            return parse_source(source)
+
+        cfg.parse_source = counting_parse_source
+        cfg.parse()
+        return scanned
+
+    def assert_same_as_fresh(self, cfg):
+        fresh = NginxConfigParser(cfg.filename)
+        fresh.parse()
+        for attribute in ('tree', 'index', 'files', 'errors'):
+            assert_that(getattr(cfg, attribute), equal_to(getattr(fresh, attribute)), attribute)
+
+    def test_unchanged(self):
+        cfg = NginxConfigParser(self.folder + '/nginx.conf')
+        assert_that(self.parse(cfg), has_length(4))
+        assert_that(self.parse(cfg), has_length(0))
+        self.assert_same_as_fresh(cfg)
+
+    def test_one_file_changed(self):
+        cfg = NginxConfigParser(self.folder + '/nginx.conf')
+        self.parse(cfg)
+
+        self.write('sites/1.conf', 'server {\n    listen 9000;\n    server_name example.com;\n}\n')
+        scanned = self.parse(cfg)
+        assert_that(scanned, has_length(1))
+        assert_that(scanned[0], contains_string('example.com'))
+        assert_that(cfg.simplify()['http']['server'], has_item(has_entry('server_name', 'example.com')))
+        self.assert_same_as_fresh(cfg)
+
+    def test_glob_changed(self):
+        cfg = NginxConfigParser(self.folder + '/nginx.conf')
+        self.parse(cfg)
+
+        os.remove(self.folder + '/sites/0.conf')
+        self.write('sites/3.conf', 'server {\n    listen 8083;\n}\n')
+        assert_that(self.parse(cfg), has_length(1))
+        assert_that(cfg.rows_cache, has_length(4))
+        assert_that(cfg.rows_cache, not_(has_key(self.folder + '/sites/0.conf')))
+        self.assert_same_as_fresh(cfg)
+
+    def test_glob_cached(self):
+        cfg = NginxConfigParser(self.folder + '/nginx.conf')
+        pattern = self.folder + '/sites/*.conf'
+
+        # just changed directories are not cached, their mtime may stay the same after another change
+        cfg.parse()
+        assert_that(cfg.glob_cache, not_(has_key(pattern)))
+
+        os.utime(self.folder + '/sites', (0, 0))
+        cfg.parse()
+        assert_that(cfg.glob_cache, has_key(pattern))
+        assert_that(cfg.glob_cache[pattern][1], has_length(3))
+
+        # a new file changes mtime of the directory
+        self.write('sites/3.conf', 'server {\n    listen 8083;\n}\n')
+        cfg.parse()
+        assert_that(cfg.files, has_length(5))
+        self.assert_same_as_fresh(cfg)
+
+    def test_broken_file_fixed(self):
+        cfg = NginxConfigParser(self.folder + '/nginx.conf')
+        self.write('sites/2.conf', 'server {\n    listen 8082\n}\n')
+        self.parse(cfg)
+        assert_that(cfg.errors, has_length(1))
+
+        self.write('sites/2.conf', 'server {\n    listen 8082;\n}\n')
+        assert_that(self.parse(cfg), has_length(1))
+        assert_that(cfg.errors, has_length(0))
+        self.assert_same_as_fresh(cfg)
+
+
+class ParserEquivalenceTestCase(BaseTestCase):
+
+    def test_fixtures(self):
+        """
+        Every fixture parsed as a main config gives the same results as the pyparsing grammar
+        """
+        filenames = []
+        for directory, _, names in os.walk(fixtures):
+            filenames += [os.path.join(directory, name) for name in sorted(names)]
+
+        for filename in filenames:
+            cfg, reference = NginxConfigParser(filename), PyparsingNginxConfigParser(filename)
+            cfg.parse()
+            reference.parse()
+
+            for attribute in ('tree', 'index', 'files', 'errors', 'ssl_certificates'):
+                assert_that(
+                    getattr(cfg, attribute), equal_to(getattr(reference, attribute)),
+                    '%s of %s' % (attribute, filename)
+                )
+
+        assert_that(len(filenames), greater_than(90))
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+from pyparsing import (
+    Regex, Keyword, Literal, Word, alphanums, CharsNotIn, Forward, Group,
+    Optional, OneOrMore, ZeroOrMore, pythonStyleComment, lineno, LineStart, LineEnd,
+    oneOf, QuotedString, nestedExpr
+)
+
+from amplify.agent.objects.nginx.config.parser import NginxConfigParser
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = [
+    "Paul McGuire", "Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev",
+    "Grant Hulegaard"
+]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+tokens_cache = {}
+
+
+def set_line_number(string, location, tokens):
+    if len(tokens) == 1:
+        line_number = lineno(location, string)
+        tokens_cache[tokens[0]] = line_number
+        tokens.line_number = line_number
+    else:
+        for item in tokens:
+            tokens.line_number = tokens_cache.get(item)
+
+
+def flatten(l):
+    """Helper function that flattens a list of lists into a single list"""
+    flattened = []
+    for element in l:
+        if isinstance(element, list):
+            flattened += flatten(element)
+        else:
+            flattened.append(element)
+    return flattened
+
+
+def as_rows(parsed):
+    """
+    Converts pyparsing results to rows of NginxConfigScanner
+    """
+    rows = []
+    for row in parsed:
+        if isinstance(row.asList()[0], list):
+            key_bucket, value_bucket = row
+            header = key_bucket.asList()
+            if len(header) > 1 and not isinstance(header[1], basestring):
+                header = [header[0], ' '.join(flatten(header[1:]))]
+            rows.append((row.line_number, header, as_rows(value_bucket)))
+        else:
+            rows.append((row.line_number, list(row), None))
+    return rows
+
+
+class PyparsingNginxConfigParser(NginxConfigParser):
+    """
+    NginxConfigParser with the pyparsing grammar it used before NginxConfigScanner.
+    Kept only as a reference for equivalence tests and benchmarks.
+    """
+
+    # line starts/ends
+    line_start = LineStart().suppress()
+    line_end = LineEnd().suppress()
+
+    # constants
+    left_brace = Literal("{").suppress()
+    left_parentheses = Literal("(").suppress()
+    right_brace = Literal("}").suppress()
+    right_parentheses = Literal(")").suppress()
+    semicolon = Literal(";").suppress()
+    # space = White().suppress()
+    singleQuote = Literal("'").suppress()
+    doubleQuote = Literal('"').suppress()
+
+    # keywords
+    IF, SET, REWRITE, PERL_SET, LOG_FORMAT, ALIAS, RETURN, ERROR_PAGE, MAP, SERVER_NAME, SUB_FILTER, ADD_HEADER = (
+        map(
+            lambda x: x.setParseAction(set_line_number),
+            map(
+                Keyword,
+                "if set rewrite perl_set log_format alias return "
+                "error_page map server_name sub_filter add_header".split()
+            )
+        )
+    )
+
+    # lua keys
+    start_with_lua_key = Regex(r'lua_\S+').setParseAction(set_line_number)
+    contains_by_lua_key = Regex(r'\S+_by_lua\S*').setParseAction(set_line_number)
+
+    key = (
+        ~MAP & ~ALIAS & ~PERL_SET & ~IF & ~SET & ~REWRITE & ~SERVER_NAME & ~SUB_FILTER & ~ADD_HEADER
+    ) + Word(alphanums + '$_:%?"~<>\/-+.,*()[]"' + "'").setParseAction(set_line_number)
+
+    # For some reason this version from Paul McGuire does not trigger "set_line_number"...but the above does
+    # key = ~(MAP | ALIAS | PERL_SET | IF | SET | REWRITE | SERVER_NAME | SUB_FILTER) + \
+    #     Word(alphanums + '$_:%?"~<>\/-+.,*()[]"' + "'").setParseAction(set_line_number)
+
+    # values
+    value_string = QuotedString('"')  # Regex(r'"([^"]|\s)*\"')  # string value repurposed from map types
+    value_one = Regex(r'[^{};]*"[^\";]+"[^{};]*')
+    value_two = Regex(r'[^{};]*\'[^\';]+\'')
+    value_three = Regex(r'[^{};]+((\${[\d|\w]+(?=})})|[^{};])+')
+    value_four = Regex(r'[^{};]+(?!${.+})')
+    value = (value_string | value_one | value_two | value_three | value_four).setParseAction(set_line_number)
+    quotedValue = Regex(r'"[^;]+"|\'[^;]+\'').setParseAction(set_line_number)
+    rewrite_value = CharsNotIn(";").setParseAction(set_line_number)
+    any_value = CharsNotIn(";").setParseAction(set_line_number)
+    non_space_value = Regex(r'[^\'\";\s]+').setParseAction(set_line_number)
+    if_value = nestedExpr().setParseAction(set_line_number)  # Regex(r'\(.*\)')
+    language_include_value = CharsNotIn("'").setParseAction(set_line_number)
+    strict_value = CharsNotIn("{};").setParseAction(set_line_number)
+    sub_filter_value = (non_space_value | Regex(r"\'(.|\n)+?\'", )).setParseAction(set_line_number)
+    add_header_value = Regex(r'[^{};]*"[^"]+"').setParseAction(set_line_number)
+
+    # map values
+    map_value_one = QuotedString("'")  # Regex(r'\'([^\']|\s)*\'')
+    map_value_two = value_string
+    map_value_three = Regex(r'((\\\s|[^{};\s])*)')
+    map_value = (map_value_one | map_value_two | map_value_three).setParseAction(set_line_number)
+
+    # modifier for location uri [ = | ~ | ~* | ^~ ]
+    # ~ modifier = Literal("=") | Literal("~*") | Literal("~") | Literal("^~")
+    modifier = oneOf("= ~* ~ ^~")
+    assignment = (
+        key + Optional(value + Optional(value)) + semicolon
+        #
+        # could also write as
+        # key + value*(0,2) + semicolon
+    ).setParseAction(set_line_number)
+
+    # String helpers
+    string = (QuotedString("'") | QuotedString('"')).setParseAction(set_line_number)
+    multi_line_string = (
+        QuotedString("'", multiline=True) |
+        QuotedString('"', multiline=True)
+    ).setParseAction(set_line_number)
+    multi_line_string_unquoted = (
+        QuotedString("'", multiline=True, unquoteResults=False) |
+        QuotedString('"', multiline=True, unquoteResults=False)
+    ).setParseAction(set_line_number)
+
+    set = (
+        SET + any_value + semicolon
+    ).setParseAction(set_line_number)
+
+    rewrite = (
+        REWRITE + rewrite_value + semicolon
+    ).setParseAction(set_line_number)
+
+    perl_set = (
+        PERL_SET + key +
+        multi_line_string +
+        semicolon
+        # ~ singleQuote + language_include_value + singleQuote + semicolon
+    ).setParseAction(set_line_number)
+
+    lua_content = (
+        (start_with_lua_key | contains_by_lua_key) +
+        multi_line_string +
+        semicolon
+        # ~ singleQuote + language_include_value + singleQuote + semicolon
+    ).setParseAction(set_line_number)
+
+    alias = (
+        ALIAS + any_value + semicolon
+    ).setParseAction(set_line_number)
+
+    return_ = (
+        (RETURN | ERROR_PAGE) + value + Optional(any_value) + semicolon
+    ).setParseAction(set_line_number)
+
+    log_format = (
+        LOG_FORMAT + strict_value + any_value + semicolon
+    ).setParseAction(set_line_number)
+
+    server_name = (
+        SERVER_NAME + any_value + semicolon
+    ).setParseAction(set_line_number)
+
+    sub_filter = (
+        SUB_FILTER + sub_filter_value + sub_filter_value + semicolon
+    ).setParseAction(set_line_number)
+
+    add_header = (
+        ADD_HEADER + (non_space_value | string) +
+        Optional(multi_line_string_unquoted | add_header_value | non_space_value) +
+        Optional(non_space_value) +
+        semicolon
+    ).setParseAction(set_line_number)
+
+    # script
+    map_block = Forward()
+    map_block << Group(
+        Group(
+            MAP + map_value + map_value
+        ).setParseAction(set_line_number) +
+        left_brace +
+        Group(
+            ZeroOrMore(
+                Group(map_value + Optional(map_value) + semicolon)
+            ).setParseAction(set_line_number)
+        ) +
+        right_brace
+    )
+
+    block = Forward()
+    block << Group(
+        (
+            Group(
+                key + Optional(modifier) +
+                Optional(value + Optional(value))
+            ) |
+            Group(IF + if_value)
+        ).setParseAction(set_line_number) +
+        left_brace -  # <----- use '-' operator instead of '+' to get better error messages
+        Group(
+            ZeroOrMore(
+                Group(add_header) | Group(log_format) | Group(lua_content) | Group(perl_set) |
+                Group(set) | Group(rewrite) | Group(alias) | Group(return_) |
+                Group(assignment) | Group(server_name) | Group(sub_filter) |
+                map_block | block
+            ).setParseAction(set_line_number)
+        ).setParseAction(set_line_number) +
+        right_brace
+    )
+
+    script = OneOrMore(
+        Group(add_header) |
+        Group(log_format) | Group(perl_set) | Group(lua_content) | Group(alias) | Group(return_) |
+        Group(assignment) | Group(set) | Group(rewrite) | Group(sub_filter) |
+        map_block | block
+    ).ignore(pythonStyleComment)
+
+    def __init__(self, *args, **kwargs):
+        global tokens_cache
+        tokens_cache = {}
+        super(PyparsingNginxConfigParser, self).__init__(*args, **kwargs)
+
+    def parse_source(self, source):
+        return as_rows(self.script.parseString(source, parseAll=True))
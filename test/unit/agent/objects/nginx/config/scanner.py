@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from hamcrest import *
+
+from amplify.agent.objects.nginx.config.scanner import NginxConfigScanner, ParseException, ParseSyntaxException
+from test.base import BaseTestCase
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class ScannerTestCase(BaseTestCase):
+
+    def parse(self, source):
+        return NginxConfigScanner(source).parse()
+
+    def test_rows(self):
+        rows = self.parse(
+            'user nginx;\n'
+            '# comment { ;\n'
+            'events {\n'
+            '    worker_connections 1024;  # comment\n'
+            '}\n'
+            'http {\n'
+            '    server {\n'
+            '        location ~* \\.(gif|jpg)$ {\n'
+            '            ip_hash;\n'
+            '        }\n'
+            '    }\n'
+            '}\n'
+        )
+        assert_that(rows, equal_to([
+            (1, ['user', 'nginx'], None),
+            (3, ['events'], [(4, ['worker_connections', '1024'], None)]),
+            (6, ['http'], [
+                (7, ['server'], [
+                    (8, ['location', '~*', '\\.(gif|jpg)$ '], [(9, ['ip_hash'], None)])
+                ])
+            ]),
+        ]))
+
+    def test_values_keep_spacing(self):
+        rows = self.parse('proxy_set_header  Host   $host;\nset $a\n    "b";\n')
+        assert_that(rows, equal_to([
+            (1, ['proxy_set_header', 'Host   $host'], None),
+            (2, ['set', ' $a\n    "b"'], None),  # attributed to the line where the value starts
+        ]))
+
+    def test_map_and_if(self):
+        rows = self.parse(
+            'map $http_host $name {\n'
+            '    hostnames;\n'
+            '    "~^www\\.(?<x>.+)$"  $x;\n'
+            '}\n'
+            'if ($request_method = "POST" (nested)) {\n'
+            '    return 405;\n'
+            '}\n'
+        )
+        assert_that(rows, equal_to([
+            (1, ['map', '$http_host', '$name'], [
+                (2, ['hostnames', ''], None),
+                (3, ['~^www\\.(?<x>.+)$', '$x'], None),
+            ]),
+            (5, ['if', '$request_method = "POST" nested'], [(6, ['return', '405'], None)]),
+        ]))
+
+    def test_lua(self):
+        rows = self.parse("content_by_lua '\n    ngx.say(\"hi\");\n';\nlua_shared_dict cache 10m;\n")
+        assert_that(rows, equal_to([
+            (1, ['content_by_lua', '\n    ngx.say("hi");\n'], None),
+            (4, ['lua_shared_dict', 'cache 10m'], None),
+        ]))
+
+    def test_errors(self):
+        # missing semicolon - nothing else matches
+        assert_that(calling(self.parse).with_args('worker_processes 4'), raises(ParseException))
+        assert_that(calling(self.parse).with_args('# only a comment'), raises(ParseException))
+
+        # a block is not closed - fails right away
+        assert_that(calling(self.parse).with_args('events {\n    worker_connections 768;\n'), raises(ParseSyntaxException))
+        assert_that(
+            calling(self.parse).with_args('http { server { listen 80; }'), raises(ParseSyntaxException)
+        )
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+import pytest
+from hamcrest import *
+
+from amplify.agent.common.util import inotify
+from amplify.agent.objects.nginx.config.watcher import NginxConfigWatcher
+from test.base import BaseTestCase
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class PollingWatcherTestCase(BaseTestCase):
+
+    def setup_method(self, method):
+        super(PollingWatcherTestCase, self).setup_method(method)
+        self.folder = tempfile.mkdtemp()
+        os.mkdir(self.folder + '/sites')
+        self.write('nginx.conf', 'http {\n    include sites/*.conf;\n}\n')
+        self.write('sites/0.conf', 'server {\n    listen 80;\n}\n')
+        self.watcher = self.make_watcher()
+
+    def teardown_method(self, method):
+        self.watcher.stop()
+        shutil.rmtree(self.folder)
+        super(PollingWatcherTestCase, self).teardown_method(method)
+
+    def make_watcher(self):
+        watcher = NginxConfigWatcher()
+        watcher.stop()  # no inotify
+        return watcher
+
+    def write(self, name, source, mode='w'):
+        with open('%s/%s' % (self.folder, name), mode) as f:
+            f.write(source)
+
+    def watch(self):
+        self.watcher.watch([
+            self.folder + '/nginx.conf',
+            self.folder + '/sites/0.conf',
+            self.folder + '/',
+            self.folder + '/sites/',
+        ])
+
+    def test_unchanged(self):
+        assert_that(self.watcher.changed(), equal_to(True))  # nothing is known at start
+        self.watch()
+        assert_that(self.watcher.changed(), equal_to(True))  # paths are new
+        assert_that(self.watcher.changed(), equal_to(False))
+
+        self.watch()
+        assert_that(self.watcher.changed(), equal_to(False))
+
+    def test_file_changed(self):
+        self.watch()
+        self.watcher.changed()
+
+        self.write('sites/0.conf', '# listen 8080;\n', mode='a')
+        assert_that(self.watcher.changed(), equal_to(True))
+        assert_that(self.watcher.changed(), equal_to(False))
+
+    def test_file_added(self):
+        self.watch()
+        self.watcher.changed()
+
+        os.utime(self.folder + '/sites', (0, 0))
+        self.watcher.changed()  # the change of mtime above
+
+        self.write('sites/1.conf', 'server {\n    listen 81;\n}\n')
+        assert_that(self.watcher.changed(), equal_to(True))
+
+    def test_permissions_changed(self):
+        self.watch()
+        self.watcher.changed()
+
+        os.chmod(self.folder + '/nginx.conf', 0600)
+        assert_that(self.watcher.changed(), equal_to(True))
+
+
+@pytest.mark.skipif(not inotify.available(), reason='inotify is available only on Linux')
+class InotifyWatcherTestCase(PollingWatcherTestCase):
+
+    def make_watcher(self):
+        watcher = NginxConfigWatcher()
+        assert_that(watcher._shared, same_instance(inotify.shared_watches()))
+        return watcher
+
+    def test_symlink_target_changed(self):
+        os.mkdir(self.folder + '/available')
+        self.write('available/1.conf', 'server {\n    listen 81;\n}\n')
+        os.symlink(self.folder + '/available/1.conf', self.folder + '/sites/1.conf')
+
+        self.watch()
+        self.watcher.watch(self.watcher.paths | {self.folder + '/sites/1.conf'})
+        self.watcher.changed()
+
+        self.write('available/1.conf', '# listen 8081;\n', mode='a')
+        assert_that(self.watcher.changed(), equal_to(True))
+
+    def test_directory_created(self):
+        self.watch()
+        self.watcher.watch(self.watcher.paths | {self.folder + '/conf.d/'})  # doesn't exist yet
+        self.watcher.changed()
+
+        os.mkdir(self.folder + '/conf.d')
+        assert_that(self.watcher.changed(), equal_to(True))
+
+    def test_unwatched(self):
+        os.mkdir(self.folder + '/other')
+        self.watch()
+        self.watcher.changed()
+
+        self.write('other/1.conf', 'server {\n    listen 81;\n}\n')
+        assert_that(self.watcher.changed(), equal_to(False))
+
+    def test_shared_instance(self):
+        other = NginxConfigWatcher()
+        try:
+            other.watch([self.folder + '/nginx.conf'])
+            self.watch()
+            other.changed()
+            self.watcher.changed()
+
+            # the directory is still watched for the other watcher
+            other.stop()
+            self.write('nginx.conf', '# worker_processes 1;\n', mode='a')
+            assert_that(self.watcher.changed(), equal_to(True))
+        finally:
+            other.stop()
+
+    def test_directory_recreated(self):
+        self.watch()
+        self.watcher.changed()
+
+        shutil.rmtree(self.folder + '/sites')
+        assert_that(self.watcher.changed(), equal_to(True))
+
+        # the collector sets paths again after the structure is collected
+        os.mkdir(self.folder + '/sites')
+        self.watch()
+        self.watcher.changed()
+
+        self.write('sites/0.conf', 'server {\n    listen 80;\n}\n')
+        assert_that(self.watcher.changed(), equal_to(True))
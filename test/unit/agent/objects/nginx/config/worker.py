@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+
+from hamcrest import *
+
+from amplify.agent.common.errors import AmplifyWorkerError
+from amplify.agent.objects.nginx.config.config import NginxConfig
+from amplify.agent.objects.nginx.config.watcher import NginxConfigWatcher
+from amplify.agent.objects.nginx.config.worker import NginxConfigWorker, PARSED_ATTRIBUTES
+from test.base import BaseTestCase
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+simple_config = os.getcwd() + '/test/fixtures/nginx/simple/nginx.conf'
+ssl_simple_config = os.getcwd() + '/test/fixtures/nginx/ssl/simple/nginx.conf'
+
+
+class ConfigWorkerTestCase(BaseTestCase):
+
+    def setup_method(self, method):
+        super(ConfigWorkerTestCase, self).setup_method(method)
+        self.worker = None
+
+    def teardown_method(self, method):
+        if self.worker:
+            self.worker.stop()
+        super(ConfigWorkerTestCase, self).teardown_method(method)
+
+    def test_same_as_inline(self):
+        for filename in (simple_config, ssl_simple_config):
+            config, inline = NginxConfig(filename), NginxConfig(filename)
+            self.worker = NginxConfigWorker(config)
+            checksum = self.worker.parse(ssl_analysis=True)
+
+            inline.full_parse()
+            inline.run_ssl_analysis()
+            for attribute in PARSED_ATTRIBUTES:
+                assert_that(getattr(config, attribute), equal_to(getattr(inline, attribute)), attribute)
+            assert_that(checksum, equal_to(inline.checksum()))
+
+            self.worker.stop()
+
+    def test_reused(self):
+        config = NginxConfig(simple_config)
+        self.worker = NginxConfigWorker(config)
+        first = self.worker.parse()
+        pid = self.worker.process.pid
+
+        assert_that(self.worker.parse(), equal_to(first))
+        assert_that(self.worker.process.pid, equal_to(pid))
+
+        # digests of the first parse are cached in the worker, the counters are passed back
+        assert_that(config.digests.misses, equal_to(len(config.files)))
+        assert_that(config.digests.hits, equal_to(len(config.files)))
+        assert_that(config.digests.digests, equal_to({}))
+
+    def test_timeout(self):
+        config = NginxConfig(simple_config)
+        self.worker = NginxConfigWorker(config, timeout=0.01)
+        assert_that(calling(self.worker.parse), raises(AmplifyWorkerError, 'timed out'))
+        assert_that(self.worker.process, none())
+        assert_that(config.tree, equal_to({}))  # the config is not changed
+
+    def test_memory_limit(self):
+        with tempfile.NamedTemporaryFile(suffix='.conf') as f:
+            f.write('worker_processes 1;\n' * 200000)  # reading it needs more than 1 MB
+            f.flush()
+
+            config = NginxConfig(f.name)
+            self.worker = NginxConfigWorker(config, memory_limit=1)
+            assert_that(calling(self.worker.parse), raises(AmplifyWorkerError, 'MemoryError'))
+            assert_that(self.worker.process, none())
+
+            # next request starts a new worker
+            self.worker.memory_limit = 1024
+            self.worker.parse()
+            assert_that(config.tree, has_entry('worker_processes', has_length(200000)))
+
+    def test_failed_to_start(self):
+        config = NginxConfig(simple_config)
+        self.worker = NginxConfigWorker(config)
+
+        self.worker.command = [sys.executable, '-c', 'pass']  # exits without setup
+        assert_that(calling(self.worker.parse), raises(AmplifyWorkerError, 'failed to start'))
+        assert_that(self.worker.process, none())
+
+        self.worker.command = ['/nonexistent/python']
+        assert_that(calling(self.worker.parse), raises(AmplifyWorkerError, 'failed to start'))
+
+    def test_config_stop(self):
+        config = NginxConfig(simple_config)
+        config.worker = self.worker = NginxConfigWorker(config)
+        config.watcher = NginxConfigWatcher()
+        self.worker.parse()
+        process = self.worker.process
+
+        config.stop()
+        assert_that(process.poll(), not_none())
+        assert_that(config.worker, none())
+        assert_that(config.watcher, none())
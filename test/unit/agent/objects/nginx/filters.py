@@ -3,7 +3,7 @@ import re
 
 from hamcrest import *
 
-from amplify.agent.objects.nginx.filters import Filter
+from amplify.agent.objects.nginx.filters import Filter, FilterIndex
 from test.base import BaseTestCase
 
 __author__ = "Mike Belov"
@@ -49,3 +49,59 @@ class FiltersTestCase(BaseTestCase):
             data=[]
         )
         assert_that(filtr.empty, equal_to(True))
+
+
+class FilterIndexTestCase(BaseTestCase):
+    lines = [
+        {'request_method': 'GET', 'request_uri': '/img/docker.png', 'status': '200', 'server_protocol': 'HTTP/1.1'},
+        {'request_method': 'POST', 'request_uri': '/api/v1/objects/', 'status': '201', 'upstream_status': ['200']},
+        {'request_method': 'GET', 'request_uri': '/img', 'status': '404', 'request_time': [0.1]},
+        {'request_method': 'DELETE', 'request_uri': '/[abc', 'status': '500', 'server_name': 'example.com'},
+        {'request_method': 'PUT', 'request_uri': '/', 'status': '200'},
+    ]
+
+    filters = [
+        Filter(filter_rule_id=1, metric='nginx.http.status.2xx', data=[{'$request_method': 'get'}]),
+        Filter(filter_rule_id=2, metric='nginx.http.status.2xx', data=[{'$request_uri': '/img'}, {'$status': '2'}]),
+        Filter(filter_rule_id=3, metric='nginx.http.status.2xx', data=[{'$request_uri': '/img.*png$'}]),
+        Filter(filter_rule_id=4, metric='nginx.http.status.2xx', data=[{'$request_uri': '/(api|img)/'}]),
+        Filter(filter_rule_id=5, metric='nginx.http.status.2xx', data=[{'$request_uri': '/[abc'}]),  # not a regex
+        Filter(filter_rule_id=6, metric='nginx.http.status.2xx', data=[{'$request_uri': u'/[abc'}]),
+        Filter(filter_rule_id=7, metric='nginx.http.status.2xx', data=[{'$status': '(?i)5..'}]),
+        Filter(filter_rule_id=8, metric='nginx.http.status.2xx', data=[{'$upstream_status': r"\['200'\]"}]),
+        Filter(filter_rule_id=9, metric='nginx.http.status.2xx', data=[{'$request_time': '0.1'}]),
+        Filter(filter_rule_id=10, metric='nginx.http.status.2xx', data=[{'$server_name': 'example.com'}]),
+        Filter(filter_rule_id=11, metric='nginx.http.status.2xx', data=[{'$status': '.*'}, {'$request_uri': '/'}]),
+        Filter(filter_rule_id=12, metric='nginx.http.status.2xx', data=[{'logname': 'access.log'}]),
+    ]
+
+    def test_same_as_filter_match(self):
+        index = FilterIndex(self.filters)
+        for parsed in self.lines:
+            expected = [log_filter for log_filter in self.filters if log_filter.match(parsed)]
+            assert_that(index.matching(parsed), equal_to(expected))
+            assert_that(index.match(parsed), equal_to(set(f.filter_rule_id for f in expected)))
+
+    def test_match(self):
+        index = FilterIndex(self.filters)
+        assert_that(index.match(self.lines[0]), equal_to({1, 2, 3, 4, 11, 12}))
+        assert_that(index.match(self.lines[3]), equal_to({5, 7, 10, 11, 12}))
+
+    def test_structure(self):
+        index = FilterIndex(self.filters)
+        request_uri = index.fields['request_uri']
+        assert_that(request_uri.exact, equal_to({'/[abc': [4]}))
+        assert_that(request_uri.prefixes, equal_to({1: {'/': [10]}, 4: {'/img': [1]}}))
+        assert_that(request_uri.combined, has_length(1))
+        assert_that(request_uri.combined[0][1], equal_to([(1, 2), (2, 3)]))
+        assert_that(index.fields['status'].regexes, has_length(1))
+
+    def test_many_regexes(self):
+        filters = [
+            Filter(filter_rule_id=i, metric='nginx.http.status.2xx', data=[{'$request_uri': '/(a|b)/%s$' % i}])
+            for i in xrange(200)
+        ]
+        index = FilterIndex(filters)
+        assert_that(index.fields['request_uri'].combined, has_length(5))
+        assert_that(index.match({'request_uri': '/b/150'}), equal_to({150}))
+        assert_that(index.match({'request_uri': '/c/150'}), equal_to(set()))
@@ -336,3 +336,102 @@ class LogParserTestCase(BaseTestCase):
 
         assert_that(parsed['upstream_addr'], equal_to(['173.194.32.133:80', '173.194.32.133:81', '173.194.32.133:82']))
         assert_that(parsed['upstream_status'], equal_to(['200', '200', '200']))
+
+    def test_compiled_plan(self):
+        """
+        Check that the format is compiled once into a plan of steps with one step per unique variable
+        """
+        user_format = '$remote_addr "$request" $status rt=$request_time us="$upstream_status" $status'
+        parser = NginxAccessLogParser(user_format)
+
+        assert_that(parser.plan, has_length(5))
+        assert_that([key for _, key, _, _ in parser.plan], equal_to(
+            ['remote_addr', 'request', 'status', 'request_time', 'upstream_status']
+        ))
+
+        line = '127.0.0.1 "GET / HTTP/1.1" 200 rt=0.010 us="502, 200" 200'
+        parsed = parser.parse(line)
+
+        assert_that(parsed['status'], equal_to('200'))
+        assert_that(parsed['request_time'], equal_to([0.01]))
+        assert_that(parsed['upstream_status'], equal_to(['502', '200']))
+
+    def test_fields(self):
+        """
+        Check that only requested fields are parsed
+        """
+        user_format = '$remote_addr "$request" $status $body_bytes_sent "$http_user_agent" ' + \
+                      'ua="$upstream_addr" ut="$upstream_response_time"'
+        line = '127.0.0.1 "GET /basic_status HTTP/1.1" 200 110 "curl/7.35.0" ua="127.0.0.1:8080" ut="0.010"'
+
+        parser = NginxAccessLogParser(user_format, fields=['status', 'server_protocol', 'upstream*'])
+        assert_that(parser.keys, has_length(7))
+        assert_that(parser.groups, equal_to(['request', 'status', 'upstream_addr', 'upstream_response_time']))
+
+        parsed = parser.parse(line)
+        for key in ('remote_addr', 'body_bytes_sent', 'http_user_agent'):
+            assert_that(parsed, is_not(has_key(key)))
+
+        assert_that(parsed['status'], equal_to('200'))
+        assert_that(parsed['server_protocol'], equal_to('HTTP/1.1'))
+        assert_that(parsed['upstream_addr'], equal_to(['127.0.0.1:8080']))
+        assert_that(parsed['upstream_response_time'], equal_to([0.01]))
+
+    def test_tokenizer(self):
+        """
+        Check that well-known formats are parsed by tokenizer with the same results as regex
+        """
+        user_format = NginxAccessLogParser.combined_format + ' "$http_x_forwarded_for" rt=$request_time ' + \
+            'ua="$upstream_addr" us="$upstream_status" ut="$upstream_response_time" cs=$upstream_cache_status'
+        line = \
+            '85.25.210.234 - - [22/Jan/2010:19:34:21 +0300] "GET /foo/ HTTP/1.1" 200 11078 ' + \
+            '"http://www.rambler.ru/" "Mozilla/5.0 (Windows; U; Windows NT 5.1" "-" rt=0.024 ' + \
+            'ua="10.0.0.1:80, 10.0.0.2:80" us="502, 200" ut="2.001, 0.345" cs=MISS'
+
+        parser = NginxAccessLogParser(user_format)
+        assert_that(parser.tokenizer, not_none())
+        assert_that(parser.tokenizer.keys, equal_to(parser.keys))
+
+        regex_parser = NginxAccessLogParser(user_format)
+        regex_parser.tokenizer = None
+
+        parsed = parser.parse(line)
+        assert_that(parser.tokenizer_misses, equal_to(0))
+        assert_that(parsed, equal_to(regex_parser.parse(line)))
+        assert_that(parsed['upstream_status'], equal_to(['502', '200']))
+        assert_that(parsed['upstream_response_time'], equal_to([2.001, 0.345]))
+        assert_that(parsed['request_method'], equal_to('GET'))
+
+    def test_tokenizer_fallback(self):
+        """
+        Check that lines which don't fit tokenizer are parsed by regex
+        """
+        parser = NginxAccessLogParser()
+        assert_that(parser.tokenizer, not_none())
+
+        # remote_user with a space and a bracket
+        line = '127.0.0.1 - john [doe] [02/Jul/2015:14:49:48 +0000] "GET /basic_status HTTP/1.1" 200 110 "-" "curl"'
+        regex_parser = NginxAccessLogParser()
+        regex_parser.tokenizer = None
+
+        parsed = parser.parse(line)
+        assert_that(parser.tokenizer_misses, equal_to(0))
+        assert_that(parsed, equal_to(regex_parser.parse(line)))
+        assert_that(parsed['remote_user'], equal_to('john [doe]'))
+
+        # not a number in $status
+        line = '127.0.0.1 - - [02/Jul/2015:14:49:48 +0000] "GET /basic_status HTTP/1.1" 2x0 110 "-" "curl"'
+        parsed = parser.parse(line)
+        assert_that(parser.tokenizer_misses, equal_to(1))
+        assert_that(parsed, is_not(has_key('status')))
+
+    def test_no_tokenizer(self):
+        """
+        Check that formats with other shapes use regex
+        """
+        for user_format in (
+            '$remote_addr - $remote_user [$time_local] "$request" $status',
+            NginxAccessLogParser.combined_format + ' $request_time',
+            NginxAccessLogParser.combined_format + '  "$http_x_forwarded_for"',
+        ):
+            assert_that(NginxAccessLogParser(user_format).tokenizer, none())
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
+import os
+import socket
+import stat
 import time
 import logging
 from logging.handlers import SysLogHandler
 
 from hamcrest import *
 
+from amplify.agent.common.context import context
+from amplify.agent.data.statsd import StatsdClient
 from amplify.agent.pipelines.syslog import SyslogTail, SYSLOG_ADDRESSES, AmplifyAddresssAlreadyInUse
 from test.base import BaseTestCase, disabled_test
+from test.helpers import DummyObject
 
 
 __author__ = "Grant Hulegaard"
@@ -28,12 +34,14 @@ class SyslogTailTestCase(BaseTestCase):
         # Set up python logger
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
+        self.logger.disabled = False  # logging config of every context setup disables loggers it doesn't know
         self.handler = SysLogHandler(address=('localhost', 514))
         self.handler.setFormatter(logging.Formatter(' amplify: %(message)s'))
         self.logger.addHandler(self.handler)
 
     def teardown_method(self, method):
         # Revert logger stuff
+        self.logger.removeHandler(self.handler)
         self.handler.close()
         self.handler = None
         self.logger = None
@@ -67,6 +75,90 @@ class SyslogTailTestCase(BaseTestCase):
         # Check that cache was cleared after iteration
         assert_that(self.tail.cache, has_length(0))
 
+    def test_batch_receive(self):
+        time.sleep(0.1)
+        for i in xrange(2000):
+            self.logger.debug('This is message #%s' % i)
+        time.sleep(0.2)
+
+        # all of them are received during a few wakeups, not 10 per 0.1s
+        assert_that(self.tail.listener.server.received, equal_to(2000))
+        assert_that([line for line in self.tail], has_length(2000))
+
+        statsd = StatsdClient(object=DummyObject())
+        self.tail.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.syslog.received'][0][1], equal_to(2000))
+        assert_that(statsd.current['counter'], is_not(has_key('amplify.agent.syslog.dropped')))
+
+        # only new ones are reported next time
+        self.logger.debug('One more message')
+        time.sleep(0.1)
+        statsd = StatsdClient(object=DummyObject())
+        self.tail.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.syslog.received'][0][1], equal_to(1))
+
+    def test_dropped(self):
+        self.tail.stop()
+        self.tail = SyslogTail(address=('localhost', 514), maxlen=10, interval=0.1)
+        time.sleep(0.1)
+        for i in xrange(15):
+            self.logger.debug('This is message #%s' % i)
+        time.sleep(0.1)
+
+        assert_that(self.tail.queue.dropped, equal_to(5))
+        assert_that(self.tail.listener.server.kernel_drops(), equal_to(0))
+
+        statsd = StatsdClient(object=DummyObject())
+        self.tail.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.syslog.dropped'][0][1], equal_to(5))
+        assert_that([line for line in self.tail], equal_to(['This is message #%s\x00' % i for i in xrange(5, 15)]))
+
+    def test_swap_cache(self):
+        self.tail.cache.extend(['first', 'second'])
+        cache = self.tail.cache
+
+        lines = iter(self.tail)
+        assert_that(self.tail.cache, is_not(same_instance(cache)))
+        assert_that(self.tail.listener.server.queues['amplify'].cache, same_instance(self.tail.cache))
+
+        # lines which come while the previous ones are processed are kept for the next iteration
+        assert_that(next(lines), equal_to('first'))
+        self.tail.listener.server.handle_message(' amplify: third')
+        assert_that(list(lines), equal_to(['second']))
+        assert_that(list(self.tail), equal_to(['third']))
+
+    def test_tags(self):
+        nginx = SyslogTail(address=('localhost', 514), tag='nginx', interval=0.1)
+        try:
+            # one listener for all tags of the address
+            assert_that(nginx.listener, same_instance(self.tail.listener))
+            duplicate = SyslogTail(address=('localhost', 514), tag='nginx')
+            assert_that(duplicate.listener, none())
+            assert_that(duplicate.listener_setup_attempts, equal_to(1))
+            duplicate.stop()
+
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for tag, message in (('nginx', 'first'), ('amplify', 'second'), ('other', 'third'), ('nginx', 'fourth')):
+                client.sendto('<190>Jul  3 11:12:53 host %s: %s' % (tag, message), ('localhost', 514))
+            client.close()
+            time.sleep(0.1)
+
+            assert_that(list(nginx), equal_to(['first', 'fourth']))
+            assert_that(list(self.tail), equal_to(['second']))
+
+            statsd = StatsdClient(object=DummyObject())
+            nginx.report(statsd)
+            self.tail.report(statsd)
+            counters = statsd.current['counter']
+            assert_that(counters['amplify.agent.syslog.received'][0][1], equal_to(3))
+            assert_that(counters['amplify.agent.syslog.unmatched'][0][1], equal_to(1))
+        finally:
+            nginx.stop()
+
+        # the listener keeps running for the other tail
+        assert_that(self.tail.listener.running, equal_to(True))
+        assert_that(('localhost', 514), is_in(SYSLOG_ADDRESSES))
+
     # TODO: test_overall doesn't work if there are other tests run with it...why?
     # The tests below pass, but will cause test_overall to fail if run...so skipped for now.
     @disabled_test
@@ -79,3 +171,83 @@ class SyslogTailTestCase(BaseTestCase):
             calling(SyslogTail).with_args(address=('localhost', 514)),
             raises(AmplifyAddresssAlreadyInUse)
         )
+
+
+class UnixSyslogTailTestCase(BaseTestCase):
+    path = 'log/syslog.sock'
+
+    def setup_method(self, method):
+        super(UnixSyslogTailTestCase, self).setup_method(method)
+        self.tail = None
+        self.client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def teardown_method(self, method):
+        self.client.close()
+        if self.tail:
+            self.tail.stop()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_receive(self):
+        self.tail = SyslogTail(address=self.path, interval=0.1)
+        assert_that(stat.S_IMODE(os.stat(self.path).st_mode), equal_to(0o660))
+
+        # messages longer than UDP chunks are fine
+        long_message = 'x' * 20000
+        for message in ('first', 'second', long_message):
+            self.client.sendto('<190>Jul  3 11:12:53 host amplify: %s' % message, self.path)
+        time.sleep(0.1)
+
+        assert_that(list(self.tail), equal_to(['first', 'second', long_message]))
+        assert_that(self.tail.listener.server.received, equal_to(3))
+
+        # the socket file is removed
+        self.tail.stop()
+        self.tail = None
+        assert_that(os.path.exists(self.path), equal_to(False))
+
+    def test_stale_socket_and_mode(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(self.path)
+        stale.close()
+
+        keys = context.app_config['listeners']['keys']
+        context.app_config['listeners']['keys'] = 'unix'
+        context.app_config.config['listener_unix'] = {'address': 'unix:%s' % self.path, 'mode': '0600'}
+        try:
+            self.tail = SyslogTail(address=self.path, interval=0.1)
+        finally:
+            context.app_config['listeners']['keys'] = keys
+            del context.app_config.config['listener_unix']
+
+        assert_that(stat.S_IMODE(os.stat(self.path).st_mode), equal_to(0o600))
+        self.client.sendto('<190>Jul  3 11:12:53 host amplify: message', self.path)
+        time.sleep(0.1)
+        assert_that(list(self.tail), equal_to(['message']))
+
+    def test_socket_in_use(self):
+        other = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        other.bind(self.path)
+        try:
+            assert_that(calling(SyslogTail).with_args(address=self.path), raises(socket.error, 'another process'))
+            assert_that(os.path.exists(self.path), equal_to(True))
+        finally:
+            other.close()
+
+    def test_non_ascii_and_invalid_messages(self):
+        self.tail = SyslogTail(address=self.path, interval=0.1)
+        for message in (
+            '<190>Jul  3 11:12:53 host amplify: caf\xc3\xa9 \xff',
+            'garbage',
+            '<190>Jul  3 11:12:53 host amplify: after',
+        ):
+            self.client.sendto(message, self.path)
+        time.sleep(0.1)
+
+        # the listener keeps running and receiving
+        assert_that(list(self.tail), equal_to(['caf\xc3\xa9 \xff', 'after']))
+        assert_that(self.tail.listener.thread.dead, equal_to(False))
+
+        statsd = StatsdClient(object=DummyObject())
+        self.tail.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.syslog.invalid'][0][1], equal_to(1))
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
+import time
 
+import gevent
+import pytest
 from hamcrest import *
 
-from amplify.agent.pipelines.file import FileTail
+from amplify.agent.common.context import context
+from amplify.agent.common.util import inotify
+from amplify.agent.data.statsd import StatsdClient
+from amplify.agent.pipelines import file as file_pipeline
+from amplify.agent.pipelines.file import FileTail, InotifyFileTail, OffsetStore, SharedFileReader, shared_tail
 from test.base import BaseTestCase
+from test.helpers import DummyObject
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -14,13 +22,13 @@ __maintainer__ = "Mike Belov"
 __email__ = "dedm@nginx.com"
 
 
-class TailTestCase(BaseTestCase):
+class LogFileTestCase(BaseTestCase):
     test_log = 'log/something.log'
     test_log_rotated = 'log/something.log.rotated'
 
     def setup_method(self, method):
         # write something to create file
-        super(TailTestCase, self).setup_method(method)
+        super(LogFileTestCase, self).setup_method(method)
         self.write_log('start')
 
     def write_log(self, line):
@@ -37,7 +45,10 @@ class TailTestCase(BaseTestCase):
             if os.path.exists(filename):
                 os.remove(filename)
 
-        super(TailTestCase, self).teardown_method(method)
+        super(LogFileTestCase, self).teardown_method(method)
+
+
+class TailTestCase(LogFileTestCase):
 
     def test_read_new_lines(self):
         tail = FileTail(filename=self.test_log)
@@ -64,7 +75,7 @@ class TailTestCase(BaseTestCase):
         assert_that(new_lines, has_length(1))
         assert_that(new_lines, equal_to(['from a new file']))
 
-    def test_lose_changes_while_rotate(self):
+    def test_read_old_file_after_rotation(self):
         tail = FileTail(filename=self.test_log)
 
         # write something
@@ -73,13 +84,55 @@ class TailTestCase(BaseTestCase):
         # rotate it
         os.rename(self.test_log, self.test_log_rotated)
 
+        # nginx keeps writing to the old file until it reopens logs
+        os.system('echo "after rotation" >> %s' % self.test_log_rotated)
+
         # write something in a new one
         self.write_log("from a new file")
 
-        # read tail and get two lines
+        # read tail and get all lines
         new_lines = tail.readlines()
-        assert_that(new_lines, has_length(1))
-        assert_that(new_lines, equal_to(['from a new file']))
+        assert_that(new_lines, equal_to(['from the old file', 'after rotation', 'from a new file']))
+        assert_that(tail.recovered_bytes, equal_to(len('from the old file\nafter rotation\n')))
+
+    def test_rotation_while_reading_old_file(self):
+        tail = FileTail(filename=self.test_log, chunk_size=16)
+        lines = ['this is %s line' % i for i in xrange(5)]
+        with open(self.test_log, 'a') as f:
+            f.write('\n'.join(lines) + '\nincomplete')
+        assert_that(tail.read_batch(2), equal_to(lines[:2]))
+
+        os.rename(self.test_log, self.test_log_rotated)
+        self.write_log('from a new file')
+
+        # rest of the old file goes first, its incomplete line is returned as it is
+        assert_that(tail.readlines(), equal_to(lines[2:] + ['incomplete', 'from a new file']))
+        assert_that(tail.readlines(), has_length(0))
+
+    def test_copytruncate(self):
+        tail = FileTail(filename=self.test_log)
+        self.write_log('a long line before truncation')
+        tail.readlines()
+
+        # truncate in place and write less than was read before
+        with open(self.test_log, 'w') as f:
+            f.write('short\n')
+        self.write_log('line')
+
+        assert_that(tail.readlines(), equal_to(['short', 'line']))
+        assert_that(tail.recovered_bytes, equal_to(len('short\nline\n')))
+
+    def test_report(self):
+        tail = FileTail(filename=self.test_log)
+        statsd = StatsdClient(object=DummyObject())
+        tail.report(statsd)
+        assert_that(statsd.current, is_not(has_key('counter')))
+        assert_that(statsd.current['gauge']['amplify.agent.tail.lag_bytes'].last, equal_to(0))
+
+        tail.recovered_bytes = 100
+        tail.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.tail.recovered_bytes'][0][1], equal_to(100))
+        assert_that(tail.recovered_bytes, equal_to(0))
 
     def test_no_new_lines(self):
         # check one new line
@@ -110,3 +163,372 @@ class TailTestCase(BaseTestCase):
         # create new
         tail = FileTail(filename=self.test_log)
         assert_that(tail._offset, equal_to(old_offset))
+
+    def test_partial_line(self):
+        tail = FileTail(filename=self.test_log)
+
+        # an incomplete line is not returned until it gets a newline
+        with open(self.test_log, 'a') as f:
+            f.write('first line\nsecond ')
+        assert_that(tail.readlines(), equal_to(['first line']))
+        assert_that(tail.readlines(), has_length(0))
+
+        self.write_log('line')
+        assert_that(tail.readlines(), equal_to(['second line']))
+
+        # a new tail object starts from the incomplete line as well
+        with open(self.test_log, 'a') as f:
+            f.write('third ')
+        tail.readlines()
+        tail = FileTail(filename=self.test_log)
+        self.write_log('line')
+        assert_that(tail.readlines(), equal_to(['third line']))
+
+    def test_read_batch(self):
+        tail = FileTail(filename=self.test_log, chunk_size=16)
+        lines = ['this is %s line' % i for i in xrange(10)]
+        with open(self.test_log, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        assert_that(tail.read_batch(3), equal_to(lines[:3]))
+        assert_that(tail.read_batch(4), equal_to(lines[3:7]))
+
+        # offset points to the first unread line
+        assert_that(FileTail(filename=self.test_log).readlines(), equal_to(lines[7:]))
+
+        assert_that(tail.read_batch(100), equal_to(lines[7:]))
+        assert_that(tail.read_batch(100), has_length(0))
+
+    def test_iterate_small_chunks(self):
+        tail = FileTail(filename=self.test_log, chunk_size=7)
+        lines = ['', 'a' * 30, 'b', '', 'c' * 7, 'trailing spaces   ']
+        with open(self.test_log, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        assert_that([line for line in tail], equal_to([line.rstrip() for line in lines]))
+        assert_that([line for line in tail], has_length(0))
+
+
+class TailBudgetTestCase(LogFileTestCase):
+
+    def write_lines(self, count):
+        lines = ['this is %s line' % i for i in xrange(count)]
+        with open(self.test_log, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+        return lines
+
+    def test_line_budget(self):
+        tail = FileTail(filename=self.test_log, chunk_size=16, max_lines=4)
+        lines = self.write_lines(10)
+
+        # the rest is read during the next cycles
+        assert_that([line for line in tail], equal_to(lines[:4]))
+        assert_that(tail.behind, equal_to(True))
+        assert_that(tail.lag_bytes, equal_to(len('\n'.join(lines[4:]) + '\n')))
+
+        assert_that(tail.readlines(), equal_to(lines[4:8]))
+        assert_that(FileTail(filename=self.test_log).readlines(), equal_to(lines[8:]))
+
+        assert_that([line for line in tail], equal_to(lines[8:]))
+        assert_that(tail.behind, equal_to(False))
+        assert_that(tail.lag_bytes, equal_to(0))
+
+    def test_read_batch_budget(self):
+        tail = FileTail(filename=self.test_log, max_lines=5)
+        lines = self.write_lines(12)
+
+        assert_that(tail.read_batch(3), equal_to(lines[:3]))
+        assert_that(tail.read_batch(3), equal_to(lines[3:5]))
+        assert_that(tail.read_batch(3), has_length(0))
+        assert_that(tail.behind, equal_to(True))
+
+        # a new cycle starts after an empty batch
+        assert_that(tail.read_batch(), equal_to(lines[5:10]))
+
+    def test_report_max_lag(self):
+        behind = FileTail(filename=self.test_log, max_lines=4)
+        self.write_lines(10)
+        list(behind)
+        assert_that(behind.lag_bytes, greater_than(0))
+
+        with open(self.test_log_rotated, 'w') as f:
+            f.write('other log\n')
+        at_the_end = FileTail(filename=self.test_log_rotated)
+        at_the_end.readlines()  # offset of a new file is at its end already
+        assert_that(at_the_end.lag_bytes, equal_to(0))
+
+        # the lag of the log most behind is reported, not an average
+        statsd = StatsdClient(object=DummyObject())
+        behind.report(statsd)
+        at_the_end.report(statsd)
+        gauges = statsd.flush()['metrics']['gauge']
+        assert_that(gauges['G|amplify.agent.tail.lag_bytes'][0][1], equal_to(behind.lag_bytes))
+
+    def test_time_budget(self):
+        tail = FileTail(filename=self.test_log, max_time=1)
+        lines = self.write_lines(1000)
+
+        tail._start_cycle()
+        tail._cycle_deadline = time.time() - 1
+        assert_that(tail.read_batch(), has_length(0))
+        assert_that(tail.behind, equal_to(True))
+        assert_that(tail.lag_bytes, greater_than(0))
+
+        assert_that(tail.readlines(), equal_to(lines))
+        assert_that(tail.behind, equal_to(False))
+
+    def test_wait_when_behind(self):
+        tail = FileTail(filename=self.test_log, max_lines=1)
+        self.write_lines(2)
+        tail.readlines()
+
+        start_time = time.time()
+        tail.wait(10)
+        assert_that(time.time() - start_time, less_than(1))
+
+    def test_skip_ahead(self):
+        tail = FileTail(filename=self.test_log, max_lag=100)
+        lines = self.write_lines(100)
+
+        # unread lines are skipped, but not an incomplete line at the end
+        with open(self.test_log, 'a') as f:
+            f.write('incomplete ')
+        assert_that(tail.readlines(), has_length(0))
+        assert_that(tail.skipped_bytes, equal_to(len('\n'.join(lines) + '\n')))
+        self.write_log('line')
+        assert_that(tail.readlines(), equal_to(['incomplete line']))
+
+        statsd = StatsdClient(object=DummyObject())
+        tail.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.tail.skipped_bytes'][0][1], greater_than(0))
+        assert_that(tail.skipped_bytes, equal_to(0))
+
+        # lag below the threshold is read as usual
+        lines = self.write_lines(3)
+        assert_that(tail.readlines(), equal_to(lines))
+
+    def test_config(self):
+        context.app_config['tail']['max_lines'] = '10'
+        try:
+            tail = FileTail(filename=self.test_log)
+            assert_that(tail.max_lines, equal_to(10))
+            assert_that(tail.max_lag, none())
+        finally:
+            context.app_config['tail']['max_lines'] = None
+
+
+class SharedTailTestCase(LogFileTestCase):
+    test_link = 'log/something.link.log'
+
+    def teardown_method(self, method):
+        if os.path.exists(self.test_link):
+            os.remove(self.test_link)
+        super(SharedTailTestCase, self).teardown_method(method)
+
+    def test_one_reader(self):
+        os.link(self.test_log, self.test_link)
+        first = shared_tail(self.test_log)
+        second = shared_tail(self.test_link)
+        assert_that(second.reader, same_instance(first.reader))
+        assert_that(file_pipeline.SHARED_READERS, has_length(1))
+
+        # every subscriber gets every line
+        self.write_log('first')
+        self.write_log('second')
+        assert_that([line for line in first], equal_to(['first', 'second']))
+        self.write_log('third')
+        assert_that([line for line in first], equal_to(['third']))
+        assert_that(second.readlines(), equal_to(['first', 'second', 'third']))
+        assert_that(first.readlines(), has_length(0))
+
+        # the reader is closed with the last subscriber
+        first.stop()
+        assert_that(file_pipeline.SHARED_READERS, has_length(1))
+        second.stop()
+        assert_that(file_pipeline.SHARED_READERS, has_length(0))
+
+    def test_slow_subscriber(self):
+        fast = shared_tail(self.test_log)
+        slow = shared_tail(self.test_log)
+        fast.reader.max_buffer = 3
+
+        for i in xrange(5):
+            self.write_log('line %s' % i)
+        assert_that(fast.readlines(), has_length(5))
+        assert_that(fast.reader.lines, has_length(3))
+
+        # lines dropped from the buffer are skipped and counted
+        assert_that(slow.lag_bytes, equal_to(0))
+        assert_that(slow.readlines(), equal_to(['line 2', 'line 3', 'line 4']))
+        assert_that(slow.skipped_lines, equal_to(2))
+        assert_that(fast.reader.lines, has_length(0))
+
+        statsd = StatsdClient(object=DummyObject())
+        slow.report(statsd)
+        assert_that(statsd.current['counter']['amplify.agent.tail.skipped_lines'][0][1], equal_to(2))
+
+    def test_lag_and_wait(self):
+        fast = shared_tail(self.test_log)
+        slow = shared_tail(self.test_log)
+        self.write_log('line')
+        fast.readlines()
+
+        # the slow one has buffered lines, so it doesn't sleep
+        start_time = time.time()
+        slow.wait(10)
+        assert_that(time.time() - start_time, less_than(1))
+        assert_that(fast.reader.unread_bytes(slow), equal_to(len('line\n')))
+
+    def test_rotation(self):
+        first = shared_tail(self.test_log)
+        reader = first.reader
+        os.rename(self.test_log, self.test_log_rotated)
+        self.write_log('from a new file')
+        assert_that(first.readlines(), equal_to(['from a new file']))
+
+        # the reader is found by the new inode
+        second = shared_tail(self.test_log)
+        assert_that(second.reader, same_instance(reader))
+        assert_that(reader, instance_of(SharedFileReader))
+
+
+@pytest.mark.skipif(not inotify.available(), reason='inotify is available only on Linux')
+class InotifyTailTestCase(LogFileTestCase):
+
+    def test_wakeup_on_write(self):
+        tail = InotifyFileTail(filename=self.test_log, min_interval=0.1)
+        gevent.spawn_later(0.3, self.write_log, 'something')
+
+        start_time = time.time()
+        tail.wait(10)
+        assert_that(time.time() - start_time, less_than(5))
+        assert_that(tail.readlines(), equal_to(['something']))
+
+    def test_wakeup_after_rotation(self):
+        tail = InotifyFileTail(filename=self.test_log, min_interval=0.1)
+        os.rename(self.test_log, self.test_log_rotated)
+
+        gevent.spawn_later(0.3, self.write_log, 'from a new file')
+        start_time = time.time()
+        tail.wait(10)
+        assert_that(time.time() - start_time, less_than(5))
+        assert_that(tail.readlines(), equal_to(['from a new file']))
+
+    def test_timeout_and_other_files(self):
+        tail = InotifyFileTail(filename=self.test_log, min_interval=0.1)
+        gevent.spawn_later(0.1, os.system, 'echo other >> %s' % self.test_log_rotated)
+
+        start_time = time.time()
+        tail.wait(0.5)
+        assert_that(time.time() - start_time, greater_than_or_equal_to(0.45))
+        assert_that(tail.readlines(), has_length(0))
+
+    def test_shared_watches(self):
+        open(self.test_log_rotated, 'w').close()
+        first = InotifyFileTail(filename=self.test_log, min_interval=0.1)
+        second = InotifyFileTail(filename=self.test_log_rotated, min_interval=0.1)
+        watches = inotify.SHARED_WATCHES
+        assert_that(watches.directories, has_length(1))  # one watch for the directory of both files
+
+        gevent.spawn_later(0.3, os.system, 'echo other >> %s' % self.test_log_rotated)
+        start_time = time.time()
+        second.wait(10)
+        first.wait(0.5)
+        assert_that(time.time() - start_time, less_than(5))
+        assert_that(first.readlines(), has_length(0))
+        assert_that(second.readlines(), equal_to(['other']))
+
+        first.stop()
+        assert_that(watches.directories, has_length(1))
+        second.stop()
+        assert_that(watches.directories, has_length(0))
+        assert_that(inotify.SHARED_WATCHES, same_instance(watches))
+
+    def test_min_interval(self):
+        tail = InotifyFileTail(filename=self.test_log, min_interval=0.5)
+        self.write_log('something')
+        tail.wait(0)
+
+        # there is a new line already, but the previous wakeup was too recent
+        start_time = time.time()
+        self.write_log('something')
+        tail.wait(10)
+        assert_that(time.time() - start_time, greater_than_or_equal_to(0.45))
+
+
+class OffsetStoreTestCase(LogFileTestCase):
+    state_file = 'log/offsets'
+
+    def teardown_method(self, method):
+        for filename in (self.state_file, self.state_file + '.tmp'):
+            if os.path.exists(filename):
+                os.remove(filename)
+        super(OffsetStoreTestCase, self).teardown_method(method)
+
+    def restart(self, **kwargs):
+        """
+        Forgets offsets kept in memory, like an agent restart does
+        """
+        file_pipeline.OFFSET_CACHE.pop(self.test_log, None)
+        return OffsetStore(filename=self.state_file, **kwargs)
+
+    def test_save_and_load(self):
+        store = OffsetStore(filename=self.state_file)
+        store.update('/var/log/nginx/access.log', 2049, 12345, 100)
+        store.checkpoint()
+        store.update('/var/log/nginx/access.log', 2049, 12345, 200)
+        store.checkpoint()  # too early
+
+        store_copy = OffsetStore(filename=self.state_file)
+        assert_that(store_copy.get('/var/log/nginx/access.log', 2049, 12345, 1000), equal_to(100))
+        assert_that(os.path.exists(self.state_file + '.tmp'), equal_to(False))
+
+        store.checkpoint(force=True)
+        store = OffsetStore(filename=self.state_file)
+        assert_that(store.get('/var/log/nginx/access.log', 2049, 12345, 1000), equal_to(200))
+        assert_that(store.get('/var/log/nginx/access.log', 2049, 54321, 1000), equal_to(0))  # rotated
+        assert_that(store.get('/var/log/nginx/access.log', 2049, 12345, 150), equal_to(0))  # truncated
+        assert_that(store.get('/var/log/nginx/error.log', 2049, 12345, 1000), equal_to(None))
+
+    def test_broken_state_file(self):
+        with open(self.state_file, 'w') as f:
+            f.write('{not json')
+        assert_that(OffsetStore(filename=self.state_file).offsets, equal_to({}))
+
+    def test_resume_after_restart(self):
+        tail = FileTail(filename=self.test_log, offsets=self.restart())
+        self.write_log('before stop')
+        assert_that(tail.readlines(), equal_to(['before stop']))
+        tail.stop()
+        del tail
+
+        # lines written while the agent is down are read after the restart
+        self.write_log('while down')
+        tail = FileTail(filename=self.test_log, offsets=self.restart())
+        self.write_log('after start')
+        assert_that(tail.readlines(), equal_to(['while down', 'after start']))
+
+    def test_max_backlog(self):
+        tail = FileTail(filename=self.test_log, offsets=self.restart())
+        tail.readlines()
+        tail.stop()
+        del tail
+
+        for i in xrange(10):
+            self.write_log('line%s' % i)  # 6 bytes each
+
+        # the limit falls in the middle of a line, so reading starts from the next one
+        tail = FileTail(filename=self.test_log, offsets=self.restart(max_backlog=20))
+        assert_that(tail.readlines(), equal_to(['line7', 'line8', 'line9']))
+
+    def test_rotated_while_down(self):
+        tail = FileTail(filename=self.test_log, offsets=self.restart())
+        self.write_log('something')
+        tail.readlines()
+        tail.stop()
+        del tail
+
+        os.rename(self.test_log, self.test_log_rotated)
+        self.write_log('from a new file')
+        tail = FileTail(filename=self.test_log, offsets=self.restart())
+        assert_that(tail.readlines(), equal_to(['from a new file']))
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+
+from optparse import OptionParser, Option
+
+sys.path.append(os.getcwd())  # to make amplify libs available
+
+from amplify.agent.common.context import context
+context.setup(
+    app='agent',
+    config_file='etc/agent.conf.development',
+)
+
+from amplify.agent.collectors.nginx.accesslog import NginxAccessLogsCollector
+from amplify.agent.objects.nginx.log.access import NginxAccessLogParser
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+FORMATS = {
+    'combined': (
+        NginxAccessLogParser.combined_format,
+        '178.23.225.78 - - [18/Jun/2015:17:22:25 +0000] "GET /img/docker.png HTTP/1.1" 304 0 ' +
+        '"http://ec2-54-78-3-178.eu-west-1.compute.amazonaws.com:4000/" ' +
+        '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_4) AppleWebKit/537.36 (KHTML, like Gecko) ' +
+        'Chrome/43.0.2357.124 Safari/537.36"'
+    ),
+    'recommended': (
+        NginxAccessLogParser.combined_format + ' "$http_x_forwarded_for" rt=$request_time ua="$upstream_addr" ' +
+        'us="$upstream_status" ut="$upstream_response_time" cs=$upstream_cache_status',
+        '10.0.0.1 - - [03/Jul/2015:11:12:53 +0300] "GET /api/v1/objects/?limit=100 HTTP/1.1" 200 11901 ' +
+        '"https://example.com/dashboard" "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/47.0" "-" ' +
+        'rt=0.105 ua="10.0.1.10:8080, 10.0.1.11:8080" us="502, 200" ut="0.001, 0.100" cs=MISS'
+    ),
+    'upstream': (
+        '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" ' +
+        '"$http_user_agent" "$http_x_forwarded_for" $host $server_name $server_port $scheme $bytes_sent ' +
+        '$request_length rt=$request_time ua="$upstream_addr" us="$upstream_status" ' +
+        'ut="$upstream_response_time" uct="$upstream_connect_time" uht="$upstream_header_time" ' +
+        'ul="$upstream_response_length" cs=$upstream_cache_status $connection/$connection_requests "$gzip_ratio"',
+        '10.0.0.1 - - [03/Jul/2015:11:12:53 +0300] "GET /api/v1/objects/?limit=100 HTTP/1.1" 200 11901 ' +
+        '"https://example.com/dashboard" "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/47.0" "-" ' +
+        'example.com example.com 443 https 12283 512 rt=0.105 ua="10.0.1.10:8080, 10.0.1.11:8080" ' +
+        'us="502, 200" ut="0.001, 0.100" uct="0.000, 0.001" uht="0.001, 0.090" ul="11901" cs=MISS 62277/22 "2.51"'
+    ),
+    'json': (
+        '{"time_local": "$time_local","remote_addr": "$remote_addr",' +
+        '"remote_user": "$remote_user","request": "$request","status": "$status",' +
+        '"body_bytes_sent": "$body_bytes_sent","bytes_sent": "$bytes_sent",' +
+        '"request_length": "$request_length","request_time": "$request_time",' +
+        '"http_referer": "$http_referer","http_user_agent": "$http_user_agent",' +
+        '"http_x_forwarded_for": "$http_x_forwarded_for","http_host": "$http_host",' +
+        '"host": "$host","server_name": "$server_name","server_addr": "$server_addr",' +
+        '"server_port": "$server_port","scheme": "$scheme","args": "$args","uri": "$uri",' +
+        '"document_uri": "$document_uri","query_string": "$query_string",' +
+        '"content_type": "$content_type","content_length": "$content_length",' +
+        '"http_cookie": "$http_cookie","http_accept": "$http_accept",' +
+        '"http_accept_encoding": "$http_accept_encoding",' +
+        '"http_accept_language": "$http_accept_language","ssl_protocol": "$ssl_protocol",' +
+        '"ssl_cipher": "$ssl_cipher","ssl_session_reused": "$ssl_session_reused",' +
+        '"connection": "$connection","connection_requests": "$connection_requests",' +
+        '"pipe": "$pipe","upstream_addr": "$upstream_addr",' +
+        '"upstream_status": "$upstream_status",' +
+        '"upstream_response_time": "$upstream_response_time",' +
+        '"upstream_connect_time": "$upstream_connect_time",' +
+        '"upstream_header_time": "$upstream_header_time",' +
+        '"upstream_response_length": "$upstream_response_length",' +
+        '"upstream_cache_status": "$upstream_cache_status","gzip_ratio": "$gzip_ratio",' +
+        '"request_id": "$request_id","sent_http_content_type": "$sent_http_content_type"}',
+        '{"time_local": "03/Jul/2015:11:12:53 +0300","remote_addr": "10.0.0.1",' +
+        '"remote_user": "-","request": "GET /api/v1/objects/?limit=100 HTTP/1.1",' +
+        '"status": "200","body_bytes_sent": "11901","bytes_sent": "12283",' +
+        '"request_length": "512","request_time": "0.105",' +
+        '"http_referer": "https://example.com/dashboard",' +
+        '"http_user_agent": "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/47.0",' +
+        '"http_x_forwarded_for": "-","http_host": "example.com","host": "example.com",' +
+        '"server_name": "example.com","server_addr": "10.0.0.2","server_port": "443",' +
+        '"scheme": "https","args": "limit=100","uri": "/api/v1/objects/",' +
+        '"document_uri": "/api/v1/objects/","query_string": "limit=100",' +
+        '"content_type": "-","content_length": "-",' +
+        '"http_cookie": "session=0123456789abcdef; theme=dark",' +
+        '"http_accept": "application/json","http_accept_encoding": "gzip, deflate, br",' +
+        '"http_accept_language": "en-US,en;q=0.8","ssl_protocol": "TLSv1.2",' +
+        '"ssl_cipher": "ECDHE-RSA-AES128-GCM-SHA256","ssl_session_reused": "r",' +
+        '"connection": "62277","connection_requests": "22","pipe": ".",' +
+        '"upstream_addr": "10.0.1.10:8080","upstream_status": "200",' +
+        '"upstream_response_time": "0.100","upstream_connect_time": "0.001",' +
+        '"upstream_header_time": "0.090","upstream_response_length": "11901",' +
+        '"upstream_cache_status": "MISS","gzip_ratio": "2.51",' +
+        '"request_id": "4ad1c2b1e0f6a9e3d1f0c2b3a4d5e6f7",' +
+        '"sent_http_content_type": "application/json"}'
+    ),
+}
+
+
+class PrecomputedMatch(object):
+    """Regex stand-in that always returns the same match object"""
+
+    def __init__(self, match):
+        self.result = match
+
+    def match(self, line):
+        return self.result
+
+
+usage = "usage: %prog -h"
+
+option_list = (
+    Option(
+        '-n', '--lines',
+        action='store',
+        dest='lines',
+        type='int',
+        help='number of lines to parse per format (default: 20000)',
+        default=20000,
+    ),
+    Option(
+        '-f', '--format',
+        action='append',
+        dest='formats',
+        type='choice',
+        choices=sorted(FORMATS.keys()),
+        help='format to benchmark (can be repeated, default: all)',
+    ),
+    Option(
+        '--all-fields',
+        action='store_true',
+        dest='all_fields',
+        help='parse all variables instead of only those used by the access log collector',
+        default=False,
+    ),
+    Option(
+        '--no-tokenizer',
+        action='store_true',
+        dest='no_tokenizer',
+        help='always use regex, even for formats that have a tokenizer',
+        default=False,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+
+if __name__ == '__main__':
+    if options.all_fields:
+        fields = None
+    else:
+        fields = set()
+        for method_fields in NginxAccessLogsCollector.method_variables.itervalues():
+            fields.update(method_fields)
+
+    for name in options.formats or sorted(FORMATS.keys()):
+        log_format, line = FORMATS[name]
+        log_parser = NginxAccessLogParser(log_format, fields=fields)
+        if options.no_tokenizer:
+            log_parser.tokenizer = None
+        parse = log_parser.parse
+
+        # make sure that the sample line is actually parsable
+        assert log_parser.regex.match(line), 'sample line does not match "%s" format' % name
+
+        start_time = time.time()
+        for _ in xrange(options.lines):
+            parse(line)
+        parse_elapsed = time.time() - start_time
+
+        # same thing without the regex, to see the cost of converting matched values alone
+        log_parser.tokenizer = None
+        log_parser.regex = PrecomputedMatch(log_parser.regex.match(line))
+        start_time = time.time()
+        for _ in xrange(options.lines):
+            parse(line)
+        convert_elapsed = time.time() - start_time
+
+        print('%-12s %2d variables %-9s %10d lines/sec (without regex: %d lines/sec)' % (
+            name,
+            len(log_parser.keys),
+            'tokenizer' if log_parser.tokenizer_plan and not options.no_tokenizer else 'regex',
+            options.lines / parse_elapsed,
+            options.lines / convert_elapsed
+        ))
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import gc
+import os
+import resource
+import sys
+import time
+
+from optparse import OptionParser, Option
+
+sys.path.append(os.getcwd())  # to make amplify libs available
+
+from amplify.agent.common.context import context
+context.setup(
+    app='agent',
+    config_file='etc/agent.conf.development',
+)
+
+from amplify.agent.data.eventd import WARNING
+from amplify.agent.managers.bridge import Bridge
+from amplify.agent.objects.abstract import AbstractObject
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class RootObject(AbstractObject):
+    type = 'system'
+
+
+class BenchmarkObject(AbstractObject):
+    type = 'nginx'
+
+
+usage = "usage: %prog -h"
+
+option_list = (
+    Option(
+        '-o', '--objects',
+        action='store',
+        dest='objects',
+        type='int',
+        help='number of objects in the tree (default: 500)',
+        default=500,
+    ),
+    Option(
+        '-m', '--metrics',
+        action='store',
+        dest='metrics',
+        type='int',
+        help='number of samples per object between flushes (default: 2000)',
+        default=2000,
+    ),
+    Option(
+        '-r', '--runs',
+        action='store',
+        dest='runs',
+        type='int',
+        help='number of flushes (default: 10)',
+        default=10,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+
+def max_rss():
+    """
+    :return: int max resident set size of the process in KB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def populate(objects):
+    """
+    Fills data clients of every object the same way collectors do during one push interval
+    """
+    for obj in objects:
+        statsd = obj.statsd
+        for i in xrange(options.metrics):
+            statsd.incr('nginx.http.status.2xx')
+            statsd.incr('nginx.http.method.get')
+            statsd.timer('nginx.http.request.time', (i % 100) / 100.0)
+            statsd.average('nginx.http.request.length', i % 1000)
+            if i % 100 == 0:
+                statsd.gauge('nginx.http.conn.current', i)
+        obj.eventd.event(level=WARNING, message='benchmark event')
+        obj.metad.meta({'type': obj.type, 'root_uuid': None, 'extra': {'version': '1.11.5', 'workers': [1, 2]}})
+
+
+if __name__ == '__main__':
+    root = RootObject(data={})
+    context.objects.register(root)
+    objects = [root]
+    for _ in xrange(options.objects - 1):
+        obj = BenchmarkObject(data={})
+        context.objects.register(obj, parent_obj=root)
+        objects.append(obj)
+
+    # collect payloads without sending them
+    bridge = Bridge(interval=10 ** 9)
+    bridge.first_run = False
+    bridge.last_http_attempt = time.time()
+
+    populate(objects)
+    gc.collect()
+    rss_before = max_rss()
+
+    elapsed = []
+    for _ in xrange(options.runs):
+        populate(objects)
+        start_time = time.time()
+        bridge.flush_all()
+        elapsed.append(time.time() - start_time)
+        bridge._reset_payload()
+        gc.collect()
+
+    elapsed.sort()
+    print('%d objects, %d samples per object' % (options.objects, options.metrics))
+    print('flush_all: min %.3fs  median %.3fs  max %.3fs' % (
+        elapsed[0], elapsed[len(elapsed) / 2], elapsed[-1]
+    ))
+    print('max rss growth during flushes: %d KB' % (max_rss() - rss_before))
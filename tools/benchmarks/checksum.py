@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser, Option
+
+sys.path.insert(0, os.getcwd())  # to make amplify libs available
+
+from amplify.agent.common.context import context
+context.setup(
+    app='agent',
+    config_file='etc/agent.conf.development',
+)
+
+from amplify.agent.common.util.digest import FileDigests
+from amplify.agent.objects.nginx.config.config import NginxConfig
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+SERVER = """
+server {
+    listen 443 ssl;
+    server_name site%(i)s.example.com;
+    ssl_certificate %(folder)s/certs/%(i)s.pem;
+    ssl_certificate_key %(folder)s/certs/%(i)s.key;
+}
+"""
+
+usage = "usage: %prog -h"
+
+option_list = (
+    Option(
+        '-c', '--certificates',
+        action='store',
+        dest='certificates',
+        type='int',
+        help='number of certificates (default: 5000)',
+        default=5000,
+    ),
+    Option(
+        '-s', '--size',
+        action='store',
+        dest='size',
+        type='int',
+        help='size of a certificate in bytes, e.g. a chain (default: 65536)',
+        default=65536,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+
+def generate(folder):
+    """
+    Writes the main config with a server per certificate and the certificates
+
+    :return: str path of the main config
+    """
+    os.mkdir(folder + '/certs')
+    filename = folder + '/nginx.conf'
+    with open(filename, 'w') as f:
+        f.write('http {\n')
+        for i in xrange(options.certificates):
+            f.write(SERVER % dict(i=i, folder=folder))
+            with open('%s/certs/%s.pem' % (folder, i), 'w') as cert:
+                cert.write(os.urandom(options.size))
+        f.write('}\n')
+    return filename
+
+
+def run(name, config):
+    hits, misses = config.digests.hits, config.digests.misses
+
+    start_time = time.time()
+    checksum = config.checksum()
+    elapsed = time.time() - start_time
+
+    print('%-20s %8.2fs  %5d hashed  %5d cached' % (
+        name, elapsed, config.digests.misses - misses, config.digests.hits - hits
+    ))
+    return checksum
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    try:
+        config = NginxConfig(generate(folder))
+        config.full_parse()
+
+        # ssl analysis (openssl calls) is not measured, certificates are added as if it was done
+        config.ssl_certificates = dict((path, {}) for path in config.parser.ssl_certificates)
+        print('%d files, %d certificates, %.1f MB' % (
+            len(config.files), len(config.ssl_certificates), options.certificates * options.size / 1024.0 / 1024.0
+        ))
+
+        checksum = run('first', config)
+        assert run('unchanged', config) == checksum
+
+        with open('%s/certs/0.pem' % folder, 'a') as f:
+            f.write('renewed')
+        assert run('one changed', config) != checksum
+
+        config.digests = FileDigests()
+        run('without cache', config)
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser, Option
+
+import gevent
+
+sys.path.insert(0, os.getcwd())  # to make amplify and test libs available (stdlib has a "test" package too)
+
+from amplify.agent.common.context import context
+context.setup(
+    app='agent',
+    config_file='etc/agent.conf.development',
+)
+
+from amplify.agent.objects.nginx.config.config import NginxConfig
+from amplify.agent.objects.nginx.config.parser import NginxConfigParser
+from amplify.agent.objects.nginx.config.worker import NginxConfigWorker
+
+try:
+    from test.unit.agent.objects.nginx.config.pyparsing_grammar import PyparsingNginxConfigParser
+except ImportError:
+    PyparsingNginxConfigParser = None  # pyparsing is not installed
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+MAIN = """
+user nginx;
+worker_processes 4;
+
+events {
+    worker_connections 1024;
+}
+
+http {
+    log_format main '$remote_addr - $remote_user [$time_local] "$request" '
+                    '$status $body_bytes_sent "$http_referer" '
+                    '"$http_user_agent" "$http_x_forwarded_for" rt=$request_time';
+
+    map $http_upgrade $connection_upgrade {
+        default upgrade;
+        ''      close;
+    }
+
+    include %s/sites/*.conf;
+}
+"""
+
+SITE = """
+upstream backend%(i)s {
+    server 10.0.%(a)s.%(b)s:8080 max_fails=3;
+    server 10.0.%(a)s.%(c)s:8080 backup;
+    keepalive 16;
+}
+
+server {
+    listen 80;
+    listen 443 ssl;
+    server_name site%(i)s.example.com www.site%(i)s.example.com;
+    root /var/www/site%(i)s;
+
+    access_log /var/log/nginx/site%(i)s.access.log main;
+    error_log /var/log/nginx/site%(i)s.error.log;
+
+    add_header X-Frame-Options SAMEORIGIN;
+    add_header Content-Security-Policy "default-src 'self'; img-src *";
+
+    # static files
+    location ~* \\.(gif|jpg|jpeg|png|css|js)$ {
+        expires 30d;
+        try_files $uri =404;
+    }
+
+    location / {
+        if ($request_method = "OPTIONS") {
+            return 204;
+        }
+        set $cache_key "$scheme$host$request_uri";
+        rewrite ^/old/(.*)$ /new/$1 permanent;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection $connection_upgrade;
+        proxy_pass http://backend%(i)s;
+    }
+
+    location = /status {
+        stub_status on;
+        allow 127.0.0.1;
+        deny all;
+    }
+
+    error_page 500 502 503 504 /50x.html;
+}
+"""
+
+
+usage = "usage: %prog -h"
+
+option_list = (
+    Option(
+        '-f', '--files',
+        action='store',
+        dest='files',
+        type='int',
+        help='number of included files (default: 3000)',
+        default=3000,
+    ),
+    Option(
+        '-s', '--sites',
+        action='store',
+        dest='sites',
+        type='int',
+        help='number of servers per file (default: 3)',
+        default=3,
+    ),
+    Option(
+        '--no-pyparsing',
+        action='store_true',
+        dest='no_pyparsing',
+        help='do not run the pyparsing grammar for comparison',
+        default=False,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+
+def generate(folder):
+    """
+    Writes the main config and included files with servers
+
+    :return: str path of the main config, int size of all files in bytes
+    """
+    os.mkdir(folder + '/sites')
+    filename = folder + '/nginx.conf'
+    with open(filename, 'w') as f:
+        f.write(MAIN % folder)
+
+    size = os.path.getsize(filename)
+    for n in xrange(options.files):
+        site_filename = '%s/sites/%s.conf' % (folder, n)
+        with open(site_filename, 'w') as f:
+            for i in xrange(n * options.sites, (n + 1) * options.sites):
+                f.write(SITE % dict(i=i, a=i / 256 % 256, b=i % 256, c=(i + 1) % 256))
+        size += os.path.getsize(site_filename)
+
+    return filename, size
+
+
+def run(name, parser_cls, filename):
+    cfg = parser_cls(filename)
+
+    start_time = time.time()
+    cfg.parse()
+    elapsed = time.time() - start_time
+
+    print('%-20s %8.2fs  %8d index entries  %d errors' % (name, elapsed, len(cfg.index), len(cfg.errors)))
+    return cfg
+
+
+def run_in_loop(name, f):
+    """
+    Runs f in a greenlet while another one wakes up every 10 ms, like collectors do, and measures the longest pause
+    """
+    pauses = [0.0]
+
+    def tick():
+        last = time.time()
+        while True:
+            gevent.sleep(0.01)
+            now = time.time()
+            pauses.append(now - last - 0.01)
+            last = now
+
+    ticker = gevent.spawn(tick)
+    gevent.sleep(0.05)
+
+    start_time = time.time()
+    gevent.spawn(f).get()
+    elapsed = time.time() - start_time
+    gevent.sleep(0.05)  # let the ticker see the last pause
+    ticker.kill()
+
+    print('%-20s %8.2fs  max event loop pause %.3fs' % (name, elapsed, max(pauses)))
+
+
+if __name__ == '__main__':
+    context.check_and_limit_cpu_consumption = lambda: None  # measure parsing only
+
+    folder = tempfile.mkdtemp()
+    try:
+        filename, size = generate(folder)
+        print('%d files, %.1f MB' % (options.files + 1, size / 1024.0 / 1024.0))
+
+        # full parse of NginxConfig, as the collector runs it (goes first, while the heap has nothing else)
+        run_in_loop('inline', NginxConfig(filename).full_parse)
+        worker = NginxConfigWorker(NginxConfig(filename))
+        try:
+            run_in_loop('worker', worker.parse)
+            run_in_loop('worker, cached', worker.parse)
+        finally:
+            worker.stop()
+
+        cfg = run('scanner', NginxConfigParser, filename)
+
+        # change one file and parse again with the same parser (unchanged files come from its cache)
+        with open('%s/sites/0.conf' % folder, 'a') as f:
+            f.write(SITE % dict(i=-1, a=0, b=0, c=1))
+        start_time = time.time()
+        cfg.parse()
+        print('%-20s %8.2fs' % ('one file changed', time.time() - start_time))
+
+        if PyparsingNginxConfigParser is not None and not options.no_pyparsing:
+            reference = run('pyparsing', PyparsingNginxConfigParser, filename)
+            for attribute in ('tree', 'index', 'files', 'errors'):
+                assert getattr(cfg, attribute) == getattr(reference, attribute), 'different %s' % attribute
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import random
+import sys
+import time
+
+from optparse import OptionParser, Option
+
+sys.path.append(os.getcwd())  # to make amplify libs available
+
+from amplify.agent.objects.nginx.filters import Filter, FilterIndex
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# rules that look like the ones people set up in the UI, %s is replaced with the number of a rule
+RULES = (
+    [{'$request_method': 'POST'}, {'$request_uri': '/api/v%s/'}],
+    [{'$request_uri': '/static/%s/.*\.(png|jpg|gif)$'}],
+    [{'$status': '5..'}, {'$server_name': 'app%s.example.com'}],
+    [{'$request_uri': '/img/%s'}],
+    [{'$http_user_agent': '.*Bot%s.*'}],
+    [{'$status': '404'}, {'$request_uri': '.*\.php%s$'}],
+)
+
+LINES = [
+    {
+        'request_method': random.choice(('GET', 'GET', 'GET', 'POST', 'PUT')),
+        'request_uri': random.choice(('/api/v%s/objects/', '/static/%s/logo.png', '/img/%s', '/index.php%s')) % i,
+        'status': random.choice(('200', '200', '200', '304', '404', '502')),
+        'server_name': 'app%s.example.com' % (i % 20),
+        'http_user_agent': random.choice(('Mozilla/5.0 (X11; Linux x86_64)', 'Slackbot 1.0', 'Googlebot/2.1')),
+        'body_bytes_sent': i * 10,
+    }
+    for i in xrange(100)
+]
+
+
+usage = "usage: %prog -h"
+
+option_list = (
+    Option(
+        '-n', '--lines',
+        action='store',
+        dest='lines',
+        type='int',
+        help='number of lines to match (default: 20000)',
+        default=20000,
+    ),
+    Option(
+        '-f', '--filters',
+        action='append',
+        dest='filters',
+        type='int',
+        help='number of filters (can be repeated, default: 1, 10, 30, 60, 120)',
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+
+if __name__ == '__main__':
+    for count in options.filters or (1, 10, 30, 60, 120):
+        filters = []
+        for i in xrange(count):
+            rule = RULES[i % len(RULES)]
+            data = [dict((k, v.replace('%s', str(i % 20))) for k, v in condition.iteritems()) for condition in rule]
+            filters.append(Filter(filter_rule_id=i, metric='nginx.http.status.2xx', data=data))
+
+        lines = [LINES[i % len(LINES)] for i in xrange(options.lines)]
+
+        start_time = time.time()
+        for parsed in lines:
+            [log_filter for log_filter in filters if log_filter.match(parsed)]
+        loop_elapsed = time.time() - start_time
+
+        index = FilterIndex(filters)
+        start_time = time.time()
+        for parsed in lines:
+            index.matching(parsed)
+        index_elapsed = time.time() - start_time
+
+        # make sure that both ways give the same result
+        for parsed in LINES:
+            assert index.matching(parsed) == [log_filter for log_filter in filters if log_filter.match(parsed)]
+
+        print('%4d filters  Filter.match: %8d lines/sec  FilterIndex: %8d lines/sec' % (
+            count,
+            options.lines / loop_elapsed,
+            options.lines / index_elapsed
+        ))
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+
+from optparse import OptionParser, Option
+
+sys.path.append(os.getcwd())  # to make amplify libs available
+
+from amplify.agent.common.context import context
+context.setup(
+    app='agent',
+    config_file='etc/agent.conf.development',
+)
+
+from amplify.agent.common.util import tail as readline_tail
+from amplify.agent.pipelines import file as chunked_tail
+
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+LINE = '10.0.0.%s - - [03/Jul/2015:11:12:53 +0300] "GET /api/v1/objects/?limit=%s HTTP/1.1" 200 11901 ' + \
+       '"https://example.com/dashboard" "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/47.0" "-" ' + \
+       'rt=0.105 ua="10.0.1.10:8080" us="200" ut="0.100" cs=MISS\n'
+
+
+usage = "usage: %prog -h"
+
+option_list = (
+    Option(
+        '-s', '--size',
+        action='store',
+        dest='size',
+        type='int',
+        help='size of the synthetic log in MB (default: 2048)',
+        default=2048,
+    ),
+    Option(
+        '-f', '--filename',
+        action='store',
+        dest='filename',
+        type='string',
+        help='path of the synthetic log (default: /tmp/amplify-benchmark-tail.log)',
+        default='/tmp/amplify-benchmark-tail.log',
+    ),
+    Option(
+        '-b', '--batch',
+        action='store',
+        dest='batch',
+        type='int',
+        help='max lines for read_batch (default: 2000)',
+        default=2000,
+    ),
+    Option(
+        '--keep',
+        action='store_true',
+        dest='keep',
+        help='do not remove the log after the benchmark',
+        default=False,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+
+def generate():
+    size = options.size * 1024 * 1024
+    if os.path.exists(options.filename) and os.path.getsize(options.filename) >= size:
+        return
+
+    block = ''.join(LINE % (i % 256, i) for i in xrange(10000))
+    with open(options.filename, 'w') as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+
+def run(name, module, read):
+    module.OFFSET_CACHE[options.filename] = 0  # read the whole file
+    tail = module.FileTail(options.filename)
+
+    start_time = time.time()
+    count = read(tail)
+    elapsed = time.time() - start_time
+
+    print('%-28s %10d lines  %7.2fs  %9d lines/sec  %7.1f MB/sec' % (
+        name, count, elapsed, count / elapsed, options.size / elapsed
+    ))
+    return count
+
+
+def iterate(tail):
+    count = 0
+    for line in tail:
+        count += 1
+    return count
+
+
+def read_batches(tail):
+    count = 0
+    while True:
+        lines = tail.read_batch(options.batch)
+        if not lines:
+            return count
+        count += len(lines)
+
+
+if __name__ == '__main__':
+    generate()
+    try:
+        counts = [
+            run('readline (old FileTail)', readline_tail, iterate),
+            run('chunked, iterate', chunked_tail, iterate),
+            run('chunked, read_batch(%d)' % options.batch, chunked_tail, read_batches),
+        ]
+        assert len(set(counts)) == 1, 'different number of lines: %s' % counts
+    finally:
+        if not options.keep:
+            os.remove(options.filename)
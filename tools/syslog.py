@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-import asyncore
 import socket
+import time
 
 from optparse import OptionParser, Option
-from collections import deque
+
+import gevent
 
 sys.path.append(os.getcwd())  # to make amplify libs available
 
@@ -16,7 +17,7 @@ context.setup(
     config_file='etc/agent.conf.development',
 )
 
-from amplify.agent.pipelines.syslog import SyslogServer
+from amplify.agent.pipelines.syslog import SyslogTail
 
 
 __author__ = "Grant Hulegaard"
@@ -30,25 +31,23 @@ __email__ = "grant.hulegaard@nginx.com"
 # HELPERS
 
 
-cache = deque(maxlen=10000)
-
+TEMPLATE = '<190>Jul  3 11:12:53 host %s: 10.0.0.1 - - [03/Jul/2015:11:12:53 +0300] ' + \
+           '"GET /api/v1/objects/?limit=%s HTTP/1.1" 200 11901 "-" "Mozilla/5.0" rt=0.105'
 
-class UDPClient(asyncore.dispatcher):
-    """Sends datagrams to a socket"""
 
-    def __init__(self, address):
-        self.counter = 0
-        self.template = "This is message #%s"
-        asyncore.dispatcher.__init__(self)
+def tag(i):
+    return 'amplify%s' % (i % options.tags if options.tags > 1 else '')
 
-        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)  # asyncore socket wrapper
-        self.connect(address)
 
-    def handle_write(self):
-        self.counter += 1
-        message = self.template % self.counter
-        self.send(message)
-        context.log.debug('Sent %s' % message)
+def generate(address, count):
+    """
+    Sends datagrams to a socket as fast as possible (runs in a child process)
+    """
+    family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+    client = socket.socket(family, socket.SOCK_DGRAM)
+    for i in xrange(count):
+        client.sendto(TEMPLATE % (tag(i), i), address)
+    client.close()
 
 
 # SCRIPT
@@ -72,6 +71,38 @@ option_list = (
         help='socket port',
         default='514'
     ),
+    Option(
+        '-u', '--unix',
+        action='store',
+        dest='unix',
+        type='string',
+        help='path of a unix socket to use instead of UDP',
+        default=None
+    ),
+    Option(
+        '-t', '--tags',
+        action='store',
+        dest='tags',
+        type='int',
+        help='number of syslog tags (logs) sharing the socket (default: 1)',
+        default=1
+    ),
+    Option(
+        '-c', '--count',
+        action='store',
+        dest='count',
+        type='int',
+        help='number of messages to send (default: 200000)',
+        default=200000
+    ),
+    Option(
+        '-i', '--interval',
+        action='store',
+        dest='interval',
+        type='float',
+        help='seconds between collector reads of the syslog cache (default: 1.0)',
+        default=1.0
+    ),
 )
 
 parser = OptionParser(usage, option_list=option_list)
@@ -79,10 +110,35 @@ parser = OptionParser(usage, option_list=option_list)
 
 
 if __name__ == '__main__':
-    address = (options.address, options.port)
-    server = SyslogServer(cache, address)
-    client = UDPClient(address)
-
+    address = options.unix or (options.address, options.port)
+    tails = [SyslogTail(address=address, tag=tag(i), interval=1.0) for i in xrange(options.tags)]
+    server = tails[0].listener.server
+    gevent.sleep(0.1)
+
+    start_time = time.time()
+    pid = os.fork()
+    if pid == 0:
+        generate(address, options.count)
+        os._exit(0)
+
+    # read the cache like a collector does until the generator is done and nothing comes for a while
+    collected, last_received, generator_done = 0, 0, False
     while True:
-        context.log.debug('Main event loop; cache length: %s' % len(cache))
-        asyncore.loop(timeout=1, count=100)
+        gevent.sleep(options.interval)
+        for tail in tails:
+            collected += len([line for line in tail])
+
+        if not generator_done:
+            generator_done = os.waitpid(pid, os.WNOHANG)[0] != 0
+        elif server.received == last_received:
+            break
+        last_received = server.received
+
+    elapsed = time.time() - start_time - options.interval
+    print('sent:             %d' % options.count)
+    print('received:         %d (%.0f messages/sec)' % (server.received, server.received / elapsed))
+    print('collected:        %d' % collected)
+    print('dropped by cache: %d' % sum(tail.queue.dropped for tail in tails))
+    print('dropped by kernel: %s' % server.kernel_drops())
+    for tail in tails:
+        tail.stop()